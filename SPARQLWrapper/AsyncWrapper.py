@@ -0,0 +1,786 @@
+# -*- coding: utf-8 -*-
+
+"""
+Asyncio client for SPARQL endpoints.
+
+L{AsyncSPARQLWrapper} has the same configuration surface as L{SPARQLWrapper<SPARQLWrapper.Wrapper.SPARQLWrapper>}
+(it is a subclass of it, and the requests are built by the very same methods), but the queries are sent over
+C{asyncio} streams, so thousands of them can be in flight at once without blocking a thread each::
+
+ import asyncio
+ from SPARQLWrapper import AsyncSPARQLWrapper, JSON
+
+ sparql = AsyncSPARQLWrapper("http://example.org/sparql", returnFormat=JSON)
+ queries = ["SELECT ?label WHERE { <%s> rdfs:label ?label }" % uri for uri in uris]
+ results = asyncio.get_event_loop().run_until_complete(sparql.gather(queries, concurrency=50))
+
+As the C{async}/C{await} syntax is used, this module is only available with Python 3.5 or later.
+
+@authors: U{Ivan Herman<http://www.ivan-herman.net>}, U{Sergio Fernández<http://www.wikier.org>}, U{Carlos Tejo Alonso<http://www.dayures.net>}
+@organization: U{World Wide Web Consortium<http://www.w3.org>} and U{Foundation CTIC<http://www.fundacionctic.org/>}.
+@license: U{W3C® SOFTWARE NOTICE AND LICENSE<href="http://www.w3.org/Consortium/Legal/copyright-software">}
+@since: 1.8.3
+"""
+
+import asyncio
+import socket
+import ssl
+import time
+import urllib2
+from io import BytesIO
+from urlparse import urlsplit, urljoin
+
+import httplib
+
+from Wrapper import SPARQLWrapper, QueryResult, QuerySpec, DIGEST, POST, JSON, _boundByDeadline, _withServerQueryId
+from SPARQLExceptions import CircuitBreakerOpen, DeadlineExceeded, QueryCancelled, LimitExceeded
+from Compression import decodeBody
+from CircuitBreaker import getCircuitBreaker
+from Deadline import DeadlineResponse, isTimeout
+from Cancellation import CancellableResponse
+from Limiter import getLimiter
+from Batching import LookupBatch, termKey
+from Transport import BufferedResponse
+from KeyCaseInsensitiveDict import KeyCaseInsensitiveDict
+
+_REDIRECT_CODES = [301, 302, 303, 307, 308]
+_MAX_REDIRECTIONS = 10
+
+
+class AsyncSPARQLWrapper(SPARQLWrapper):
+    """
+    Asyncio version of L{SPARQLWrapper<SPARQLWrapper.Wrapper.SPARQLWrapper>}. The setters are inherited, while
+    L{query}, L{queryAndConvert} and L{execute} are coroutines returning L{AsyncQueryResult} instances, whose
+    L{convert<AsyncQueryResult.convert>} method is a coroutine too.
+
+    Persistent connections are always used: up to L{maxConnections} idle connections are kept per host. Note that
+    the connections belong to the event loop that opened them, so an instance must not be used by several loops.
+
+    The L{cache<SPARQLWrapper.Wrapper.SPARQLWrapper.setCache>} and the
+    L{coalescing group<SPARQLWrapper.Wrapper.SPARQLWrapper.setCoalescingGroup>} are shared with the other wrappers
+    (synchronous or not): as they may block, the queries using them wait for them in a thread of the default executor
+    of the loop, while their requests are still sent by the loop.
+
+    @ivar maxConnections: Maximum number of idle connections kept per host. Default is C{10}.
+    @type maxConnections: int
+    """
+
+    maxConnections = 10
+
+    def __init__(self, *args, **kwargs):
+        super(AsyncSPARQLWrapper, self).__init__(*args, **kwargs)
+        self._connections = {}  # (scheme, netloc) -> list of idle (reader, writer)
+        self._loop = None  # the loop sending the requests of the cached and coalesced queries
+
+    def _usesGlobalOpener(self):
+        return False
+
+    async def query(self):
+        """
+            Execute the query (see L{SPARQLWrapper.query<SPARQLWrapper.Wrapper.SPARQLWrapper.query>}).
+            @return: query result
+            @rtype: L{AsyncQueryResult} instance
+        """
+        return await self.execute(self._getQuerySpec())
+
+    async def queryAndConvert(self):
+        """Macro like method: issue a query and return the converted results.
+        @return: the converted query result. See the conversion methods for more details.
+        """
+        res = await self.query()
+        return await res.convert()
+
+    async def execute(self, spec):
+        """
+            Execute a query prepared with L{prepare<SPARQLWrapper.Wrapper.SPARQLWrapper.prepare>}. The coroutine
+            returns as soon as the response headers are received; the body is read by the result. The failed
+            requests are retried according to the retry policy (see
+            L{setRetryPolicy<SPARQLWrapper.Wrapper.SPARQLWrapper.setRetryPolicy>}), within the deadline of the
+            query, if any (see L{setDeadline<SPARQLWrapper.Wrapper.SPARQLWrapper.setDeadline>}). The query can be
+            cancelled from another thread with its cancellation token, if any (see
+            L{setCancellationToken<SPARQLWrapper.Wrapper.SPARQLWrapper.setCancellationToken>}). The results are
+            cached and the identical queries coalesced as for the synchronous wrapper (see
+            L{SPARQLWrapper._query<SPARQLWrapper.Wrapper.SPARQLWrapper._query>}), and an update removes the results it
+            may modify from the cache.
+            @param spec: The request specification.
+            @type spec: L{QuerySpec<SPARQLWrapper.Wrapper.QuerySpec>}
+            @return: query result
+            @rtype: L{AsyncQueryResult} instance
+            @raise QueryBadFormed: If the C{HTTP return code} is C{400}.
+            @raise Unauthorized: If the C{HTTP return code} is C{401}.
+            @raise EndPointNotFound: If the C{HTTP return code} is C{404}.
+            @raise URITooLong: If the C{HTTP return code} is C{414}.
+            @raise EndPointInternalError: If the C{HTTP return code} is C{500}.
+            @raise CircuitBreakerOpen: If the circuit breaker of the endpoint is used and open.
+            @raise DeadlineExceeded: If the deadline of the query is exceeded.
+            @raise QueryCancelled: If the query is cancelled.
+        """
+        hedged = self.hedgingPolicy is not None and spec.isSparqlQueryRequest()
+        expires = time.time() + spec.deadline if spec.deadline else None
+        token = spec.cancellationToken
+        shared = (self.cache is not None or self.coalescingGroup is not None) and spec.isSparqlQueryRequest()
+        if shared:
+            identity = self._getRequestIdentity(spec)
+        tried = []
+        keys = []
+        if token is not None:
+            token.raiseIfCancelled()
+            spec, queryId = _withServerQueryId(spec)
+            if queryId is not None:
+                keys.append(token.register(lambda: self._cancelOnServer(spec, queryId, tried)))
+        try:
+            if shared:
+                result = await _cancellable(self._executeShared(spec, identity, hedged, expires, tried), token)
+            else:
+                result = await _cancellable(self._executeWithRetries(spec, hedged, expires, tried), token)
+        except BaseException:
+            for key in keys:
+                token.unregister(key)
+            raise
+        finally:
+            if self.cache is not None and spec.isSparqlUpdateRequest():
+                self._invalidateCache(spec)
+        if expires is not None:
+            result.response = DeadlineResponse(result.response, expires)
+        if token is not None:
+            result.response = CancellableResponse(result.response, token, keys)
+        result.expires = expires
+        result.cancellationToken = token
+        return result
+
+    async def _executeShared(self, spec, identity, hedged, expires, tried):
+        """
+        Internal method to get the whole response of a query from the cache, or else to send the request (within the
+        coalescing group, if any) and to cache its response (see
+        L{SPARQLWrapper._sharedQuery<SPARQLWrapper.Wrapper.SPARQLWrapper._sharedQuery>}). The cache and the
+        coalescing group are waited for in a thread of the default executor of the loop, and the request is sent by
+        the loop (see L{_bufferedQuery}).
+        @rtype: L{AsyncQueryResult}
+        """
+        self._loop = asyncio.get_event_loop()
+        buffered, returnFormat = await self._loop.run_in_executor(None, self._sharedQuery, spec, identity, hedged,
+                                                                  expires, tried)
+        return AsyncQueryResult((_LoadedResponse(*buffered), returnFormat))
+
+    def _bufferedQuery(self, spec, hedged, expires, tried):
+        """
+        Internal method to send the request of a cached or coalesced query and read the whole response (see
+        L{SPARQLWrapper._bufferedQuery<SPARQLWrapper.Wrapper.SPARQLWrapper._bufferedQuery>}). It is called by the
+        thread waiting for the cache (see L{_executeShared}), or refreshing it in the background, and the request is
+        sent by the loop of the wrapper.
+        @return: a tuple with the arguments of a L{BufferedResponse<SPARQLWrapper.Transport.BufferedResponse>}
+        holding the response, plus the expected format.
+        @rtype: tuple
+        """
+        return asyncio.run_coroutine_threadsafe(self._bufferedExecute(spec, hedged, expires, tried), self._loop).result()
+
+    async def _bufferedExecute(self, spec, hedged, expires, tried):
+        """
+        Internal method to send the request (see L{_executeWithRetries}) and read the whole response, within the
+        deadline of the query (if any) and unless it is cancelled.
+        @rtype: tuple
+        """
+        token = spec.cancellationToken
+        result = await _cancellable(self._executeWithRetries(spec, hedged, expires, tried), token)
+        response = result.response
+        load = response.load()
+        if expires is not None:
+            load = asyncio.wait_for(load, max(0, expires - time.time()))
+        try:
+            body = await _cancellable(load, token)
+        except asyncio.TimeoutError:
+            raise DeadlineExceeded()
+        headers = KeyCaseInsensitiveDict(dict(response.info().items()))
+        return (body, headers, response.geturl(), response.code), result.requestedFormat
+
+    async def _executeWithRetries(self, spec, hedged, expires, tried):
+        """
+        Internal method to send the request, retrying the failed attempts according to the retry policy (see
+        L{SPARQLWrapper._queryWithRetries<SPARQLWrapper.Wrapper.SPARQLWrapper._queryWithRetries>}).
+        @rtype: L{AsyncQueryResult}
+        """
+        attempt = 0
+        while True:
+            attempt += 1
+            attemptSpec = _boundByDeadline(spec, expires)
+            try:
+                if hedged:
+                    result = await self._hedgedExecuteAttempt(attemptSpec, tried)
+                else:
+                    result = await self._executeAttempt(attemptSpec, tried)
+            except Exception as e:
+                if expires is not None and (isTimeout(e) or isinstance(e, asyncio.TimeoutError)) and \
+                        time.time() >= expires:
+                    raise DeadlineExceeded()
+                delay = self._getRetryDelay(spec, e, attempt)
+                if delay is not None and expires is not None and time.time() + delay >= expires:
+                    delay = None  # the retry could not complete in time
+                if delay is None:
+                    if isinstance(e, urllib2.HTTPError):
+                        self._raiseHTTPError(e)
+                    raise
+                await asyncio.sleep(delay)
+                continue
+            return result
+
+    async def _executeAttempt(self, spec, tried):
+        """
+        Internal method to send the request once (see
+        L{SPARQLWrapper._queryAttempt<SPARQLWrapper.Wrapper.SPARQLWrapper._queryAttempt>}).
+        @rtype: L{AsyncQueryResult}
+        @raise urllib2.HTTPError: If the C{HTTP return code} is C{4XX} or C{5XX}.
+        @raise CircuitBreakerOpen: If the circuit breaker of the endpoint is open.
+        @raise LimitExceeded: If the limiter of the endpoint does not let the request through in time.
+        """
+        replica = None
+        if self.replicaSet is not None and spec.isSparqlQueryRequest():
+            replica = self.replicaSet.acquire(tried)
+            tried.append(replica)
+            spec = spec._replace(endpoint=replica.url)
+        request = self._createRequest(spec)
+
+        uri = spec.updateEndpoint if spec.isSparqlUpdateRequest() else spec.endpoint
+        breaker = None
+        if self.useCircuitBreaker:
+            breaker = getCircuitBreaker(uri)
+            try:
+                breaker.allowRequest()
+            except CircuitBreakerOpen as e:
+                self._recordOutcome(None, replica, 0, e)
+                raise
+
+        limiter = getLimiter(uri)
+        if limiter is not None:
+            try:
+                await _acquire(limiter, spec.deadline)
+            except BaseException:  # not let through in time, or cancelled while waiting
+                self._recordOutcome(breaker, replica, None)
+                raise
+
+        start = time.time()
+        try:
+            if spec.timeout:
+                response = await asyncio.wait_for(self._urlopen(request, spec), spec.timeout)
+            else:
+                response = await self._urlopen(request, spec)
+            if response.code >= 400:
+                await response.load()
+                raise urllib2.HTTPError(response.geturl(), response.code, response.msg, response.info(), response)
+        except asyncio.CancelledError:
+            self._recordOutcome(breaker, replica, None, limiter=limiter)
+            raise
+        except Exception as e:
+            self._recordOutcome(breaker, replica, time.time() - start, e, limiter)
+            if isinstance(e, urllib2.HTTPError) and self._isAutoGetRejected(spec, request, e):
+                return await self._executeAttempt(spec._replace(method=POST), tried)
+            raise
+        self._recordOutcome(breaker, replica, time.time() - start, limiter=limiter)
+        return AsyncQueryResult((response, spec.returnFormat))
+
+    async def _hedgedExecuteAttempt(self, spec, tried):
+        """
+        Internal method to send the query once, hedged according to the hedging policy (see
+        L{SPARQLWrapper._hedgedQueryAttempt<SPARQLWrapper.Wrapper.SPARQLWrapper._hedgedQueryAttempt>}). The request
+        that has not answered first is cancelled.
+        @rtype: L{AsyncQueryResult}
+        """
+        policy = self.hedgingPolicy
+
+        async def attempt():
+            start = time.time()
+            result = await self._executeAttempt(spec, tried)
+            policy.record(time.time() - start)
+            return result
+
+        delay = policy.startRequest()
+        tasks = [asyncio.ensure_future(attempt())]
+        done, _ = await asyncio.wait(tasks, timeout=delay)
+        if not done and policy.allowHedge():
+            tasks.append(asyncio.ensure_future(attempt()))
+        pending = set(tasks)
+        try:
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                succeeded = [task for task in tasks if task in done and task.exception() is None]
+                if succeeded:
+                    for task in succeeded[1:]:
+                        task.result().response.close()
+                    if succeeded[0] is not tasks[0]:
+                        policy.recordHedgeWin()
+                    return succeeded[0].result()
+            return done.pop().result()  # all the requests failed
+        finally:
+            for task in pending:
+                task.cancel()
+
+    async def gather(self, queries, concurrency=10, convert=True, return_exceptions=False):
+        """
+            Execute several queries concurrently, with at most C{concurrency} of them in flight at once.
+            @param queries: the queries, either query strings or L{QuerySpec<SPARQLWrapper.Wrapper.QuerySpec>} instances.
+            @type queries: iterable
+            @param concurrency: Maximum number of concurrent requests.
+            @type concurrency: int
+            @param convert: If C{True} (the default), the converted results are returned; otherwise the
+            L{AsyncQueryResult} instances (with the body already read).
+            @type convert: bool
+            @param return_exceptions: If C{True}, the exceptions are returned in place of the results of the failed
+            queries, instead of being raised (as C{asyncio.gather} does).
+            @type return_exceptions: bool
+            @return: the results, in the same order as the queries.
+            @rtype: list
+        """
+        semaphore = asyncio.Semaphore(concurrency)
+
+        async def run(query):
+            spec = query if isinstance(query, QuerySpec) else self.prepare(query)
+            async with semaphore:
+                result = await self.execute(spec)
+                if convert:
+                    return await result.convert()
+                await result.response.load()
+                return result
+
+        return await asyncio.gather(*[run(query) for query in queries], return_exceptions=return_exceptions)
+
+    async def queryBatch(self, query, bindings, maxRows=500, maxLength=65536, concurrency=10):
+        """
+            Execute a lookup query for many bindings of some of its variables, in a few requests sent concurrently
+            (see L{SPARQLWrapper.queryBatch<SPARQLWrapper.Wrapper.SPARQLWrapper.queryBatch>}).
+            @param query: the C{SELECT} query, either a query string or a
+            L{QuerySpec<SPARQLWrapper.Wrapper.QuerySpec>}. It must project the variables of the bindings.
+            @param bindings: the values of the variables for each lookup, as dictionaries of values by name, all with
+            the same names.
+            @type bindings: iterable
+            @param maxRows: Maximum number of bindings sent in a request.
+            @type maxRows: int
+            @param maxLength: Maximum length of the query of a request, once URL encoded.
+            @type maxLength: int
+            @param concurrency: Maximum number of concurrent requests.
+            @type concurrency: int
+            @return: the rows of the results of each lookup, in the order of the bindings.
+            @rtype: list of list of dict
+            @raise ValueError: If the query is not a C{SELECT} query, or the bindings do not have the same names.
+        """
+        spec = query if isinstance(query, QuerySpec) else self.prepare(query)
+        batch = LookupBatch(spec.queryString, list(bindings), maxRows, maxLength)
+        specs = [spec._replace(queryString=batchQuery, returnFormat=JSON) for batchQuery in batch.queries]
+        for result in await self.gather(specs, concurrency):
+            batch.addResults(result["results"]["bindings"])
+        return batch.getResults()
+
+    async def close(self):
+        """Close all the idle connections."""
+        connections, self._connections = self._connections, {}
+        for idle in connections.values():
+            for _, writer in idle:
+                writer.close()
+
+    async def _urlopen(self, request, spec):
+        """
+        Internal method for sending a request, following redirections and answering a L{DIGEST} challenge.
+        @rtype: L{AsyncResponse}
+        """
+        for _ in range(_MAX_REDIRECTIONS + 1):
+            response = await self._send(request, spec.connectTimeout)
+            location = response.info().get("location")
+            if response.code in _REDIRECT_CODES and location:
+                await response.load()
+                newurl = urljoin(request.get_full_url(), location)
+                request = urllib2.HTTPRedirectHandler().redirect_request(request, response, response.code,
+                                                                        response.msg, response.info(), newurl)
+                if request is None:
+                    break
+                continue
+            if response.code == 401 and spec.http_auth == DIGEST and spec.user and spec.passwd and \
+                    not request.has_header("Authorization"):
+                await response.load()
+                uri = spec.updateEndpoint if spec.isSparqlUpdateRequest() else spec.endpoint
+                handler = urllib2.HTTPDigestAuthHandler(self._getPasswordManager(uri, spec))
+                handler.parent = _RequestCapturingOpener()
+                request.timeout = spec.timeout
+                authorized = handler.http_error_401(request, response, response.code, response.msg, response.info())
+                if authorized is not None:
+                    request = authorized
+                    continue
+            return response
+        return response
+
+    async def _send(self, request, connectTimeout=None):
+        """
+        Internal method for sending a single request over a (possibly reused) connection.
+        @param connectTimeout: Timeout (in seconds) for opening a new connection, if any.
+        @type connectTimeout: float
+        @rtype: L{AsyncResponse}
+        """
+        url = request.get_full_url()
+        scheme, netloc, path, query, _ = urlsplit(url)
+        if scheme not in ["http", "https"]:
+            raise urllib2.URLError("unsupported URL scheme '%s'" % scheme)
+        key = (scheme, netloc)
+        parts = urlsplit(url)
+        selector = (path or "/") + ("?" + query if query else "")
+        headers = dict(request.header_items())
+        headers.setdefault("Host", netloc)
+        if request.data is not None:
+            headers["Content-Length"] = str(len(request.data))
+        lines = ["%s %s HTTP/1.1" % (request.get_method(), selector)] + ["%s: %s" % h for h in headers.items()]
+        message = ("\r\n".join(lines) + "\r\n\r\n").encode("latin-1") + (request.data or b"")
+
+        while True:
+            (reader, writer), reused = await self._getConnection(key, parts.hostname, parts.port, connectTimeout)
+            try:
+                writer.write(message)
+                await writer.drain()
+                return await AsyncResponse.begin(self, key, reader, writer, url, request.get_method())
+            except (ConnectionError, asyncio.IncompleteReadError, httplib.BadStatusLine) as e:
+                writer.close()
+                if not reused:
+                    raise urllib2.URLError(e)
+            except BaseException:  # eg, cancelled (a timeout, or a hedged request that has not answered first)
+                writer.close()
+                raise
+
+    async def _getConnection(self, key, host, port, connectTimeout=None):
+        """
+        Internal method for getting an idle connection to a host, or opening a new one.
+        @return: a tuple with the C{(reader, writer)} pair and a boolean indicating whether it has been reused.
+        @rtype: tuple
+        """
+        idle = self._connections.get(key, [])
+        while idle:
+            reader, writer = idle.pop()
+            if not reader.at_eof() and not writer.transport.is_closing():
+                return (reader, writer), True
+            writer.close()
+        https = key[0] == "https"
+        try:
+            connection = await asyncio.wait_for(
+                asyncio.open_connection(host, port or (443 if https else 80),
+                                        ssl=ssl.create_default_context() if https else None), connectTimeout)
+        except asyncio.TimeoutError:
+            raise urllib2.URLError(socket.timeout("timed out while connecting"))
+        except OSError as e:
+            raise urllib2.URLError(e)
+        return connection, False
+
+    def _releaseConnection(self, key, reader, writer, reusable):
+        """Internal method for keeping a connection once a response has been read, or closing it."""
+        idle = self._connections.setdefault(key, [])
+        if reusable and len(idle) < self.maxConnections:
+            idle.append((reader, writer))
+        else:
+            writer.close()
+
+
+class _RequestCapturingOpener(object):
+    """Internal opener for the C{urllib2} authentication handlers, returning the authorized request instead of
+    sending it (as it must be sent asynchronously)."""
+
+    def open(self, request, data=None, timeout=None):
+        return request
+
+
+class AsyncResponse(object):
+    """
+    Response of an L{AsyncSPARQLWrapper}. The status and the headers are available once the instance is created;
+    the body is read by the L{load} coroutine, after which the instance behaves as a file-like object (like the
+    responses of C{urllib2.urlopen}).
+
+    @ivar code: HTTP status code.
+    @type code: int
+    @ivar msg: HTTP reason phrase.
+    @type msg: string
+    @ivar url: URL of the request.
+    @type url: string
+    @ivar headers: HTTP response headers.
+    """
+
+    def __init__(self, wrapper, key, reader, writer, url, code, msg, headers, keepAlive, method):
+        self._wrapper = wrapper
+        self._key = key
+        self._reader = reader
+        self._writer = writer
+        self._keepAlive = keepAlive
+        self._method = method
+        self._body = None
+        self._loop = asyncio.get_event_loop()
+        self.url = url
+        self.code = code
+        self.msg = msg
+        self.headers = headers
+
+    @classmethod
+    async def begin(cls, wrapper, key, reader, writer, url, method):
+        """Read the status line and the headers of a response."""
+        while True:
+            line = await reader.readline()
+            if not line:
+                raise httplib.BadStatusLine("")
+            version, _, status = line.decode("latin-1").strip().partition(" ")
+            code, _, msg = status.partition(" ")
+            if not version.startswith("HTTP/") or not code.isdigit():
+                raise httplib.BadStatusLine(line)
+            headerLines = []
+            while True:
+                headerLine = await reader.readline()
+                if headerLine in [b"\r\n", b"\n", b""]:
+                    break
+                headerLines.append(headerLine)
+            if int(code) != 100:
+                break
+        headers = httplib.parse_headers(BytesIO(b"".join(headerLines) + b"\r\n"))
+        connection = (headers.get("connection") or "").lower()
+        keepAlive = connection != "close" if version == "HTTP/1.1" else connection == "keep-alive"
+        return cls(wrapper, key, reader, writer, url, int(code), msg, headers, keepAlive, method)
+
+    async def load(self):
+        """Read the whole body (once), decompressing it if needed, and give the connection back.
+        @return: the body
+        @rtype: bytes
+        """
+        if self._body is None:
+            try:
+                body = await self._readBody()
+            except BaseException:
+                self._writer.close()
+                raise
+            self._wrapper._releaseConnection(self._key, self._reader, self._writer, self._keepAlive)
+            self._body = BytesIO(decodeBody(body, self.headers))
+        return self._body.getvalue()
+
+    async def _readBody(self):
+        if self._method == "HEAD" or self.code in [204, 304]:
+            return b""
+        if (self.headers.get("transfer-encoding") or "").lower() == "chunked":
+            chunks = []
+            while True:
+                size = int((await self._reader.readline()).split(b";")[0].strip(), 16)
+                if size == 0:
+                    while (await self._reader.readline()) not in [b"\r\n", b"\n", b""]:
+                        pass  # trailers
+                    return b"".join(chunks)
+                chunks.append(await self._reader.readexactly(size))
+                await self._reader.readexactly(2)
+        length = self.headers.get("content-length")
+        if length is not None:
+            return await self._reader.readexactly(int(length))
+        self._keepAlive = False
+        return await self._reader.read()
+
+    def _loaded(self):
+        if self._body is None:
+            raise RuntimeError("the response body has not been read yet; await load() first")
+        return self._body
+
+    def info(self):
+        return self.headers
+
+    def geturl(self):
+        return self.url
+
+    def getcode(self):
+        return self.code
+
+    def read(self, amt=-1):
+        return self._loaded().read(amt)
+
+    def readline(self, limit=-1):
+        return self._loaded().readline(limit)
+
+    def __iter__(self):
+        return iter(self._loaded())
+
+    def next(self):
+        return self._loaded().next()
+
+    def close(self):
+        if self._body is None:
+            self._writer.close()
+            self._body = BytesIO()
+
+    def abort(self):
+        """Close the response from any thread (the connection belongs to the event loop)."""
+        self._loop.call_soon_threadsafe(self.close)
+
+
+class _LoadedResponse(BufferedResponse):
+    """Internal response of a query served from the cache, or shared with a coalesced one: the body has already been
+    read, so L{load} returns at once (see L{AsyncResponse})."""
+
+    async def load(self):
+        return self._body.getvalue()
+
+
+class AsyncQueryResult(QueryResult):
+    """
+    Result of an L{AsyncSPARQLWrapper} query. It is a L{QueryResult<SPARQLWrapper.Wrapper.QueryResult>} whose
+    L{convert} method is a coroutine (it reads the body before converting it). The other methods, like the direct
+    access to the lines of the body, are available once the body has been read (see L{AsyncResponse.load}).
+
+    @ivar expires: Time (as returned by C{time.time()}) of the deadline of the query, if any.
+    @type expires: float
+    @ivar cancellationToken: The cancellation token of the query, if any.
+    @type cancellationToken: L{CancellationToken<SPARQLWrapper.Cancellation.CancellationToken>}
+    """
+
+    expires = None
+    cancellationToken = None
+
+    async def convert(self):
+        """
+        Read the body and convert it (see L{QueryResult.convert<SPARQLWrapper.Wrapper.QueryResult.convert>}).
+        @return: the converted query result. See the conversion methods for more details.
+        @raise DeadlineExceeded: If the deadline of the query is exceeded.
+        @raise QueryCancelled: If the query is cancelled.
+        """
+        load = self.response.load()
+        if self.expires is not None:
+            load = asyncio.wait_for(load, max(0, self.expires - time.time()))
+        try:
+            await _cancellable(load, self.cancellationToken)
+        except asyncio.TimeoutError:
+            raise DeadlineExceeded()
+        return super(AsyncQueryResult, self).convert()
+
+
+class AsyncDataLoader(object):
+    """
+    Loader coalescing the lookups requested within an iteration of the event loop into batched queries (see
+    L{DataLoader<SPARQLWrapper.Loader.DataLoader>}): the first lookup schedules the queries for the next iteration,
+    so that the lookups of all the coroutines running meanwhile are sent together::
+
+     labels = AsyncDataLoader(sparql, "SELECT ?uri ?label WHERE { ?uri rdfs:label ?label }", "uri")
+     rows = await asyncio.gather(*[labels.load(IRI(uri)) for uri in uris])  # a single query
+
+    The results are kept by the loader (each entity is looked up once). A loader belongs to the event loop it is
+    used in.
+
+    @ivar sparql: The wrapper sending the queries.
+    @type sparql: L{AsyncSPARQLWrapper}
+    @ivar query: The C{SELECT} query of a lookup. It must project the variable of the lookups.
+    @type query: L{QuerySpec<SPARQLWrapper.Wrapper.QuerySpec>}
+    @ivar variable: The name of the variable of the lookups (without C{?}).
+    @type variable: string
+    @ivar maxRows: Maximum number of lookups sent in a request. Default is C{500}.
+    @type maxRows: int
+    """
+
+    def __init__(self, sparql, query, variable, maxRows=500):
+        """
+        @param sparql: The wrapper sending the queries.
+        @type sparql: L{AsyncSPARQLWrapper}
+        @param query: The C{SELECT} query of a lookup, either a query string or a
+        L{QuerySpec<SPARQLWrapper.Wrapper.QuerySpec>}.
+        @param variable: The name of the variable of the lookups.
+        @type variable: string
+        @param maxRows: Maximum number of lookups sent in a request.
+        @type maxRows: int
+        """
+        self.sparql = sparql
+        self.query = query if isinstance(query, QuerySpec) else sparql.prepare(query)
+        self.variable = variable
+        self.maxRows = maxRows
+        self._futures = {}  # by key of the value looked up
+        self._pending = []
+
+    async def load(self, value):
+        """
+        Look an entity up.
+        @param value: The value of the variable of the lookup (see L{Template<SPARQLWrapper.Template>}).
+        @return: the rows of the results of the lookup.
+        @rtype: list of dict
+        """
+        key = termKey(value)
+        future = self._futures.get(key)
+        if future is None:
+            loop = asyncio.get_event_loop()
+            future = self._futures[key] = loop.create_future()
+            self._pending.append((key, value, future))
+            if len(self._pending) == 1:
+                loop.call_soon(self._dispatch)
+        return list(await asyncio.shield(future))  # a caller being cancelled does not cancel the others
+
+    async def loadMany(self, values):
+        """
+        Look several entities up, in the same batched queries.
+        @param values: The values of the variable of the lookups.
+        @type values: iterable
+        @return: the rows of the results of each lookup, in the order of the values.
+        @rtype: list of list of dict
+        """
+        return await asyncio.gather(*[self.load(value) for value in values])
+
+    def clear(self, value=None):
+        """
+        Forget the result of a lookup, or of all of them, so that the entities are looked up again.
+        @param value: The value of the variable of the lookup. Default is C{None}: all the lookups.
+        """
+        if value is None:
+            self._futures.clear()
+        else:
+            self._futures.pop(termKey(value), None)
+
+    def _dispatch(self):
+        """Internal method for sending the pending lookups, in a task."""
+        pending, self._pending = self._pending, []
+        asyncio.ensure_future(self._run(pending))
+
+    async def _run(self, pending):
+        """Internal coroutine sending lookups, and setting their results."""
+        try:
+            results = await self.sparql.queryBatch(self.query, [{self.variable: value} for _, value, _ in pending],
+                                                   self.maxRows)
+        except Exception as e:
+            for key, _, future in pending:
+                if self._futures.get(key) is future:
+                    del self._futures[key]  # looked up again by the next callers
+                if not future.done():
+                    future.set_exception(e)
+        else:
+            for (_, _, future), rows in zip(pending, results):
+                if not future.done():
+                    future.set_result(rows)
+
+
+async def _acquire(limiter, timeout=None):
+    """
+    Take the permission of a limiter to send a request, polling it without blocking the event loop (see
+    L{EndpointLimiter.acquire<SPARQLWrapper.Limiter.EndpointLimiter.acquire>}).
+    @param limiter: The limiter.
+    @type limiter: L{EndpointLimiter<SPARQLWrapper.Limiter.EndpointLimiter>}
+    @param timeout: Maximum time (in seconds) to wait, if lower than the C{maxWait} of the limiter.
+    @type timeout: float
+    @raise LimitExceeded: If the request can not be sent (in time).
+    """
+    if limiter.maxWait is not None:
+        timeout = limiter.maxWait if timeout is None else min(timeout, limiter.maxWait)
+    start = time.time()
+    while True:
+        delay = limiter.tryAcquire(start)
+        if delay is None:
+            return
+        elapsed = time.time() - start
+        if not limiter.blocking or (timeout is not None and elapsed >= timeout):
+            limiter.recordRejection()
+            raise LimitExceeded()
+        await asyncio.sleep(delay if timeout is None else min(delay, timeout - elapsed))
+
+
+async def _cancellable(awaitable, token):
+    """Internal coroutine awaiting a coroutine in a task cancelled, from any thread, with the cancellation token (if
+    any).
+    @raise QueryCancelled: If the token is cancelled.
+    """
+    if token is None:
+        return await awaitable
+    loop = asyncio.get_event_loop()
+    task = asyncio.ensure_future(awaitable)
+    key = token.register(lambda: loop.call_soon_threadsafe(task.cancel))
+    try:
+        return await task
+    except asyncio.CancelledError:
+        if token.cancelled:
+            raise QueryCancelled()
+        raise
+    finally:
+        token.unregister(key)
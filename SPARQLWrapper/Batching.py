@@ -0,0 +1,186 @@
+# -*- coding: utf-8 -*-
+
+"""
+Batching of many lookups into a few queries with a C{VALUES} clause (see
+L{SPARQLWrapper.queryBatch<SPARQLWrapper.Wrapper.SPARQLWrapper.queryBatch>}).
+
+Running the same C{SELECT} query for each of many entities costs a round trip per entity. Instead, the values of the
+variables of the lookups are sent in a C{VALUES} clause, at the start of the C{WHERE} clause of the query::
+
+ SELECT ?uri ?label WHERE { VALUES ?uri { <http://example.org/a> <http://example.org/b> } ?uri rdfs:label ?label }
+
+and each row of the results is given back to the lookup with the same values. The lookups are split into chunks,
+bounded by the number of rows of their C{VALUES} clause and by the length of their (URL encoded) query.
+
+The variables of the lookups must be projected by the query (eg, C{SELECT *}), so that the rows of the results can be
+matched with the lookups, and the query must not aggregate or limit the rows across the lookups (no C{GROUP BY},
+C{LIMIT}, etc, at its top level). The values are matched as RDF terms: IRIs, literals with the same language tag (in
+any case) or datatype, and numbers with the same value (eg, C{"1.0"^^xsd:double} and C{1.0}).
+
+@authors: U{Ivan Herman<http://www.ivan-herman.net>}, U{Sergio Fernández<http://www.wikier.org>}, U{Carlos Tejo Alonso<http://www.dayures.net>}
+@organization: U{World Wide Web Consortium<http://www.w3.org>} and U{Foundation CTIC<http://www.fundacionctic.org/>}.
+@license: U{W3C® SOFTWARE NOTICE AND LICENSE<href="http://www.w3.org/Consortium/Legal/copyright-software">}
+@since: 1.8.3
+"""
+
+import decimal
+import urllib
+
+from Lexer import findPatternStart, scanQuery
+from SmartWrapper import Value
+from Template import IRI, Literal, toTerm
+
+_XSD = "http://www.w3.org/2001/XMLSchema#"
+
+# The parsers of the lexical values of the numeric datatypes, for matching the numbers by value.
+_NUMBERS = {_XSD + "integer": long, _XSD + "decimal": decimal.Decimal, _XSD + "double": float, _XSD + "float": float}
+
+
+def termKey(value):
+    """
+    Get a key identifying an RDF term, for matching the values of the lookups with the terms of the results.
+    @param value: Either the value of a lookup (see L{Template<SPARQLWrapper.Template>}), or a term of the results:
+    a L{Value<SPARQLWrapper.SmartWrapper.Value>} or a dictionary of the JSON results.
+    @return: a hashable key.
+    @rtype: tuple
+    """
+    if isinstance(value, dict):
+        value = Value(None, value)
+    if isinstance(value, Value):
+        if value.type == Value.URI:
+            return Value.URI, value.value
+        if value.type == Value.BNODE:
+            return Value.BNODE, value.value
+        value = Literal(value.value, value.lang, value.datatype if value.lang is None else None)
+    elif isinstance(value, IRI):
+        return Value.URI, unicode(value)
+    elif isinstance(value, bool):
+        value = Literal(u"true" if value else u"false", datatype=_XSD + "boolean")
+    elif isinstance(value, (int, long)):
+        return Value.Literal, _XSD + "integer", long(value)
+    elif isinstance(value, float):
+        return Value.Literal, _XSD + "double", value
+    elif isinstance(value, decimal.Decimal):
+        return Value.Literal, _XSD + "decimal", value
+    elif not isinstance(value, Literal):
+        value = Literal(value.decode("utf-8") if isinstance(value, bytes) else value)
+    if value.lang is not None:
+        return Value.Literal, value.value, value.lang.lower()
+    if value.datatype in _NUMBERS:
+        try:
+            return Value.Literal, value.datatype, _NUMBERS[value.datatype](value.value)
+        except (ValueError, decimal.InvalidOperation):
+            pass
+    return Value.Literal, value.value, value.datatype if value.datatype != _XSD + "string" else None
+
+
+def splitBatches(query, names, rows, maxRows=500, maxLength=65536):
+    """
+    Split lookups into queries with a C{VALUES} clause.
+    @param query: The C{SELECT} query of a lookup.
+    @type query: string
+    @param names: The names of the variables of the lookups.
+    @type names: list of string
+    @param rows: The values of the variables of each lookup, in the order of the names.
+    @type rows: list of tuple
+    @param maxRows: Maximum number of rows in the C{VALUES} clause of a query. Default is C{500}.
+    @type maxRows: int
+    @param maxLength: Maximum length of a query, once URL encoded (a single lookup may exceed it). Default is 64KB.
+    @type maxLength: int
+    @return: the queries, with the indexes of the rows each of them includes.
+    @rtype: list of (string, list of int) tuples
+    @raise ValueError: If the query is not a C{SELECT} query.
+    """
+    scanned = scanQuery(query)
+    start = findPatternStart(query, scanned.keywordOffset) if scanned.queryType == "SELECT" else None
+    if start is None:
+        raise ValueError("only the SELECT queries can be batched")
+    if len(names) == 1:
+        header, rowFormat = u" VALUES ?%s {" % names[0], u" %s"
+    else:
+        header = u" VALUES (%s) {" % u" ".join(u"?" + name for name in names)
+        rowFormat = u" (" + u" ".join([u"%s"] * len(names)) + u")"
+    head, tail = query[:start] + header, u" }" + query[start:]
+    baseLength = _encodedLength(head) + _encodedLength(tail)
+
+    batches = []
+    terms, indexes, length = [], [], baseLength
+    for index, row in enumerate(rows):
+        term = rowFormat % tuple(toTerm(value) for value in row)
+        termLength = _encodedLength(term)
+        if indexes and (len(indexes) >= maxRows or length + termLength > maxLength):
+            batches.append((head + u"".join(terms) + tail, indexes))
+            terms, indexes, length = [], [], baseLength
+        terms.append(term)
+        indexes.append(index)
+        length += termLength
+    if indexes:
+        batches.append((head + u"".join(terms) + tail, indexes))
+    return batches
+
+
+class LookupBatch(object):
+    """
+    The lookups of a batch: their distinct values, split into queries (see L{splitBatches}), and the rows of the
+    results given back to them.
+
+    @ivar names: The names of the variables of the lookups.
+    @type names: list of string
+    @ivar queries: The queries to run.
+    @type queries: list of string
+    """
+
+    def __init__(self, query, bindings, maxRows=500, maxLength=65536):
+        """
+        @param query: The C{SELECT} query of a lookup.
+        @type query: string
+        @param bindings: The values of the variables of each lookup, as dictionaries of values by name, all with the
+        same names.
+        @type bindings: list of dict
+        @param maxRows: Maximum number of rows in the C{VALUES} clause of a query.
+        @type maxRows: int
+        @param maxLength: Maximum length of a query, once URL encoded.
+        @type maxLength: int
+        @raise ValueError: If the query is not a C{SELECT} query, or the bindings do not have the same names.
+        """
+        self.names = sorted(bindings[0]) if bindings else []
+        self._indexes = {}  # the index of each distinct row of values, by key
+        self._lookups = []
+        rows = []
+        for binding in bindings:
+            if not self.names or sorted(binding) != self.names:
+                raise ValueError("the bindings must have the same (non empty) variables")
+            row = tuple(binding[name] for name in self.names)
+            key = tuple(termKey(value) for value in row)
+            if key not in self._indexes:
+                self._indexes[key] = len(rows)
+                rows.append(row)
+            self._lookups.append(self._indexes[key])
+        self._results = [[] for _ in rows]
+        self.queries = [batch for batch, _ in splitBatches(query, self.names, rows, maxRows, maxLength)] if rows else []
+
+    def addResults(self, rows):
+        """
+        Give the rows of the results of a query back to the lookups they match.
+        @param rows: The rows, as dictionaries of the terms (as in the JSON results, or
+        L{Value<SPARQLWrapper.SmartWrapper.Value>} instances) by variable name.
+        @type rows: list of dict
+        """
+        for row in rows:
+            if all(name in row for name in self.names):
+                index = self._indexes.get(tuple(termKey(row[name]) for name in self.names))
+                if index is not None:
+                    self._results[index].append(row)
+
+    def getResults(self):
+        """
+        Get the rows of the results of each lookup.
+        @return: the rows, in the order of the lookups.
+        @rtype: list of list of dict
+        """
+        return [list(self._results[index]) for index in self._lookups]
+
+
+def _encodedLength(text):
+    """Internal function for getting the length of a text once URL encoded (as a request parameter)."""
+    return len(urllib.quote_plus(text.encode("utf-8")))
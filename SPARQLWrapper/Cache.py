@@ -0,0 +1,663 @@
+# -*- coding: utf-8 -*-
+
+"""
+Caches of the query results (see L{SPARQLWrapper.setCache<SPARQLWrapper.Wrapper.SPARQLWrapper.setCache>}).
+
+Many applications run the same lookup queries again and again (labels, class hierarchies, configuration graphs). A
+cache keeps the responses of the queries (the raw body and the headers), keyed on the identity of their requests
+(endpoint, query, parameters, C{Accept} header, credentials, etc, see
+L{requestIdentity<SPARQLWrapper.Transport.requestIdentity>}). A cached response is replayed through a
+L{QueryResult<SPARQLWrapper.Wrapper.QueryResult>}, so that it is converted exactly as a fresh one::
+
+ from SPARQLWrapper import SPARQLWrapper, MemoryCache
+
+ cache = MemoryCache(maxBytes=16 * 1024 * 1024, ttl=600)  # can be shared by several wrappers
+
+ sparql = SPARQLWrapper("http://example.org/sparql")
+ sparql.setCache(cache)
+
+Only the successful responses of the queries (not of the updates) are cached. The time they are kept is given by the
+C{Cache-Control} (C{max-age}, C{no-store}, etc) and C{Expires} headers of the responses, if any, or else by the TTL
+of the cache. The updates sent through a wrapper with a cache remove the results they may modify (see
+L{Invalidation<SPARQLWrapper.Invalidation>}). Once expired, a response with an C{ETag} or C{Last-Modified} header is revalidated: the request is sent
+with an C{If-None-Match} or C{If-Modified-Since} header, and if the endpoint answers with a C{304 Not Modified}
+status, the cached body is replayed (and kept for a new lifetime) instead of being downloaded again.
+
+When a popular result expires, the queries needing it must not all hit the endpoint at once: a single query (per
+cache, and across the processes sharing a L{DiskCache}) fetches it again, while the other ones wait for it to be
+cached (see L{ResultCache.acquireLock}). A cache can also serve the expired results for a while (see
+L{ResultCache.staleWhileRevalidate}): they are then returned at once, and refreshed in the background.
+
+The results can be kept in memory (L{MemoryCache}), or on disk (L{DiskCache}), where several processes share them.
+Other storages can be plugged in by subclassing L{ResultCache}.
+
+@authors: U{Ivan Herman<http://www.ivan-herman.net>}, U{Sergio Fernández<http://www.wikier.org>}, U{Carlos Tejo Alonso<http://www.dayures.net>}
+@organization: U{World Wide Web Consortium<http://www.w3.org>} and U{Foundation CTIC<http://www.fundacionctic.org/>}.
+@license: U{W3C® SOFTWARE NOTICE AND LICENSE<href="http://www.w3.org/Consortium/Legal/copyright-software">}
+@since: 1.8.3
+"""
+
+import email.utils
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+import zlib
+from collections import namedtuple, OrderedDict
+
+from Invalidation import isAffected
+from KeyCaseInsensitiveDict import KeyCaseInsensitiveDict
+
+# Headers of a cached response updated by a "304 Not Modified" response revalidating it.
+_UPDATED_HEADERS = ["etag", "last-modified", "date", "expires", "cache-control"]
+
+# Delay between two checks of a lock of a DiskCache held by another query (see DiskCache.acquireLock).
+_LOCK_POLL_INTERVAL = 0.05
+
+# Maximum time (in seconds) the access times of the entries read from a DiskCache are kept by a process before being
+# written to the database (they are also written before any eviction by the process), see DiskCache._load.
+_TOUCH_INTERVAL = 5
+
+
+def cacheKey(identity):
+    """
+    Get the key of a request in a cache.
+    @param identity: The identity of the request (see L{requestIdentity<SPARQLWrapper.Transport.requestIdentity>}).
+    @type identity: tuple
+    @return: a digest of the identity.
+    @rtype: string
+    """
+    return hashlib.sha256(repr(identity).encode("utf-8")).hexdigest()
+
+
+class CacheEntry(namedtuple("CacheEntry", ["body", "headers", "url", "code", "returnFormat", "created", "expires",
+                                             "endpoint", "graphs"])):
+    """
+    Response of a query kept in a cache: its C{body} (decompressed), C{headers} (a dictionary with case-insensitive
+    names), C{url} and status C{code}, the C{returnFormat} it was requested in, the times (as returned by
+    C{time.time()}) it was C{created} and C{expires}, and the C{endpoint} and the C{graphs} of the dataset of the query
+    (see L{getQueryGraphs<SPARQLWrapper.Invalidation.getQueryGraphs>}), if known.
+    @since: 1.8.3
+    """
+    __slots__ = ()
+
+    def __new__(cls, body, headers, url, code, returnFormat, created, expires, endpoint=None, graphs=None):
+        if not isinstance(headers, KeyCaseInsensitiveDict):
+            headers = KeyCaseInsensitiveDict(headers)
+        return super(CacheEntry, cls).__new__(cls, body, headers, url, code, returnFormat, created, expires, endpoint,
+                                              frozenset(graphs) if graphs is not None else None)
+
+    @property
+    def size(self):
+        """The approximate memory used by the entry, in bytes."""
+        return len(self.body) + len(self.url) + sum(len(name) + len(value) for name, value in self.headers.items())
+
+    def isFresh(self, now=None):
+        """
+        Check if the entry has not expired yet.
+        @param now: The current time (as returned by C{time.time()}). Default is the actual current time.
+        @type now: float
+        @rtype: bool
+        """
+        return (now if now is not None else time.time()) < self.expires
+
+    def getResponse(self):
+        """
+        Get the arguments of a L{BufferedResponse<SPARQLWrapper.Transport.BufferedResponse>} replaying the response.
+        @rtype: tuple
+        """
+        return self.body, self.headers, self.url, self.code
+
+
+class ResultCache(object):
+    """
+    Base class of the caches. A cache must be thread-safe: it can be shared by several wrappers.
+
+    @ivar ttl: Time (in seconds) the results are kept, unless their headers tell otherwise.
+    @type ttl: float
+    @ivar useHttpHeaders: C{True} if the C{Cache-Control} and C{Expires} headers of the responses are honoured (the
+    default), C{False} if the results are kept for L{ttl} anyway (eg, for endpoints forbidding any caching).
+    @type useHttpHeaders: bool
+    @ivar staleWhileRevalidate: Time (in seconds) the results are still served once expired, while a single query
+    refreshes them in the background. Default is C{0}: the queries wait for the fresh results.
+    @type staleWhileRevalidate: float
+    @ivar lockTimeout: Maximum time (in seconds) a query waits for another one to fetch the result it needs (see
+    L{acquireLock}), before fetching it itself. Default is C{30}.
+    @type lockTimeout: float
+    """
+
+    def __init__(self, ttl=300, useHttpHeaders=True, staleWhileRevalidate=0, lockTimeout=30):
+        """
+        @param ttl: Time (in seconds) the results are kept. Default is C{300}.
+        @type ttl: float
+        @param useHttpHeaders: C{True} if the C{Cache-Control} and C{Expires} headers of the responses are honoured.
+        @type useHttpHeaders: bool
+        @param staleWhileRevalidate: Time (in seconds) the results are still served once expired. Default is C{0}.
+        @type staleWhileRevalidate: float
+        @param lockTimeout: Maximum time (in seconds) a query waits for another one to fetch a result. Default is
+        C{30}.
+        @type lockTimeout: float
+        """
+        self.ttl = ttl
+        self.useHttpHeaders = useHttpHeaders
+        self.staleWhileRevalidate = staleWhileRevalidate
+        self.lockTimeout = lockTimeout
+        self._hits = 0
+        self._misses = 0
+        self._stale = 0
+        self._revalidations = 0
+        self._evictions = 0
+        self._invalidations = 0
+        self._countersLock = threading.Lock()
+        self._locks = set()
+        self._locksCondition = threading.Condition()
+
+    def get(self, key, allowStale=False):
+        """
+        Get a fresh entry (a hit), or else an expired one (a miss) which can be revalidated.
+        @param key: The key of the request (see L{cacheKey}).
+        @type key: string
+        @param allowStale: C{True} for getting the entry even if it has expired. Default is C{False}.
+        @type allowStale: bool
+        @return: the entry, or C{None} if it is not cached (or has expired, unless C{allowStale} is set).
+        @rtype: L{CacheEntry}
+        """
+        entry = self._load(key)
+        fresh = entry is not None and entry.isFresh()
+        self._count(hits=int(fresh), misses=int(not fresh))
+        return entry if fresh or allowStale else None
+
+    def isServableStale(self, entry, now=None):
+        """
+        Check if an expired entry can still be served, while it is refreshed (see L{staleWhileRevalidate}). Such an
+        entry served is counted.
+        @param entry: The entry.
+        @type entry: L{CacheEntry}
+        @param now: The current time (as returned by C{time.time()}). Default is the actual current time.
+        @type now: float
+        @rtype: bool
+        """
+        servable = (now if now is not None else time.time()) < entry.expires + self.staleWhileRevalidate
+        self._count(stale=int(servable))
+        return servable
+
+    def acquireLock(self, key, blocking=True, timeout=None):
+        """
+        Take the lock of a key, held by the (single) query fetching its result, so that the identical queries wait for
+        the result to be cached instead of sending the same request (a cache stampede). The lock must then be
+        L{released<releaseLock>}.
+        @param key: The key of the request (see L{cacheKey}).
+        @type key: string
+        @param blocking: C{True} for waiting until the lock is released (the default), C{False} for failing at once.
+        @type blocking: bool
+        @param timeout: Maximum time (in seconds) to wait. Default is C{None}: no limit.
+        @type timeout: float
+        @return: C{True} if the lock has been taken, C{False} otherwise.
+        @rtype: bool
+        """
+        start = time.time()
+        with self._locksCondition:
+            while key in self._locks:
+                remaining = timeout - (time.time() - start) if timeout is not None else None
+                if not blocking or (remaining is not None and remaining <= 0):
+                    return False
+                self._locksCondition.wait(remaining)
+            self._locks.add(key)
+            return True
+
+    def releaseLock(self, key):
+        """
+        Release the lock of a key (see L{acquireLock}).
+        @param key: The key of the request (see L{cacheKey}).
+        @type key: string
+        """
+        with self._locksCondition:
+            self._locks.discard(key)
+            self._locksCondition.notify_all()
+
+    def getLifetime(self, headers, now=None):
+        """
+        Get the time a response can be kept, according to its headers (if L{useHttpHeaders}) or to the L{ttl}.
+        @param headers: The headers of the response.
+        @type headers: dict
+        @param now: The current time (as returned by C{time.time()}). Default is the actual current time.
+        @type now: float
+        @return: the time, in seconds, or C{None} if the response must not be kept.
+        @rtype: float
+        """
+        if not self.useHttpHeaders:
+            return self.ttl
+        return getFreshnessLifetime(headers, self.ttl, now)
+
+    def set(self, key, entry):
+        """
+        Keep an entry, replacing the previous one. An entry larger than the cache is not kept, but the previous one is
+        removed anyway (it must not be served in place of a newer response).
+        @param key: The key of the request (see L{cacheKey}).
+        @type key: string
+        @param entry: The entry.
+        @type entry: L{CacheEntry}
+        """
+        raise NotImplementedError
+
+    def delete(self, key):
+        """
+        Remove an entry, if cached.
+        @param key: The key of the request (see L{cacheKey}).
+        @type key: string
+        """
+        raise NotImplementedError
+
+    def clear(self):
+        """Remove all the entries."""
+        raise NotImplementedError
+
+    def invalidate(self, endpoints, graphs=None):
+        """
+        Remove the entries of the queries whose result may be modified by an update (see
+        L{isAffected<SPARQLWrapper.Invalidation.isAffected>}).
+        @param endpoints: The endpoints of the entries to check.
+        @type endpoints: list of string
+        @param graphs: The graphs the update may modify, or C{None} if they are not known.
+        @type graphs: set
+        @return: the number of entries removed.
+        @rtype: int
+        """
+        removed = self._invalidate(endpoints, graphs)
+        self._count(invalidations=removed)
+        return removed
+
+    def recordRevalidation(self):
+        """Count an expired entry revalidated by the endpoint (with a C{304 Not Modified} status)."""
+        self._count(revalidations=1)
+
+    def getCounters(self):
+        """
+        Get the counters of the cache, for monitoring.
+        @return: a dictionary with the number of C{hits}, C{misses}, C{stale} (the misses served with an expired
+        entry, see L{staleWhileRevalidate}), C{revalidations} (the misses answered with a C{304 Not Modified} status),
+        C{evictions} (the entries removed to make room for new ones) and C{invalidations} (the entries removed by
+        updates).
+        @rtype: dict
+        """
+        with self._countersLock:
+            return {"hits": self._hits, "misses": self._misses, "stale": self._stale,
+                    "revalidations": self._revalidations, "evictions": self._evictions,
+                    "invalidations": self._invalidations}
+
+    def _load(self, key):
+        """
+        Internal method for getting an entry, fresh or not, without counting a hit or a miss.
+        @rtype: L{CacheEntry}
+        """
+        raise NotImplementedError
+
+    def _invalidate(self, endpoints, graphs):
+        """
+        Internal method for removing the entries of the queries whose result may be modified by an update (see
+        L{invalidate}), without counting them.
+        @rtype: int
+        """
+        raise NotImplementedError
+
+    def _count(self, hits=0, misses=0, stale=0, revalidations=0, evictions=0, invalidations=0):
+        """Internal method for updating the counters."""
+        with self._countersLock:
+            self._hits += hits
+            self._misses += misses
+            self._stale += stale
+            self._revalidations += revalidations
+            self._evictions += evictions
+            self._invalidations += invalidations
+
+
+def getFreshnessLifetime(headers, default, now=None):
+    """
+    Get the time a response can be kept, according to its C{Cache-Control} and C{Expires} headers (see RFC 7234).
+    @param headers: The headers of the response.
+    @type headers: dict
+    @param default: The time to return when the headers do not tell.
+    @type default: float
+    @param now: The current time (as returned by C{time.time()}). Default is the actual current time.
+    @type now: float
+    @return: the time, in seconds, or C{None} if the response must not be kept at all.
+    @rtype: float
+    """
+    headers = dict((name.lower(), value) for name, value in headers.items())
+    directives = {}
+    for directive in headers.get("cache-control", "").split(","):
+        name, _, value = directive.strip().partition("=")
+        directives[name.strip().lower()] = value.strip().strip('"')
+    if "no-store" in directives or "private" in directives:
+        return None
+    if "no-cache" in directives:
+        return 0
+    for name in ["s-maxage", "max-age"]:
+        if name in directives:
+            try:
+                return max(0, int(directives[name]))
+            except ValueError:
+                return 0
+    if "expires" in headers:
+        expires = email.utils.parsedate_tz(headers["expires"])
+        if expires is None:
+            return 0  # an invalid date means "already expired"
+        date = email.utils.parsedate_tz(headers.get("date", ""))
+        reference = email.utils.mktime_tz(date) if date is not None else (now if now is not None else time.time())
+        return max(0, email.utils.mktime_tz(expires) - reference)
+    return default
+
+
+def getConditionalHeaders(headers):
+    """
+    Get the headers revalidating a response, according to its validators (C{ETag} and C{Last-Modified} headers).
+    @param headers: The headers of the response.
+    @type headers: dict
+    @return: the C{If-None-Match} and C{If-Modified-Since} headers (empty if the response has no validator).
+    @rtype: dict
+    """
+    conditional = {}
+    for name, value in headers.items():
+        if name.lower() == "etag":
+            conditional["If-None-Match"] = value
+        elif name.lower() == "last-modified":
+            conditional["If-Modified-Since"] = value
+    return conditional
+
+
+def updateHeaders(headers, notModifiedHeaders):
+    """
+    Update the headers of a cached response with the ones of a C{304 Not Modified} response revalidating it (its
+    validators, date and freshness headers).
+    @param headers: The headers of the cached response.
+    @type headers: dict
+    @param notModifiedHeaders: The headers of the C{304 Not Modified} response.
+    @type notModifiedHeaders: dict
+    @return: the updated headers.
+    @rtype: L{KeyCaseInsensitiveDict<SPARQLWrapper.KeyCaseInsensitiveDict.KeyCaseInsensitiveDict>}
+    """
+    result = KeyCaseInsensitiveDict(headers)
+    for name, value in notModifiedHeaders.items():
+        if name.lower() in _UPDATED_HEADERS:
+            result[name] = value
+    return result
+
+
+class MemoryCache(ResultCache):
+    """
+    Cache keeping the results in memory, within a size bound: the least recently used entries are evicted first.
+    """
+
+    def __init__(self, maxBytes=32 * 1024 * 1024, ttl=300, maxEntries=None, useHttpHeaders=True,
+                 staleWhileRevalidate=0, lockTimeout=30):
+        """
+        @param maxBytes: Maximum memory used by the entries, in bytes. Default is 32MB.
+        @type maxBytes: int
+        @param ttl: Time (in seconds) the results are kept. Default is C{300}.
+        @type ttl: float
+        @param maxEntries: Maximum number of entries. Default is C{None}: no limit.
+        @type maxEntries: int
+        @param useHttpHeaders: C{True} if the C{Cache-Control} and C{Expires} headers of the responses are honoured.
+        @type useHttpHeaders: bool
+        @param staleWhileRevalidate: Time (in seconds) the results are still served once expired. Default is C{0}.
+        @type staleWhileRevalidate: float
+        @param lockTimeout: Maximum time (in seconds) a query waits for another one to fetch a result. Default is
+        C{30}.
+        @type lockTimeout: float
+        """
+        super(MemoryCache, self).__init__(ttl, useHttpHeaders, staleWhileRevalidate, lockTimeout)
+        self.maxBytes = maxBytes
+        self.maxEntries = maxEntries
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+    def set(self, key, entry):
+        size = entry.size
+        evicted = 0
+        with self._lock:
+            self._remove(key)
+            if size > self.maxBytes:
+                return
+            self._entries[key] = (entry, size)
+            self._bytes += size
+            while self._bytes > self.maxBytes or (self.maxEntries is not None and len(self._entries) > self.maxEntries):
+                self._remove(next(iter(self._entries)))
+                evicted += 1
+        self._count(evictions=evicted)
+
+    def delete(self, key):
+        with self._lock:
+            self._remove(key)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def getCounters(self):
+        """
+        Get the counters of the cache, for monitoring.
+        @return: a dictionary with the number of C{hits}, C{misses} and C{evictions}, and the number of C{entries} and
+        the memory they use (C{bytes}).
+        @rtype: dict
+        """
+        counters = super(MemoryCache, self).getCounters()
+        with self._lock:
+            counters.update(entries=len(self._entries), bytes=self._bytes)
+        return counters
+
+    def _invalidate(self, endpoints, graphs):
+        with self._lock:
+            keys = [key for key, (entry, size) in self._entries.items()
+                    if entry.endpoint in endpoints and isAffected(entry.graphs, graphs)]
+            for key in keys:
+                self._remove(key)
+        return len(keys)
+
+    def _load(self, key):
+        with self._lock:
+            item = self._entries.pop(key, None)
+            if item is None:
+                return None
+            self._entries[key] = item  # most recently used
+            return item[0]
+
+    def _remove(self, key):
+        """Internal method for removing an entry (the lock must be held)."""
+        item = self._entries.pop(key, None)
+        if item is not None:
+            self._bytes -= item[1]
+
+
+class DiskCache(ResultCache):
+    """
+    Cache keeping the results in a SQLite database, which several processes (eg, the workers of a web server, and
+    cron jobs) can share: the results fetched by any of them are available to the others, and survive their restarts.
+    The bodies are compressed, and the total size of the entries is bounded: the least recently used entries are
+    evicted first. The reads do not take the write lock of the database: the access times of the entries are written
+    in batches (see L{_load}).
+
+    @ivar path: The path of the database file.
+    @type path: string
+    """
+
+    def __init__(self, path, maxBytes=256 * 1024 * 1024, ttl=300, useHttpHeaders=True, compressLevel=6,
+                 staleWhileRevalidate=0, lockTimeout=30):
+        """
+        @param path: The path of the database file, created if needed.
+        @type path: string
+        @param maxBytes: Maximum size of the (compressed) entries, in bytes. Default is 256MB.
+        @type maxBytes: int
+        @param ttl: Time (in seconds) the results are kept. Default is C{300}.
+        @type ttl: float
+        @param useHttpHeaders: C{True} if the C{Cache-Control} and C{Expires} headers of the responses are honoured.
+        @type useHttpHeaders: bool
+        @param compressLevel: The C{zlib} compression level of the bodies, from C{0} (none) to C{9}. Default is C{6}.
+        @type compressLevel: int
+        @param staleWhileRevalidate: Time (in seconds) the results are still served once expired. Default is C{0}.
+        @type staleWhileRevalidate: float
+        @param lockTimeout: Maximum time (in seconds) a query waits for another process to fetch a result (and the
+        time its lock is kept, if that process dies). Default is C{30}.
+        @type lockTimeout: float
+        """
+        super(DiskCache, self).__init__(ttl, useHttpHeaders, staleWhileRevalidate, lockTimeout)
+        self.path = os.path.abspath(path)
+        self.maxBytes = maxBytes
+        self.compressLevel = compressLevel
+        self._local = threading.local()
+        self._touched = {}  # the access times of the entries read, not written yet, by key
+        self._flushed = time.time()
+        self._touchedLock = threading.Lock()
+        with self._transaction() as connection:
+            connection.execute("CREATE TABLE IF NOT EXISTS entries (key TEXT PRIMARY KEY, body BLOB, headers TEXT, "
+                               "url TEXT, code INTEGER, returnFormat TEXT, created REAL, expires REAL, "
+                               "endpoint TEXT, graphs TEXT, accessed REAL, size INTEGER)")
+            connection.execute("CREATE INDEX IF NOT EXISTS entries_accessed ON entries (accessed)")
+            connection.execute("CREATE INDEX IF NOT EXISTS entries_endpoint ON entries (endpoint)")
+            connection.execute("CREATE TABLE IF NOT EXISTS locks (key TEXT PRIMARY KEY, expires REAL)")
+
+    def set(self, key, entry):
+        body = zlib.compress(entry.body, self.compressLevel)
+        headers = json.dumps(entry.headers)
+        size = len(body) + len(headers) + len(entry.url)
+        if size > self.maxBytes:
+            self.delete(key)
+            return
+        with self._transaction() as connection:
+            graphs = json.dumps(sorted(entry.graphs)) if entry.graphs is not None else None
+            connection.execute("INSERT OR REPLACE INTO entries VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                               (key, sqlite3.Binary(body), headers, entry.url, entry.code, entry.returnFormat,
+                                entry.created, entry.expires, entry.endpoint, graphs, time.time(), size))
+            self._flushTouches(connection)  # for evicting the least recently used entries
+            total = connection.execute("SELECT SUM(size) FROM entries").fetchone()[0]
+            evicted = []
+            if total > self.maxBytes:
+                for evictedKey, evictedSize in connection.execute("SELECT key, size FROM entries ORDER BY accessed"):
+                    if total <= self.maxBytes:
+                        break
+                    evicted.append((evictedKey,))
+                    total -= evictedSize
+                connection.executemany("DELETE FROM entries WHERE key = ?", evicted)
+        self._count(evictions=len(evicted))
+
+    def delete(self, key):
+        with self._transaction() as connection:
+            connection.execute("DELETE FROM entries WHERE key = ?", (key,))
+
+    def clear(self):
+        with self._transaction() as connection:
+            connection.execute("DELETE FROM entries")
+
+    def acquireLock(self, key, blocking=True, timeout=None):
+        """
+        Take the lock of a key, shared by all the processes using the database (see
+        L{ResultCache.acquireLock}). The lock is a lease: it is released after L{lockTimeout} anyway, in case the
+        process holding it dies.
+        @param key: The key of the request (see L{cacheKey}).
+        @type key: string
+        @param blocking: C{True} for waiting until the lock is released (the default), C{False} for failing at once.
+        @type blocking: bool
+        @param timeout: Maximum time (in seconds) to wait. Default is C{None}: no limit.
+        @type timeout: float
+        @return: C{True} if the lock has been taken, C{False} otherwise.
+        @rtype: bool
+        """
+        start = time.time()
+        while True:
+            now = time.time()
+            with self._transaction() as connection:
+                connection.execute("DELETE FROM locks WHERE key = ? AND expires <= ?", (key, now))
+                taken = connection.execute("INSERT OR IGNORE INTO locks VALUES (?, ?)",
+                                           (key, now + self.lockTimeout)).rowcount == 1
+            if taken:
+                return True
+            if not blocking or (timeout is not None and now - start >= timeout):
+                return False
+            time.sleep(_LOCK_POLL_INTERVAL if timeout is None else
+                       max(0, min(_LOCK_POLL_INTERVAL, start + timeout - now)))
+
+    def releaseLock(self, key):
+        with self._transaction() as connection:
+            connection.execute("DELETE FROM locks WHERE key = ?", (key,))
+
+    def getCounters(self):
+        """
+        Get the counters of the cache, for monitoring.
+        @return: a dictionary with the number of C{hits}, C{misses} and C{evictions} of this process, and the number
+        of C{entries} and their size on disk (C{bytes}).
+        @rtype: dict
+        """
+        counters = super(DiskCache, self).getCounters()
+        entries, size = self._getConnection().execute("SELECT COUNT(*), SUM(size) FROM entries").fetchone()
+        counters.update(entries=entries, bytes=size or 0)
+        return counters
+
+    def _invalidate(self, endpoints, graphs):
+        with self._transaction() as connection:
+            keys = []
+            for endpoint in endpoints:
+                for key, entryGraphs in connection.execute("SELECT key, graphs FROM entries WHERE endpoint = ?",
+                                                           (endpoint,)).fetchall():
+                    if isAffected(set(json.loads(entryGraphs)) if entryGraphs is not None else None, graphs):
+                        keys.append((key,))
+            connection.executemany("DELETE FROM entries WHERE key = ?", keys)
+        return len(keys)
+
+    def _load(self, key):
+        """
+        Internal method for reading an entry, without taking the write lock of the database (the statement runs in a
+        deferred transaction of its own). The access time of the entry is kept, and written with the other ones
+        every few seconds (C{_TOUCH_INTERVAL}), or before an eviction by this process.
+        """
+        row = self._getConnection().execute("SELECT body, headers, url, code, returnFormat, created, expires, "
+                                            "endpoint, graphs FROM entries WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            return None
+        now = time.time()
+        with self._touchedLock:
+            self._touched[key] = now
+            flush = now - self._flushed >= _TOUCH_INTERVAL
+        if flush:
+            with self._transaction() as connection:
+                self._flushTouches(connection)
+        body, headers, url, code, returnFormat, created, expires, endpoint, graphs = row
+        return CacheEntry(zlib.decompress(bytes(body)), json.loads(headers), url, code, returnFormat, created,
+                          expires, endpoint, json.loads(graphs) if graphs is not None else None)
+
+    def _flushTouches(self, connection):
+        """Internal method for writing the access times of the entries read since the last call (in a transaction)."""
+        with self._touchedLock:
+            touched, self._touched = self._touched, {}
+            self._flushed = time.time()
+        connection.executemany("UPDATE entries SET accessed = MAX(accessed, ?) WHERE key = ?",
+                               [(accessed, key) for key, accessed in touched.items()])
+
+    def _getConnection(self):
+        """Internal method for getting the connection of the current thread to the database."""
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            connection = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            connection.execute("PRAGMA journal_mode=WAL")  # the readers do not block the writer
+            self._local.connection = connection
+        return connection
+
+    def _transaction(self):
+        """Internal method for running statements in a transaction, holding the write lock of the database."""
+        return _Transaction(self._getConnection())
+
+
+class _Transaction(object):
+    """Internal context manager running statements in an immediate transaction of a connection."""
+
+    def __init__(self, connection):
+        self.connection = connection
+
+    def __enter__(self):
+        self.connection.execute("BEGIN IMMEDIATE")
+        return self.connection
+
+    def __exit__(self, exceptionType, exception, traceback):
+        self.connection.execute("COMMIT" if exceptionType is None else "ROLLBACK")
@@ -0,0 +1,281 @@
+# -*- coding: utf-8 -*-
+
+"""
+Cancellation of the queries in flight (see
+L{SPARQLWrapper.setCancellationToken<SPARQLWrapper.Wrapper.SPARQLWrapper.setCancellationToken>}).
+
+A query given a L{CancellationToken} can be abandoned from another thread, eg, when the user who asked for it is
+gone. Cancelling the token interrupts the query wherever it is: the request is aborted (over persistent
+connections, see L{SPARQLWrapper.setUseKeepAlive<SPARQLWrapper.Wrapper.SPARQLWrapper.setUseKeepAlive>}) or abandoned
+(it is then sent by another thread, and its response is closed as soon as it is received), or the connection the
+result is read from is shut down, interrupting its conversion. If the
+server of the endpoint is known to support it (see
+L{SPARQLWrapper.setServerType<SPARQLWrapper.Wrapper.SPARQLWrapper.setServerType>}), it is also asked to stop
+running the query::
+
+ from SPARQLWrapper import SPARQLWrapper, CancellationToken, BLAZEGRAPH
+
+ token = CancellationToken()
+ sparql = SPARQLWrapper("http://example.org/bigdata/sparql")
+ sparql.setServerType(BLAZEGRAPH)
+ sparql.setCancellationToken(token)
+ result = sparql.query().convert()  # raises QueryCancelled once token.cancel() is called by another thread
+
+@authors: U{Ivan Herman<http://www.ivan-herman.net>}, U{Sergio Fernández<http://www.wikier.org>}, U{Carlos Tejo Alonso<http://www.dayures.net>}
+@organization: U{World Wide Web Consortium<http://www.w3.org>} and U{Foundation CTIC<http://www.fundacionctic.org/>}.
+@license: U{W3C® SOFTWARE NOTICE AND LICENSE<href="http://www.w3.org/Consortium/Legal/copyright-software">}
+@since: 1.8.3
+"""
+
+import itertools
+import Queue
+import socket
+import threading
+
+from SPARQLExceptions import QueryCancelled
+from Deadline import DeadlineResponse
+
+_CHUNK_SIZE = 16 * 1024
+
+
+class CancellationToken(object):
+    """
+    Token cancelling the queries it is given to. The token is thread-safe: it is usually cancelled by another thread
+    than the one running the queries. Once cancelled, it stays cancelled.
+    """
+
+    def __init__(self):
+        self._event = threading.Event()
+        self._callbacks = {}
+        self._keys = itertools.count()
+        self._lock = threading.Lock()
+
+    @property
+    def cancelled(self):
+        """C{True} once the token has been cancelled."""
+        return self._event.is_set()
+
+    def cancel(self):
+        """Cancel the queries of the token. The registered callbacks are called (once) by the calling thread."""
+        with self._lock:
+            if self._event.is_set():
+                return
+            self._event.set()
+            callbacks, self._callbacks = list(self._callbacks.values()), {}
+        for callback in callbacks:
+            try:
+                callback()
+            except Exception:
+                pass  # a failing callback must not prevent the others from running
+
+    def raiseIfCancelled(self):
+        """
+        Check that the token has not been cancelled.
+        @raise QueryCancelled: If it has.
+        """
+        if self._event.is_set():
+            raise QueryCancelled()
+
+    def wait(self, timeout=None):
+        """
+        Wait until the token is cancelled, or the timeout expires.
+        @param timeout: Maximum time to wait, in seconds. Default is C{None}: no limit.
+        @type timeout: float
+        @return: C{True} if the token has been cancelled.
+        @rtype: bool
+        """
+        return self._event.wait(timeout)
+
+    def register(self, callback):
+        """
+        Register a function to call when the token is cancelled. If it already is, the function is called at once.
+        @param callback: The function, called without any argument.
+        @return: a key for L{unregistering<unregister>} the function.
+        """
+        with self._lock:
+            if not self._event.is_set():
+                key = next(self._keys)
+                self._callbacks[key] = callback
+                return key
+        callback()
+        return None
+
+    def unregister(self, key):
+        """
+        Unregister a function registered with L{register}.
+        @param key: The key returned by L{register}.
+        """
+        with self._lock:
+            self._callbacks.pop(key, None)
+
+
+def callCancellable(token, function, dismiss):
+    """
+    Call a function in another thread, and wait for its result, unless the token is cancelled first.
+    @param token: The cancellation token.
+    @type token: L{CancellationToken}
+    @param function: The function, called without any argument.
+    @param dismiss: Function called with the result of the function, if it is returned once the token is cancelled.
+    @return: the result of the function.
+    @raise QueryCancelled: If the token is cancelled before the function returns.
+    """
+    outcomes = Queue.Queue()
+    lock = threading.Lock()
+    decided = []
+
+    def run():
+        try:
+            outcome = (function(), None)
+        except Exception, e:
+            outcome = (None, e)
+        with lock:
+            if not decided:
+                outcomes.put(outcome)
+                return
+        if outcome[1] is None:
+            dismiss(outcome[0])
+
+    thread = threading.Thread(target=run)
+    thread.daemon = True
+    thread.start()
+    key = token.register(lambda: outcomes.put((None, QueryCancelled())))
+    try:
+        result, error = outcomes.get()
+    finally:
+        token.unregister(key)
+    with lock:
+        decided.append(True)
+    while not outcomes.empty():
+        late, lateError = outcomes.get()
+        if lateError is None:
+            dismiss(late)
+    if error is not None:
+        raise error
+    return result
+
+
+class CancellableResponse(object):
+    """
+    File-like wrapper of a response, raising a L{QueryCancelled<SPARQLWrapper.SPARQLExceptions.QueryCancelled>}
+    exception when the body is read after the token has been cancelled. Cancelling the token aborts the response (a
+    blocked read is interrupted, if the response can shut its connection down). The whole body is read by chunks, so
+    the token is checked while it is downloaded. Any other attribute is the one of the wrapped response.
+
+    @ivar token: The cancellation token.
+    @type token: L{CancellationToken}
+    """
+
+    def __init__(self, response, token, keys=()):
+        """
+        @param response: the wrapped response.
+        @param token: The cancellation token.
+        @type token: L{CancellationToken}
+        @param keys: Keys of the callbacks of the query registered in the token, unregistered once the response is
+        fully read, fails or is closed (so that a token reused by many queries does not keep their callbacks).
+        @type keys: list
+        """
+        self._response = response
+        self.token = token
+        self._keys = list(keys) + [token.register(self.abort)]
+
+    def __getattr__(self, name):
+        return getattr(self._response, name)
+
+    def abort(self):
+        """Abort the response (see L{abortResponse})."""
+        abortResponse(self._response)
+
+    def check(self):
+        """
+        Check that the token has not been cancelled (and that the deadline of the query, if any, is not exceeded).
+        @raise QueryCancelled: If the token has been cancelled.
+        @raise DeadlineExceeded: If the deadline is exceeded.
+        """
+        self.token.raiseIfCancelled()
+        if isinstance(self._response, DeadlineResponse):
+            self._response.check()
+
+    def read(self, amt=None):
+        if amt is None or amt < 0:
+            chunks = []
+            while True:
+                chunk = self.read(_CHUNK_SIZE)
+                if not chunk:
+                    return b"".join(chunks)
+                chunks.append(chunk)
+        self.token.raiseIfCancelled()
+        try:
+            data = self._response.read(amt)
+        except Exception:
+            self._unregister()
+            self.token.raiseIfCancelled()  # the read has been interrupted by the cancellation
+            raise
+        if not data and amt:
+            self._unregister()  # fully read
+        return data
+
+    def readline(self, limit=-1):
+        self.token.raiseIfCancelled()
+        try:
+            if limit is None or limit < 0:
+                line = self._response.readline()
+            else:
+                line = self._response.readline(limit)
+        except Exception:
+            self._unregister()
+            self.token.raiseIfCancelled()
+            raise
+        if not line and limit != 0:
+            self._unregister()  # fully read
+        return line
+
+    def __iter__(self):
+        return self
+
+    def next(self):
+        line = self.readline()
+        if not line:
+            raise StopIteration
+        return line
+
+    def close(self):
+        self._unregister()
+        self._response.close()
+
+    def _unregister(self):
+        """Internal method for unregistering the callbacks of the query from the token, once they are useless."""
+        keys, self._keys = self._keys, []
+        for key in keys:
+            self.token.unregister(key)
+
+
+def abortResponse(response):
+    """
+    Close a response, possibly from another thread than the one reading it: its connection is shut down first (if it
+    can be found), so that a blocked read is interrupted.
+    @param response: The response.
+    """
+    abort = getattr(response, "abort", None)
+    if abort is not None:
+        abort()
+        return
+    sock = _findSocket(response)
+    if sock is not None:
+        try:
+            sock.shutdown(socket.SHUT_RDWR)
+        except socket.error:
+            pass
+    response.close()
+
+
+def _findSocket(response):
+    """Internal function for finding the socket a response of C{urllib2.urlopen} is read from, if any (the objects
+    wrapping it differ between the versions of Python).
+    """
+    candidate = response
+    for _ in range(6):
+        if isinstance(candidate, socket.socket):
+            return candidate
+        candidate = getattr(candidate, "raw", None) or getattr(candidate, "_sock", None) or \
+            getattr(candidate, "fp", None)
+    return None
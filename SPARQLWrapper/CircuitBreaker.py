@@ -0,0 +1,225 @@
+# -*- coding: utf-8 -*-
+
+"""
+Circuit breakers of the SPARQL endpoints (see
+L{SPARQLWrapper.setUseCircuitBreaker<SPARQLWrapper.Wrapper.SPARQLWrapper.setUseCircuitBreaker>}).
+
+When an endpoint is overloaded, each request waits for the full timeout before failing, so the callers pile up. A
+L{CircuitBreaker} watches the outcome and the latency of the recent requests to an endpoint: if too many of them fail
+(or are too slow), the breaker I{opens}, and the requests fail immediately with a
+L{CircuitBreakerOpen<SPARQLWrapper.SPARQLExceptions.CircuitBreakerOpen>} exception, without being sent. After a
+while, the breaker lets a few trial requests through (it is I{half-open}): if they succeed, it I{closes} again.
+
+The breakers are shared by all the wrappers of the process, one per endpoint URL. By default, a breaker with the
+default thresholds is created the first time an endpoint is used; other thresholds can be set with
+L{setCircuitBreaker}::
+
+ from SPARQLWrapper import SPARQLWrapper, CircuitBreaker, setCircuitBreaker
+
+ setCircuitBreaker("http://example.org/sparql", CircuitBreaker(errorRate=0.2, slowCallDuration=5))
+ sparql = SPARQLWrapper("http://example.org/sparql")
+ sparql.setUseCircuitBreaker(True)
+
+@authors: U{Ivan Herman<http://www.ivan-herman.net>}, U{Sergio Fernández<http://www.wikier.org>}, U{Carlos Tejo Alonso<http://www.dayures.net>}
+@organization: U{World Wide Web Consortium<http://www.w3.org>} and U{Foundation CTIC<http://www.fundacionctic.org/>}.
+@license: U{W3C® SOFTWARE NOTICE AND LICENSE<href="http://www.w3.org/Consortium/Legal/copyright-software">}
+@since: 1.8.3
+
+@var CLOSED: state of a breaker letting the requests through.
+@var OPEN: state of a breaker rejecting the requests.
+@var HALF_OPEN: state of a breaker letting a few trial requests through.
+"""
+
+import threading
+import time
+import urllib2
+from collections import deque
+
+from SPARQLExceptions import CircuitBreakerOpen
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half-open"
+
+
+class CircuitBreaker(object):
+    """
+    Circuit breaker of an endpoint. The outcomes of the last L{windowSize} requests are kept: the breaker opens when
+    at least L{minimumRequests} of them are known, and either the rate of failures reaches L{errorRate}, or the rate
+    of the requests slower than L{slowCallDuration} reaches L{slowCallRate}.
+
+    The failures are the C{5XX} and C{429} responses, and the errors raised without any response (eg, a timeout or
+    a connection refused). Other error responses (eg, a malformed query) show that the endpoint is healthy.
+
+    The breaker is thread-safe.
+
+    @ivar errorRate: Rate of failures opening the breaker. Default is C{0.5}.
+    @type errorRate: float
+    @ivar slowCallDuration: Duration (in seconds) of the requests considered too slow. Default is C{None}: the latency
+    is not considered.
+    @type slowCallDuration: float
+    @ivar slowCallRate: Rate of slow requests opening the breaker. Default is C{0.5}.
+    @type slowCallRate: float
+    @ivar windowSize: Number of recent requests considered. Default is C{20}.
+    @type windowSize: int
+    @ivar minimumRequests: Minimum number of known outcomes before the breaker can open. Default is C{10}.
+    @type minimumRequests: int
+    @ivar openDuration: Number of seconds the breaker stays open before letting trial requests through. Default is
+    C{30}.
+    @type openDuration: float
+    @ivar halfOpenRequests: Number of successful trial requests closing the breaker. Default is C{1}.
+    @type halfOpenRequests: int
+    """
+
+    def __init__(self, errorRate=0.5, slowCallDuration=None, slowCallRate=0.5, windowSize=20, minimumRequests=10,
+                 openDuration=30, halfOpenRequests=1):
+        """
+        @param errorRate: Rate of failures opening the breaker.
+        @type errorRate: float
+        @param slowCallDuration: Duration (in seconds) of the requests considered too slow.
+        @type slowCallDuration: float
+        @param slowCallRate: Rate of slow requests opening the breaker.
+        @type slowCallRate: float
+        @param windowSize: Number of recent requests considered.
+        @type windowSize: int
+        @param minimumRequests: Minimum number of known outcomes before the breaker can open.
+        @type minimumRequests: int
+        @param openDuration: Number of seconds the breaker stays open before letting trial requests through.
+        @type openDuration: float
+        @param halfOpenRequests: Number of successful trial requests closing the breaker.
+        @type halfOpenRequests: int
+        """
+        self.errorRate = errorRate
+        self.slowCallDuration = slowCallDuration
+        self.slowCallRate = slowCallRate
+        self.windowSize = windowSize
+        self.minimumRequests = min(minimumRequests, windowSize)
+        self.openDuration = openDuration
+        self.halfOpenRequests = halfOpenRequests
+        self._state = CLOSED
+        self._outcomes = deque(maxlen=windowSize)  # (failed, slow) pairs
+        self._openedAt = None
+        self._trials = 0  # trial requests let through while half-open
+        self._successes = 0  # successful trial requests
+        self._lock = threading.Lock()
+
+    @property
+    def state(self):
+        """The state of the breaker: L{CLOSED}, L{OPEN} or L{HALF_OPEN}."""
+        with self._lock:
+            if self._state == OPEN and time.time() - self._openedAt >= self.openDuration:
+                return HALF_OPEN
+            return self._state
+
+    def allowRequest(self):
+        """
+        Check that a request can be sent. When the breaker is half-open, this takes one of the trial requests, so
+        the outcome of the request must then be L{recorded<record>}.
+        @raise CircuitBreakerOpen: If the request must not be sent.
+        """
+        with self._lock:
+            if self._state == OPEN:
+                if time.time() - self._openedAt < self.openDuration:
+                    raise CircuitBreakerOpen()
+                self._state = HALF_OPEN
+                self._trials = self._successes = 0
+            if self._state == HALF_OPEN:
+                if self._trials >= self.halfOpenRequests:
+                    raise CircuitBreakerOpen()
+                self._trials += 1
+
+    def record(self, latency, error=None):
+        """
+        Record the outcome of a request.
+        @param latency: Time (in seconds) taken by the request, until the response headers were received, or C{None}
+        if the request was cancelled (its outcome is then unknown).
+        @type latency: float
+        @param error: The exception raised when sending the request, if any.
+        @type error: Exception
+        """
+        if latency is None:
+            with self._lock:
+                if self._state == HALF_OPEN:
+                    self._trials -= 1
+            return
+        failed = error is not None and isEndpointFailure(error)
+        slow = self.slowCallDuration is not None and latency >= self.slowCallDuration
+        with self._lock:
+            if self._state == HALF_OPEN:
+                if failed or slow:
+                    self._open()
+                else:
+                    self._successes += 1
+                    if self._successes >= self.halfOpenRequests:
+                        self._state = CLOSED
+                        self._outcomes.clear()
+                return
+            if self._state == OPEN:  # the request was sent before the breaker opened
+                return
+            self._outcomes.append((failed, slow))
+            if len(self._outcomes) < self.minimumRequests:
+                return
+            failures = sum(1 for f, _ in self._outcomes if f)
+            slowCalls = sum(1 for _, s in self._outcomes if s)
+            if failures >= self.errorRate * len(self._outcomes) or \
+                    (self.slowCallDuration is not None and slowCalls >= self.slowCallRate * len(self._outcomes)):
+                self._open()
+
+    def reset(self):
+        """Close the breaker, forgetting the outcomes of the previous requests."""
+        with self._lock:
+            self._state = CLOSED
+            self._outcomes.clear()
+
+    def _open(self):
+        """Internal method for opening the breaker (the lock must be held)."""
+        self._state = OPEN
+        self._openedAt = time.time()
+        self._outcomes.clear()
+
+
+def isEndpointFailure(error):
+    """
+    Check if an error is a failure of the endpoint (a C{5XX} or C{429} response, or an error raised without any
+    response), rather than an error of the request.
+    @param error: The exception raised when sending the request.
+    @type error: Exception
+    @rtype: bool
+    """
+    if isinstance(error, urllib2.HTTPError):
+        return error.code >= 500 or error.code == 429
+    return True
+
+
+_breakers = {}
+_breakersLock = threading.Lock()
+
+
+def getCircuitBreaker(endpoint):
+    """
+    Get the circuit breaker of an endpoint, shared by all the wrappers of the process. A breaker with the default
+    thresholds is created if needed.
+    @param endpoint: The endpoint URL.
+    @type endpoint: string
+    @rtype: L{CircuitBreaker}
+    """
+    with _breakersLock:
+        breaker = _breakers.get(endpoint)
+        if breaker is None:
+            breaker = _breakers[endpoint] = CircuitBreaker()
+        return breaker
+
+
+def setCircuitBreaker(endpoint, breaker):
+    """
+    Set the circuit breaker of an endpoint, shared by all the wrappers of the process.
+    @param endpoint: The endpoint URL.
+    @type endpoint: string
+    @param breaker: The circuit breaker, or C{None} for reverting to a breaker with the default thresholds.
+    @type breaker: L{CircuitBreaker}
+    """
+    with _breakersLock:
+        if breaker is None:
+            _breakers.pop(endpoint, None)
+        else:
+            _breakers[endpoint] = breaker
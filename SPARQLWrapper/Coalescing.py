@@ -0,0 +1,137 @@
+# -*- coding: utf-8 -*-
+
+"""
+Coalescing of identical concurrent queries (see
+L{SPARQLWrapper.setCoalescingGroup<SPARQLWrapper.Wrapper.SPARQLWrapper.setCoalescingGroup>}).
+
+When a popular result is not available yet, many threads often send the very same query within milliseconds. The
+wrappers sharing a L{CoalescingGroup} send a single request instead: the first query of a kind is sent, and the
+identical queries started meanwhile wait for its result. Two queries are identical when their requests are (same
+endpoint, query, parameters, return format, C{Accept} header, credentials, etc, see
+L{requestIdentity<SPARQLWrapper.Transport.requestIdentity>}). The body of the response is read at once, and each
+query gets its own copy of it::
+
+ from SPARQLWrapper import SPARQLWrapper, CoalescingGroup
+
+ group = CoalescingGroup()  # shared by the wrappers of all the threads
+
+ sparql = SPARQLWrapper("http://example.org/sparql")
+ sparql.setCoalescingGroup(group)
+
+Only the queries (not the updates) are coalesced.
+
+@authors: U{Ivan Herman<http://www.ivan-herman.net>}, U{Sergio Fernández<http://www.wikier.org>}, U{Carlos Tejo Alonso<http://www.dayures.net>}
+@organization: U{World Wide Web Consortium<http://www.w3.org>} and U{Foundation CTIC<http://www.fundacionctic.org/>}.
+@license: U{W3C® SOFTWARE NOTICE AND LICENSE<href="http://www.w3.org/Consortium/Legal/copyright-software">}
+@since: 1.8.3
+"""
+
+import threading
+import time
+
+from SPARQLExceptions import DeadlineExceeded, QueryCancelled
+
+
+class _Flight(object):
+    """Internal class for a request in flight, and the queries waiting for its outcome."""
+
+    def __init__(self):
+        self.result = None
+        self.error = None
+        self.waiters = []
+
+
+class CoalescingGroup(object):
+    """
+    Group of queries coalesced when they are identical and concurrent. The group is thread-safe: it is meant to be
+    shared by the wrappers of several threads.
+    """
+
+    def __init__(self):
+        self._flights = {}
+        self._lock = threading.Lock()
+        self._requests = 0
+        self._coalesced = 0
+
+    def do(self, key, function, token=None, expires=None):
+        """
+        Call a function, unless it is already being called for the same key: its result is then waited for.
+        If the query that called the function is cancelled or exceeds its deadline, the queries waiting for its result
+        call the function again instead.
+        @param key: The identity of the request.
+        @param function: The function sending the request, called without any argument.
+        @param token: The cancellation token of the query, if any, which stops waiting for the result.
+        @type token: L{CancellationToken<SPARQLWrapper.Cancellation.CancellationToken>}
+        @param expires: Time (as returned by C{time.time()}) of the deadline of the query, if any, which stops waiting
+        for the result.
+        @type expires: float
+        @return: the result of the function, shared by all the queries of the key.
+        @raise QueryCancelled: If the token is cancelled while waiting for the result.
+        @raise DeadlineExceeded: If the deadline is exceeded while waiting for the result.
+        """
+        while True:
+            with self._lock:
+                flight = self._flights.get(key)
+                leader = flight is None
+                if leader:
+                    flight = self._flights[key] = _Flight()
+                    self._requests += 1
+                else:
+                    self._coalesced += 1
+                    wake = threading.Event()
+                    flight.waiters.append(wake)
+            if leader:
+                return self._lead(key, flight, function)
+            _wait(wake, token, expires)
+            if flight.error is not None and not isinstance(flight.error, (QueryCancelled, DeadlineExceeded)):
+                raise flight.error
+            if flight.error is None and flight.result is not None:
+                return flight.result
+            # the query that sent the request has been abandoned: send it again
+
+    def getCounters(self):
+        """
+        Get the counters of the group, for monitoring.
+        @return: a dictionary with the number of C{requests} sent, and of the queries which waited for the result of
+        an identical one instead (C{coalesced}).
+        @rtype: dict
+        """
+        with self._lock:
+            return {"requests": self._requests, "coalesced": self._coalesced}
+
+    def _lead(self, key, flight, function):
+        """Internal method for calling the function of a flight, and waking the queries waiting for it up."""
+        try:
+            flight.result = function()
+            return flight.result
+        except Exception, e:
+            flight.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._flights[key]
+                waiters = flight.waiters
+            for wake in waiters:
+                wake.set()
+
+
+def _wait(wake, token, expires):
+    """
+    Internal function for waiting until a flight is done.
+    @raise QueryCancelled: If the token is cancelled first.
+    @raise DeadlineExceeded: If the deadline is exceeded first.
+    """
+    key = token.register(wake.set) if token is not None else None
+    try:
+        while not wake.is_set():
+            timeout = None
+            if expires is not None:
+                timeout = expires - time.time()
+                if timeout <= 0:
+                    raise DeadlineExceeded()
+            wake.wait(timeout)
+        if token is not None:
+            token.raiseIfCancelled()
+    finally:
+        if key is not None:
+            token.unregister(key)
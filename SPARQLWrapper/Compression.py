@@ -0,0 +1,143 @@
+# -*- coding: utf-8 -*-
+
+"""
+Transparent decompression of the C{gzip} and C{deflate} HTTP content encodings.
+
+The body is decompressed incrementally while it is read, so the conversion methods of
+L{QueryResult<SPARQLWrapper.Wrapper.QueryResult>} (and the iteration over its lines) see the plain bytes without
+the whole compressed body being buffered first.
+
+@authors: U{Ivan Herman<http://www.ivan-herman.net>}, U{Sergio Fernández<http://www.wikier.org>}, U{Carlos Tejo Alonso<http://www.dayures.net>}
+@organization: U{World Wide Web Consortium<http://www.w3.org>} and U{Foundation CTIC<http://www.fundacionctic.org/>}.
+@license: U{W3C® SOFTWARE NOTICE AND LICENSE<href="http://www.w3.org/Consortium/Legal/copyright-software">}
+@since: 1.8.3
+"""
+
+import zlib
+
+ACCEPT_ENCODING = "gzip, deflate"
+"""Value of the C{Accept-Encoding} header sent when compression is used."""
+
+# wbits values of zlib: gzip (with header), zlib-wrapped deflate, and raw deflate (sent by some servers).
+_WBITS = {"gzip": 16 + zlib.MAX_WBITS, "x-gzip": 16 + zlib.MAX_WBITS, "deflate": zlib.MAX_WBITS}
+_RAW_DEFLATE = -zlib.MAX_WBITS
+
+_CHUNK_SIZE = 16 * 1024
+
+
+def _contentEncoding(headers):
+    return (headers.get("content-encoding") or "").strip().lower()
+
+
+def decodeResponse(response):
+    """
+    Wrap a response whose body is compressed (according to its C{Content-Encoding} header) into a
+    L{DecompressingResponse}. Other responses (including objects without headers) are returned unchanged.
+    @param response: file-like object, as returned by C{urllib2.urlopen}.
+    @return: the response, decompressing its body if needed.
+    """
+    if not hasattr(response, "info"):
+        return response
+    encoding = _contentEncoding(response.info())
+    if encoding in _WBITS:
+        return DecompressingResponse(response, encoding)
+    return response
+
+
+def decodeBody(body, headers):
+    """
+    Decompress a whole body according to the C{Content-Encoding} header.
+    @param body: the (possibly compressed) body.
+    @type body: bytes
+    @param headers: the response headers.
+    @return: the plain body.
+    @rtype: bytes
+    """
+    encoding = _contentEncoding(headers)
+    if encoding not in _WBITS or not body:
+        return body
+    try:
+        return zlib.decompress(body, _WBITS[encoding])
+    except zlib.error:
+        if encoding != "deflate":
+            raise
+        return zlib.decompress(body, _RAW_DEFLATE)
+
+
+class DecompressingResponse(object):
+    """
+    File-like wrapper decompressing the body of a response while it is read. Any other attribute (C{info()},
+    C{geturl()}, C{code}, etc) is the one of the wrapped response, so the headers still show the original
+    C{Content-Encoding} and C{Content-Length}.
+    """
+
+    def __init__(self, response, encoding):
+        """
+        @param response: the wrapped response.
+        @param encoding: the content encoding, C{gzip} or C{deflate}.
+        @type encoding: string
+        """
+        self._response = response
+        self._encoding = encoding
+        self._decompressor = zlib.decompressobj(_WBITS[encoding])
+        self._started = False
+        self._buffer = b""
+        self._eof = False
+
+    def __getattr__(self, name):
+        return getattr(self._response, name)
+
+    def _fill(self):
+        """Internal method for decompressing some more data into the buffer.
+        @return: C{False} once the end of the body has been reached.
+        @rtype: bool
+        """
+        if self._eof:
+            return False
+        raw = self._decompressor.unconsumed_tail or self._response.read(_CHUNK_SIZE)
+        if not raw:
+            self._buffer += self._decompressor.flush()
+            self._eof = True
+            return False
+        try:
+            self._buffer += self._decompressor.decompress(raw, _CHUNK_SIZE)
+        except zlib.error:
+            if self._started or self._encoding != "deflate":
+                raise
+            # some servers send raw deflate data, without the zlib wrapper
+            self._decompressor = zlib.decompressobj(_RAW_DEFLATE)
+            self._buffer += self._decompressor.decompress(raw, _CHUNK_SIZE)
+        self._started = True
+        return True
+
+    def read(self, amt=None):
+        if amt is None or amt < 0:
+            while self._fill():
+                pass
+            data, self._buffer = self._buffer, b""
+            return data
+        while len(self._buffer) < amt and self._fill():
+            pass
+        data, self._buffer = self._buffer[:amt], self._buffer[amt:]
+        return data
+
+    def readline(self, limit=-1):
+        while b"\n" not in self._buffer and self._fill():
+            pass
+        end = self._buffer.find(b"\n") + 1 or len(self._buffer)
+        if 0 <= limit < end:
+            end = limit
+        line, self._buffer = self._buffer[:end], self._buffer[end:]
+        return line
+
+    def __iter__(self):
+        return self
+
+    def next(self):
+        line = self.readline()
+        if not line:
+            raise StopIteration
+        return line
+
+    def close(self):
+        self._response.close()
@@ -0,0 +1,417 @@
+# -*- coding: utf-8 -*-
+
+"""
+A simple pool of persistent HTTP(S) connections, used by L{SPARQLWrapper<SPARQLWrapper.Wrapper.SPARQLWrapper>} when
+keep-alive is enabled (see L{SPARQLWrapper.setUseKeepAlive<SPARQLWrapper.Wrapper.SPARQLWrapper.setUseKeepAlive>}).
+
+Contrary to the former C{keepalive} based implementation, the pool is not installed as a process-global C{urllib2}
+opener: each wrapper owns its pool (or several wrappers share the same instance explicitly), so it is not replaced
+when the L{DIGEST<SPARQLWrapper.Wrapper.DIGEST>} authentication builds its own opener.
+
+@authors: U{Ivan Herman<http://www.ivan-herman.net>}, U{Sergio Fernández<http://www.wikier.org>}, U{Carlos Tejo Alonso<http://www.dayures.net>}
+@organization: U{World Wide Web Consortium<http://www.w3.org>} and U{Foundation CTIC<http://www.fundacionctic.org/>}.
+@license: U{W3C® SOFTWARE NOTICE AND LICENSE<href="http://www.w3.org/Consortium/Legal/copyright-software">}
+@since: 1.8.3
+"""
+
+import httplib
+import select
+import socket
+import threading
+import time
+import urllib2
+from urlparse import urlsplit, urljoin
+
+# HTTP status codes that are followed, the same way urllib2 does it.
+_REDIRECT_CODES = [301, 302, 303, 307, 308]
+_MAX_REDIRECTIONS = 10
+
+
+class ConnectionPool(object):
+    """
+    Pool of persistent HTTP(S) connections, keyed by scheme, host and port.
+
+    Idle connections are kept for L{idleTimeout} seconds at most, and checked before being reused: a connection
+    whose socket is readable while idle has been closed (or is otherwise unusable) and it is discarded. If a reused
+    connection turns out to be stale when the request is sent, the request is transparently sent again over a fresh
+    connection.
+
+    The pool is thread-safe, so the same instance can be shared by several L{SPARQLWrapper<SPARQLWrapper.Wrapper.SPARQLWrapper>}
+    instances targeting the same host.
+
+    @ivar maxsize: Maximum number of connections per host. Default is C{10}.
+    @type maxsize: int
+    @ivar idleTimeout: Number of seconds an idle connection is kept in the pool. Default is C{60}.
+    @type idleTimeout: float
+    @ivar block: If C{True}, a request waits until a connection is released when there are already L{maxsize}
+    connections in use for the host. Otherwise (the default) a new connection is opened, but only L{maxsize} are
+    kept once released.
+    @type block: bool
+    """
+
+    def __init__(self, maxsize=10, idleTimeout=60, block=False):
+        """
+        @param maxsize: Maximum number of connections per host.
+        @type maxsize: int
+        @param idleTimeout: Number of seconds an idle connection is kept in the pool.
+        @type idleTimeout: float
+        @param block: Wait for a free connection when L{maxsize} connections are in use for the host.
+        @type block: bool
+        """
+        self.maxsize = maxsize
+        self.idleTimeout = idleTimeout
+        self.block = block
+        self._condition = threading.Condition()
+        self._idle = {}  # (scheme, netloc) -> list of (connection, time of release)
+        self._inUse = {}  # (scheme, netloc) -> number of connections in use
+        self._sending = {}  # request -> [connection, aborted], until the response headers are received
+        self._closed = False
+
+    def urlopen(self, request, timeout=socket._GLOBAL_DEFAULT_TIMEOUT, passwordManager=None, connectTimeout=None):
+        """
+        Send a C{urllib2.Request} over a pooled connection, following redirections as C{urllib2.urlopen} does.
+
+        @param request: The request to send.
+        @type request: C{urllib2.Request}
+        @param timeout: Timeout (in seconds) for the socket operations.
+        @type timeout: float
+        @param passwordManager: Password manager used to answer a C{Digest} authentication challenge, if any.
+        @type passwordManager: C{urllib2.HTTPPasswordMgr}
+        @param connectTimeout: Timeout (in seconds) for opening a new connection. Default is C{None}: C{timeout} is
+        used.
+        @type connectTimeout: float
+        @return: the response, a file-like object with the C{info()} and C{geturl()} methods.
+        @rtype: L{PooledResponse}
+        @raise urllib2.HTTPError: If the response status code is C{4XX} or C{5XX}.
+        @raise urllib2.URLError: If the request could not be sent.
+        """
+        sending = [None, False]  # the connection in use, and whether the request has been aborted (see abort)
+        with self._condition:
+            self._sending[request] = sending
+        try:
+            return self._urlopen(request, timeout, passwordManager, connectTimeout, sending)
+        finally:
+            with self._condition:
+                self._sending.pop(request, None)
+
+    def _urlopen(self, request, timeout, passwordManager, connectTimeout, sending):
+        """
+        Internal method for sending a request, following the redirections and answering the authentication challenge
+        (see L{urlopen}).
+        @param sending: The state of the request (see L{abort}), shared by the requests sent for it.
+        @type sending: list
+        @rtype: L{PooledResponse}
+        """
+        for _ in range(_MAX_REDIRECTIONS + 1):
+            response = self._send(request, timeout, connectTimeout, sending)
+            if response.code in _REDIRECT_CODES and response.info().get("location"):
+                response.read()
+                response.close()
+                newurl = urljoin(request.get_full_url(), response.info().get("location"))
+                request = urllib2.HTTPRedirectHandler().redirect_request(request, response, response.code,
+                                                                        response.msg, response.info(), newurl)
+                if request is None:
+                    break
+                continue
+            if response.code == 401 and passwordManager is not None:
+                response.read()
+                response.close()
+                handler = urllib2.HTTPDigestAuthHandler(passwordManager)
+                handler.parent = _PoolOpener(self, sending)
+                request.timeout = timeout
+                retried = handler.http_error_401(request, response, response.code, response.msg, response.info())
+                if retried is not None:
+                    return retried
+            if response.code >= 400:
+                raise urllib2.HTTPError(response.geturl(), response.code, response.msg, response.info(), response)
+            return response
+        raise urllib2.HTTPError(request.get_full_url(), response.code, "too many redirections", response.info(), response)
+
+    def abort(self, request):
+        """
+        Abort a request sent by another thread (see L{urlopen}), if its response headers have not been received yet:
+        its connection is shut down (and not reused), and the sending thread gets a C{urllib2.URLError}. This covers
+        the redirections and the authentication challenge, as well as the wait for a free connection.
+        @param request: The request.
+        @type request: C{urllib2.Request}
+        @return: C{True} if the request was in flight.
+        @rtype: bool
+        """
+        with self._condition:
+            sending = self._sending.get(request)
+            if sending is None:
+                return False
+            sending[1] = True
+            connection = sending[0]
+            self._condition.notify_all()  # if waiting for a free connection
+        if connection is not None and connection.sock is not None:
+            try:
+                connection.sock.shutdown(socket.SHUT_RDWR)
+            except socket.error:
+                pass
+        return True
+
+    def clear(self):
+        """Close all the idle connections of the pool."""
+        with self._condition:
+            for connections in self._idle.values():
+                for connection, _ in connections:
+                    connection.close()
+            self._idle = {}
+
+    def close(self):
+        """Close all the idle connections of the pool, and the connections in use once they are released (eg, once
+        the responses handed out are read): no connection is kept anymore."""
+        with self._condition:
+            self._closed = True
+        self.clear()
+
+    def _send(self, request, timeout, connectTimeout, sending):
+        """
+        Internal method for sending a single request (ie, no redirection is followed).
+        @param sending: The state of the request (see L{abort}).
+        @type sending: list
+        @return: the response.
+        @rtype: L{PooledResponse}
+        @raise urllib2.URLError: If the request has been aborted.
+        """
+        url = request.get_full_url()
+        scheme, netloc, path, query, _ = urlsplit(url)
+        if scheme not in ["http", "https"]:
+            raise urllib2.URLError("unsupported URL scheme '%s'" % scheme)
+        selector = (path or "/") + ("?" + query if query else "")
+        headers = dict(request.header_items())
+        key = (scheme, netloc)
+
+        while True:
+            connection, reused = self._getConnection(key, timeout, sending)
+            try:
+                try:
+                    if connectTimeout is not None and connection.sock is None:
+                        _connect(connection, connectTimeout, timeout)
+                    connection.request(request.get_method(), selector, request.data, headers)
+                    if sending[1]:  # aborted before the socket could be shut down (eg, while connecting)
+                        raise _Aborted()
+                except socket.timeout:
+                    raise
+                except socket.error as e:
+                    if reused:
+                        raise _StaleConnection()
+                    raise urllib2.URLError(e)
+                try:
+                    response = connection.getresponse()
+                except (httplib.BadStatusLine, socket.error) as e:
+                    if reused and not isinstance(e, socket.timeout):
+                        raise _StaleConnection()
+                    raise
+            except _StaleConnection:
+                self._releaseConnection(key, connection, False)
+                if sending[1]:
+                    raise urllib2.URLError("the request has been aborted")
+                continue
+            except:
+                self._releaseConnection(key, connection, False)
+                if sending[1]:
+                    raise urllib2.URLError("the request has been aborted")
+                raise
+            finally:
+                with self._condition:
+                    sending[0] = None
+            return PooledResponse(self, key, connection, response, url)
+
+    def _getConnection(self, key, timeout, sending):
+        """
+        Internal method for checking out a connection for a host. The connection is recorded in the state of the
+        request, so that it can be aborted.
+        @param sending: The state of the request (see L{abort}).
+        @type sending: list
+        @return: a tuple with the connection and a boolean indicating whether it has been reused.
+        @rtype: tuple
+        @raise urllib2.URLError: If the request has been aborted.
+        """
+        with self._condition:
+            while True:
+                if sending[1]:
+                    raise urllib2.URLError("the request has been aborted")
+                idle = self._idle.get(key, [])
+                while idle:
+                    connection, released = idle.pop()
+                    if time.time() - released > self.idleTimeout or not self._isHealthy(connection):
+                        connection.close()
+                        continue
+                    self._inUse[key] = self._inUse.get(key, 0) + 1
+                    connection.timeout = timeout
+                    if connection.sock is not None:
+                        connection.sock.settimeout(None if timeout is socket._GLOBAL_DEFAULT_TIMEOUT else timeout)
+                    sending[0] = connection
+                    return connection, True
+                if self.block and self._inUse.get(key, 0) >= self.maxsize:
+                    self._condition.wait()
+                    continue
+                self._inUse[key] = self._inUse.get(key, 0) + 1
+                scheme, netloc = key
+                if scheme == "https":
+                    connection = httplib.HTTPSConnection(netloc, timeout=timeout)
+                else:
+                    connection = httplib.HTTPConnection(netloc, timeout=timeout)
+                sending[0] = connection
+                return connection, False
+
+    def _releaseConnection(self, key, connection, reusable):
+        """
+        Internal method for giving back a connection to the pool.
+        @param reusable: C{False} if the connection must be closed instead of being kept.
+        @type reusable: bool
+        """
+        with self._condition:
+            self._inUse[key] = self._inUse.get(key, 1) - 1
+            idle = self._idle.setdefault(key, [])
+            if reusable and not self._closed and len(idle) < self.maxsize:
+                idle.append((connection, time.time()))
+            else:
+                connection.close()
+            self._condition.notify()
+
+    @staticmethod
+    def _isHealthy(connection):
+        """
+        Internal method for checking an idle connection. An idle socket must not be readable: if it is, the
+        server has closed it (or sent unexpected data).
+        @rtype: bool
+        """
+        if connection.sock is None:
+            return True  # it will be (re)connected on the next request
+        try:
+            readable, _, _ = select.select([connection.sock], [], [], 0)
+        except (socket.error, ValueError):
+            return False
+        return not readable
+
+
+def _connect(connection, connectTimeout, timeout):
+    """Internal function for opening a connection with its own timeout, the reads using the other one afterwards."""
+    connection.timeout = connectTimeout
+    connection.connect()
+    connection.timeout = timeout
+    connection.sock.settimeout(None if timeout is socket._GLOBAL_DEFAULT_TIMEOUT else timeout)
+
+
+class _StaleConnection(Exception):
+    """Internal exception raised when a reused connection has been closed by the server."""
+
+
+class _Aborted(Exception):
+    """Internal exception raised when a request has been aborted while its connection was opened."""
+
+
+class _PoolOpener(object):
+    """Internal minimal opener, so the C{urllib2} authentication handlers send their retries over the pool (as part of
+    the same request, for L{ConnectionPool.abort})."""
+
+    def __init__(self, pool, sending):
+        self.pool = pool
+        self.sending = sending
+
+    def open(self, request, data=None, timeout=socket._GLOBAL_DEFAULT_TIMEOUT):
+        if data is not None:
+            request.data = data
+        return self.pool._urlopen(request, timeout, None, None, self.sending)
+
+
+class PooledResponse(object):
+    """
+    File-like response read from a pooled connection. The connection is given back to the pool as soon as the
+    body has been fully read (or it is closed if the response is closed before).
+
+    Like the responses of C{urllib2.urlopen}, it provides the C{info()}, C{geturl()} and C{getcode()} methods,
+    and it can be iterated line by line.
+
+    @ivar code: HTTP status code.
+    @type code: int
+    @ivar msg: HTTP reason phrase.
+    @type msg: string
+    @ivar url: URL of the request.
+    @type url: string
+    @ivar headers: HTTP response headers.
+    """
+
+    def __init__(self, pool, key, connection, response, url):
+        self._pool = pool
+        self._key = key
+        self._connection = connection
+        self._response = response
+        self._buffer = b""
+        self.code = response.status
+        self.msg = response.reason
+        self.url = url
+        self.headers = response.msg
+        self._releaseIfDone()
+
+    def info(self):
+        return self.headers
+
+    def geturl(self):
+        return self.url
+
+    def getcode(self):
+        return self.code
+
+    def read(self, amt=None):
+        if amt is None or amt < 0:
+            data = self._buffer + self._response.read()
+            self._buffer = b""
+        elif self._buffer:
+            data, self._buffer = self._buffer[:amt], self._buffer[amt:]
+        else:
+            data = self._response.read(amt)
+        self._releaseIfDone()
+        return data
+
+    def readline(self, limit=-1):
+        while b"\n" not in self._buffer and not self._response.isclosed():
+            chunk = self._response.read(8192)
+            if not chunk:
+                break
+            self._buffer += chunk
+        end = self._buffer.find(b"\n") + 1 or len(self._buffer)
+        if 0 <= limit < end:
+            end = limit
+        line, self._buffer = self._buffer[:end], self._buffer[end:]
+        self._releaseIfDone()
+        return line
+
+    def __iter__(self):
+        return self
+
+    def next(self):
+        line = self.readline()
+        if not line:
+            raise StopIteration
+        return line
+
+    def close(self):
+        if self._connection is not None:
+            reusable = self._response.isclosed() and not self._response.will_close
+            self._response.close()
+            self._release(reusable)
+
+    def abort(self):
+        """Shut the connection down, interrupting a read blocked in another thread, and close the response. The
+        connection is not reused."""
+        connection = self._connection
+        if connection is not None:
+            self._response.will_close = True
+            if connection.sock is not None:
+                try:
+                    connection.sock.shutdown(socket.SHUT_RDWR)
+                except socket.error:
+                    pass
+        self.close()
+
+    def _releaseIfDone(self):
+        if self._connection is not None and self._response.isclosed():
+            self._release(not self._response.will_close)
+
+    def _release(self, reusable):
+        connection, self._connection = self._connection, None
+        self._pool._releaseConnection(self._key, connection, reusable)
@@ -0,0 +1,104 @@
+# -*- coding: utf-8 -*-
+
+"""
+Deadline of a whole query (see L{SPARQLWrapper.setDeadline<SPARQLWrapper.Wrapper.SPARQLWrapper.setDeadline>}).
+
+The timeouts of the sockets apply to each operation: a large result trickling slowly never triggers them. A deadline
+bounds the whole query instead, from the first attempt to the end of the conversion of the result: the timeouts of
+each attempt are bounded by the time left, and the body of the response is read through a L{DeadlineResponse},
+which checks the time left before each read.
+
+@authors: U{Ivan Herman<http://www.ivan-herman.net>}, U{Sergio Fernández<http://www.wikier.org>}, U{Carlos Tejo Alonso<http://www.dayures.net>}
+@organization: U{World Wide Web Consortium<http://www.w3.org>} and U{Foundation CTIC<http://www.fundacionctic.org/>}.
+@license: U{W3C® SOFTWARE NOTICE AND LICENSE<href="http://www.w3.org/Consortium/Legal/copyright-software">}
+@since: 1.8.3
+"""
+
+import socket
+import time
+import urllib2
+
+from SPARQLExceptions import DeadlineExceeded
+
+_CHUNK_SIZE = 16 * 1024
+
+
+def isTimeout(error):
+    """
+    Check if an error is a socket timeout (possibly wrapped in a C{urllib2.URLError}).
+    @param error: The exception raised when sending the request.
+    @type error: Exception
+    @rtype: bool
+    """
+    if isinstance(error, urllib2.URLError) and not isinstance(error, urllib2.HTTPError):
+        error = error.reason
+    return isinstance(error, socket.timeout)
+
+
+class DeadlineResponse(object):
+    """
+    File-like wrapper of a response, raising a L{DeadlineExceeded<SPARQLWrapper.SPARQLExceptions.DeadlineExceeded>}
+    exception (and closing the response) when the body is read after the deadline. The whole body is read by chunks,
+    so the deadline is checked while it is downloaded. Any other attribute is the one of the wrapped response.
+
+    @ivar expires: Time (as returned by C{time.time()}) of the deadline.
+    @type expires: float
+    """
+
+    def __init__(self, response, expires):
+        """
+        @param response: the wrapped response.
+        @param expires: Time (as returned by C{time.time()}) of the deadline.
+        @type expires: float
+        """
+        self._response = response
+        self.expires = expires
+
+    def __getattr__(self, name):
+        return getattr(self._response, name)
+
+    def remaining(self):
+        """
+        Get the time left before the deadline.
+        @return: the time left, in seconds (negative once the deadline is exceeded).
+        @rtype: float
+        """
+        return self.expires - time.time()
+
+    def check(self):
+        """
+        Check that the deadline is not exceeded.
+        @raise DeadlineExceeded: If it is (the response is then closed).
+        """
+        if time.time() >= self.expires:
+            self._response.close()
+            raise DeadlineExceeded()
+
+    def read(self, amt=None):
+        if amt is None or amt < 0:
+            chunks = []
+            while True:
+                chunk = self.read(_CHUNK_SIZE)
+                if not chunk:
+                    return b"".join(chunks)
+                chunks.append(chunk)
+        self.check()
+        return self._response.read(amt)
+
+    def readline(self, limit=-1):
+        self.check()
+        if limit is None or limit < 0:
+            return self._response.readline()
+        return self._response.readline(limit)
+
+    def __iter__(self):
+        return self
+
+    def next(self):
+        line = self.readline()
+        if not line:
+            raise StopIteration
+        return line
+
+    def close(self):
+        self._response.close()
@@ -0,0 +1,136 @@
+# -*- coding: utf-8 -*-
+
+"""
+Hedged queries (see L{SPARQLWrapper.setHedgingPolicy<SPARQLWrapper.Wrapper.SPARQLWrapper.setHedgingPolicy>}).
+
+The latency of the queries sent to replicated endpoints is dominated by the occasional replica that stalls. When the
+response headers of a query have not been received after a while, the same query can be sent again, to another
+replica (see L{ReplicaSet<SPARQLWrapper.LoadBalancing.ReplicaSet>}), or else to the same endpoint: the first
+response is used, and the other one is aborted (or, if the transport can not abort a request in flight, its response
+is closed once received). Only the queries (not the updates) are hedged.
+
+The delay is either fixed, or learned as a percentile of the latency of the recent queries. The extra load is
+bounded by a budget: the hedges are at most a given fraction of the queries::
+
+ from SPARQLWrapper import SPARQLWrapper, HedgingPolicy
+
+ sparql = SPARQLWrapper(["http://replica1.example.org/sparql", "http://replica2.example.org/sparql"])
+ sparql.setHedgingPolicy(HedgingPolicy(percentile=95, budget=0.05))
+
+@authors: U{Ivan Herman<http://www.ivan-herman.net>}, U{Sergio Fernández<http://www.wikier.org>}, U{Carlos Tejo Alonso<http://www.dayures.net>}
+@organization: U{World Wide Web Consortium<http://www.w3.org>} and U{Foundation CTIC<http://www.fundacionctic.org/>}.
+@license: U{W3C® SOFTWARE NOTICE AND LICENSE<href="http://www.w3.org/Consortium/Legal/copyright-software">}
+@since: 1.8.3
+"""
+
+import threading
+from collections import deque
+
+# The learned delay is computed again after this number of new latencies.
+_RECOMPUTE_EVERY = 16
+
+
+class HedgingPolicy(object):
+    """
+    Policy deciding when a query is hedged. The policy is thread-safe, and it can be shared by several wrappers.
+
+    @ivar delay: Fixed delay (in seconds) before hedging a query. Default is C{None}: the delay is learned.
+    @type delay: float
+    @ivar percentile: Percentile of the latency of the recent queries used as the learned delay. Default is C{95}.
+    @type percentile: float
+    @ivar budget: Maximum fraction of hedged queries. Default is C{0.05}.
+    @type budget: float
+    @ivar minSamples: Minimum number of known latencies before a delay is learned (no query is hedged before).
+    Default is C{20}.
+    @type minSamples: int
+    @ivar windowSize: Number of recent latencies the delay is learned from. Default is C{1000}.
+    @type windowSize: int
+    """
+
+    def __init__(self, delay=None, percentile=95, budget=0.05, minSamples=20, windowSize=1000):
+        """
+        @param delay: Fixed delay (in seconds) before hedging a query; by default, it is learned.
+        @type delay: float
+        @param percentile: Percentile of the latency of the recent queries used as the learned delay.
+        @type percentile: float
+        @param budget: Maximum fraction of hedged queries.
+        @type budget: float
+        @param minSamples: Minimum number of known latencies before a delay is learned.
+        @type minSamples: int
+        @param windowSize: Number of recent latencies the delay is learned from.
+        @type windowSize: int
+        @raise ValueError: If C{percentile} is not between C{0} and C{100}.
+        """
+        if not 0 <= percentile <= 100:
+            raise ValueError("percentile must be between 0 and 100")
+        self.delay = delay
+        self.percentile = percentile
+        self.budget = budget
+        self.minSamples = minSamples
+        self.windowSize = windowSize
+        self._latencies = deque(maxlen=windowSize)
+        self._learnedDelay = None
+        self._newLatencies = 0
+        self._requests = 0
+        self._hedges = 0
+        self._wins = 0
+        self._denied = 0
+        self._lock = threading.Lock()
+
+    def startRequest(self):
+        """
+        Count a new query, and get the delay before hedging it.
+        @return: the delay, in seconds, or C{None} if the query must not be hedged.
+        @rtype: float
+        """
+        with self._lock:
+            self._requests += 1
+            if self.delay is not None:
+                return self.delay
+            if len(self._latencies) < self.minSamples:
+                return None
+            if self._learnedDelay is None or self._newLatencies >= _RECOMPUTE_EVERY:
+                latencies = sorted(self._latencies)
+                index = int(round(self.percentile / 100.0 * (len(latencies) - 1)))
+                self._learnedDelay = latencies[index]
+                self._newLatencies = 0
+            return self._learnedDelay
+
+    def allowHedge(self):
+        """
+        Check if a query can be hedged within the budget, and count the hedge.
+        @rtype: bool
+        """
+        with self._lock:
+            if self._hedges + 1 > self.budget * self._requests:
+                self._denied += 1
+                return False
+            self._hedges += 1
+            return True
+
+    def record(self, latency):
+        """
+        Record the latency of a request (until the response headers were received), hedge or not.
+        @param latency: The latency, in seconds.
+        @type latency: float
+        """
+        with self._lock:
+            self._latencies.append(latency)
+            self._newLatencies += 1
+
+    def recordHedgeWin(self):
+        """Count a hedge that answered first."""
+        with self._lock:
+            self._wins += 1
+
+    def getCounters(self):
+        """
+        Get the counters of the policy, for monitoring.
+        @return: a dictionary with the number of C{requests}, of C{hedges} sent, of hedges that answered first
+        (C{hedgeWins}), of hedges not sent because of the budget (C{hedgesDenied}), and the current learned delay
+        (C{learnedDelay}, in seconds, or C{None}).
+        @rtype: dict
+        """
+        with self._lock:
+            return {"requests": self._requests, "hedges": self._hedges, "hedgeWins": self._wins,
+                    "hedgesDenied": self._denied, "learnedDelay": self._learnedDelay}
@@ -0,0 +1,183 @@
+# -*- coding: utf-8 -*-
+
+"""
+Invalidation of the cached query results by the updates (see
+L{SPARQLWrapper.setCache<SPARQLWrapper.Wrapper.SPARQLWrapper.setCache>}).
+
+When an update is sent through a wrapper with a cache, the cached results of the queries it may affect are removed.
+The update is parsed for the graphs it modifies (C{GRAPH}, C{WITH}, C{INTO}, C{CLEAR}, C{DROP}, C{COPY ... TO}, etc),
+and the queries are parsed for the graphs they read (C{FROM} and C{FROM NAMED} clauses, C{default-graph-uri} and
+C{named-graph-uri} parameters): only the results of the queries reading a modified graph are removed. As the default
+dataset of an endpoint may include any graph, the results of the queries without an explicit dataset are always
+removed, and so are all the results of the endpoint when the modified graphs are not known (eg, C{CLEAR ALL}).
+
+@authors: U{Ivan Herman<http://www.ivan-herman.net>}, U{Sergio Fernández<http://www.wikier.org>}, U{Carlos Tejo Alonso<http://www.dayures.net>}
+@organization: U{World Wide Web Consortium<http://www.w3.org>} and U{Foundation CTIC<http://www.fundacionctic.org/>}.
+@license: U{W3C® SOFTWARE NOTICE AND LICENSE<href="http://www.w3.org/Consortium/Legal/copyright-software">}
+@since: 1.8.3
+"""
+
+from Lexer import tokenize
+
+_UPDATE_OPERATIONS = ["INSERT", "DELETE", "LOAD", "CLEAR", "DROP", "CREATE", "COPY", "MOVE", "ADD"]
+
+
+def _resolve(token, prefixes):
+    """
+    Internal function for getting the IRI of a graph name token (an IRI or a prefixed name).
+    @return: the IRI, or C{None} if the token is not a graph name (eg, a variable).
+    """
+    kind, value = token
+    if kind == "iri":
+        return value[1:-1]
+    if kind == "name" and ":" in value and value[0] not in "?$":
+        prefix, _, local = value.rstrip(".").partition(":")
+        return prefixes.get(prefix + ":", prefix + ":") + local
+    return None
+
+
+def _parameterValues(parameters, names):
+    """Internal function for getting the values of some parameters (of a L{QuerySpec<SPARQLWrapper.Wrapper.QuerySpec>})."""
+    values = set()
+    for name, value in parameters:
+        if name in names:
+            values.update(value if isinstance(value, (list, tuple)) else [value])
+    return values
+
+
+def getUpdatedGraphs(update, parameters=()):
+    """
+    Get the graphs an update may modify.
+    @param update: The update.
+    @type update: string
+    @param parameters: The parameters of the request, as C{(name, values)} pairs: the C{using-graph-uri} and
+    C{default-graph-uri} ones may name the default graph of the update.
+    @type parameters: tuple
+    @return: the IRIs of the graphs, plus the ones naming the default graph if it is modified, or C{None} if any graph
+    may be modified.
+    @rtype: set
+    """
+    tokens = list(tokenize(update))
+    prefixes = {}
+    graphs = set()
+    recognized = False
+    default = False
+    depth = 0
+    templateDepth = None
+    pendingTemplate = False
+    withGraph = None
+    i = 0
+
+    def following(index):
+        return tokens[index] if index < len(tokens) else (None, "")
+
+    while i < len(tokens):
+        kind, value = tokens[i]
+        word = value.upper() if kind == "name" else None
+        i += 1
+        if word == "PREFIX":
+            prefixes[following(i)[1]] = following(i + 1)[1][1:-1]
+            i += 2
+        elif kind == "punct":
+            if value == "{":
+                depth += 1
+                if pendingTemplate:
+                    templateDepth, pendingTemplate = depth, False
+            elif value == "}":
+                if depth == templateDepth:
+                    templateDepth = None
+                depth -= 1
+            elif depth == 0:  # a new operation
+                withGraph = None
+        elif word in ["INSERT", "DELETE"]:
+            recognized = True
+            pendingTemplate = True
+        elif word == "WITH":
+            withGraph = _resolve(following(i), prefixes)
+            if withGraph is None:
+                return None
+            graphs.add(withGraph)
+            i += 1
+        elif word in ["GRAPH", "INTO", "TO"]:
+            if word != "GRAPH" and following(i)[1].upper() == "GRAPH":
+                i += 1
+            if following(i)[1].upper() == "DEFAULT":
+                default = True
+                i += 1
+                continue
+            graph = _resolve(following(i), prefixes)
+            if graph is not None:
+                graphs.add(graph)
+                i += 1
+            elif word != "GRAPH" or templateDepth is not None:
+                return None  # eg, a template in a graph given by a variable
+        elif word in ["LOAD", "CLEAR", "DROP", "CREATE", "COPY", "MOVE", "ADD"]:
+            recognized = True
+            if following(i)[1].upper() == "SILENT":
+                i += 1
+            target = following(i)[1].upper()
+            if target in ["ALL", "NAMED"]:
+                return None
+            if target == "DEFAULT":
+                default = True
+                i += 1
+            elif target != "GRAPH":
+                graph = _resolve(following(i), prefixes)
+                if graph is not None:
+                    graphs.add(graph)  # the source of COPY, MOVE and ADD too, to be safe
+                    i += 1
+                if word == "LOAD" and following(i)[1].upper() != "INTO":
+                    default = True
+        elif templateDepth is not None and depth == templateDepth and word != "GRAPH" and value != ".":
+            if withGraph is None:
+                default = True  # a triple of the template outside of any GRAPH
+    if not recognized:
+        return None
+    if default:
+        graphs.update(_parameterValues(parameters, ["default-graph-uri", "using-graph-uri"]))
+    return graphs
+
+
+def getQueryGraphs(query, parameters=()):
+    """
+    Get the graphs of the dataset of a query.
+    @param query: The query.
+    @type query: string
+    @param parameters: The parameters of the request, as C{(name, values)} pairs (the C{default-graph-uri} and
+    C{named-graph-uri} ones).
+    @type parameters: tuple
+    @return: the IRIs of the graphs, or C{None} if the query uses the default dataset of the endpoint.
+    @rtype: set
+    """
+    graphs = _parameterValues(parameters, ["default-graph-uri", "named-graph-uri"])
+    prefixes = {}
+    tokens = tokenize(query)
+    for kind, value in tokens:
+        word = value.upper() if kind == "name" else None
+        if value == "{":
+            break  # the dataset clauses come before the query pattern
+        elif word == "PREFIX":
+            name = next(tokens, (None, ""))[1]
+            prefixes[name] = next(tokens, (None, "<>"))[1][1:-1]
+        elif word == "FROM":
+            token = next(tokens, (None, ""))
+            if token[1].upper() == "NAMED":
+                token = next(tokens, (None, ""))
+            graph = _resolve(token, prefixes)
+            if graph is not None:
+                graphs.add(graph)
+    return graphs or None
+
+
+def isAffected(queryGraphs, updatedGraphs):
+    """
+    Check if the result of a query may be modified by an update.
+    @param queryGraphs: The graphs of the dataset of the query (see L{getQueryGraphs}).
+    @type queryGraphs: set
+    @param updatedGraphs: The graphs the update may modify (see L{getUpdatedGraphs}).
+    @type updatedGraphs: set
+    @rtype: bool
+    """
+    if queryGraphs is None or updatedGraphs is None:
+        return True
+    return not updatedGraphs.isdisjoint(queryGraphs)
@@ -31,3 +31,13 @@ class KeyCaseInsensitiveDict(dict):
         if hasattr(key, "lower"):
             key = key.lower()
         dict.__delitem__(self, key)
+
+    def __contains__(self, key):
+        if hasattr(key, "lower"):
+            key = key.lower()
+        return dict.__contains__(self, key)
+
+    def get(self, key, default=None):
+        if hasattr(key, "lower"):
+            key = key.lower()
+        return dict.get(self, key, default)
@@ -0,0 +1,126 @@
+# -*- coding: utf-8 -*-
+
+"""
+Lexer of the SPARQL queries and updates, for the few things the wrapper needs to know about them (their type, see
+L{SPARQLWrapper.setQuery<SPARQLWrapper.Wrapper.SPARQLWrapper.setQuery>}, and the graphs they use, see
+L{Invalidation<SPARQLWrapper.Invalidation>}).
+
+The text is split into tokens in a single pass, by a regular expression without backtracking: the IRIs, the string
+literals and the comments are tokens of their own, so that a keyword in one of them (eg, C{<http://example.org/select>}
+or C{"ask me"}) is never taken for the type of the query. The scan of a query stops at its first query form keyword:
+the (possibly very large) rest of the query is not read at all.
+
+@authors: U{Ivan Herman<http://www.ivan-herman.net>}, U{Sergio Fernández<http://www.wikier.org>}, U{Carlos Tejo Alonso<http://www.dayures.net>}
+@organization: U{World Wide Web Consortium<http://www.w3.org>} and U{Foundation CTIC<http://www.fundacionctic.org/>}.
+@license: U{W3C® SOFTWARE NOTICE AND LICENSE<href="http://www.w3.org/Consortium/Legal/copyright-software">}
+@since: 1.8.3
+"""
+
+import re
+from collections import namedtuple
+
+_TOKENS = re.compile(
+    r'(?P<iri><[^<>"{}|^`\\\s]*>)'
+    r'|(?P<string>"""(?:[^"\\]|\\.|"(?!""))*"""' r"|'''(?:[^'\\]|\\.|'(?!''))*'''"
+    r'|"(?:[^"\\\n]|\\.)*"' r"|'(?:[^'\\\n]|\\.)*')"
+    r'|(?P<comment>#[^\n]*)'
+    r'|(?P<punct>[{};])'
+    r'|(?P<name>[\w:?$.\-]+)'
+    r'|(?P<other>\S)', re.UNICODE)
+
+# A BASE or PREFIX declaration (or a comment) of the prologue of a query, after some white space.
+_DECLARATION = re.compile(r'\s*(?:#[^\n]*|(?P<declaration>(?:BASE|PREFIX\s*[\w.\-]*:)\s*<[^<>"{}|^`\\\s]*>))',
+                          re.IGNORECASE | re.UNICODE)
+
+# A variable at the start of a name token.
+_VARIABLE = re.compile(r'[?$](\w+)', re.UNICODE)
+
+# The keywords of the query forms and of the update operations (see Wrapper._allowedQueryTypes).
+_KEYWORDS = frozenset(["CONSTRUCT", "SELECT", "ASK", "DESCRIBE", "INSERT", "DELETE", "CREATE", "CLEAR", "DROP",
+                       "LOAD", "COPY", "MOVE", "ADD"])
+
+
+class ScannedQuery(namedtuple("ScannedQuery", ["queryType", "prologueStart", "prologueEnd", "keywordOffset"])):
+    """
+    Outcome of the scan of a query (see L{scanQuery}): its C{queryType} (the first query form or update operation
+    keyword, in upper case, or C{None} if there is none), the offsets of its prologue (from the first to the end of the
+    last C{BASE} and C{PREFIX} declarations: C{prologueStart} and C{prologueEnd} are equal when there is none), and the
+    C{keywordOffset} of the keyword (or the length of the query).
+    @since: 1.8.3
+    """
+    __slots__ = ()
+
+
+def tokenize(text):
+    """
+    Generate the tokens of a query or of an update, without the comments.
+    @param text: The query or the update.
+    @type text: string
+    @return: the C{(kind, value)} pairs of the tokens, where the kind is C{iri}, C{string}, C{punct} (C{{}, C{}} or
+    C{;}), C{name} (a keyword, a variable, a prefixed name, a number, etc) or C{other}.
+    @rtype: generator
+    """
+    for match in _TOKENS.finditer(text):
+        if match.lastgroup != "comment":
+            yield match.lastgroup, match.group()
+
+
+def findVariables(text):
+    """
+    Generate the variables (C{?name} or C{$name}) of a query or of an update, outside of its IRIs, strings and
+    comments.
+    @param text: The query or the update.
+    @type text: string
+    @return: the C{(start, end, name)} of the variables, where C{start} and C{end} are their offsets in the text.
+    @rtype: generator
+    """
+    for match in _TOKENS.finditer(text):
+        if match.lastgroup == "name":
+            variable = _VARIABLE.match(match.group())
+            if variable is not None:
+                yield match.start(), match.start() + variable.end(), variable.group(1)
+
+
+def findPatternStart(query, offset=0):
+    """
+    Find the start of the first group graph pattern of a query after an offset: eg, from the
+    L{keywordOffset<ScannedQuery>} of a C{SELECT} or an C{ASK} query, the start of its C{WHERE} clause.
+    @param query: The query.
+    @type query: string
+    @param offset: The offset to start from.
+    @type offset: int
+    @return: the offset just after the opening brace of the pattern, or C{None} if there is none.
+    @rtype: int
+    """
+    for match in _TOKENS.finditer(query, offset):
+        if match.lastgroup == "punct" and match.group() == "{":
+            return match.end()
+    return None
+
+
+def scanQuery(query):
+    """
+    Scan a query (or an update) until its first query form or update operation keyword.
+    @param query: The query.
+    @type query: string
+    @return: the type and the prologue offsets of the query.
+    @rtype: L{ScannedQuery}
+    """
+    prologueStart = prologueEnd = None
+    position = 0
+    match = _DECLARATION.match(query)
+    while match is not None:
+        if match.group("declaration"):
+            if prologueStart is None:
+                prologueStart = match.start("declaration")
+            prologueEnd = match.end()
+        position = match.end()
+        match = _DECLARATION.match(query, position)
+    for match in _TOKENS.finditer(query, position):
+        if prologueStart is None:
+            prologueStart = prologueEnd = match.start()
+        if match.lastgroup == "name" and match.group().upper() in _KEYWORDS:
+            return ScannedQuery(match.group().upper(), prologueStart, prologueEnd, match.start())
+    if prologueStart is None:
+        prologueStart = prologueEnd = len(query)
+    return ScannedQuery(None, prologueStart, prologueEnd, len(query))
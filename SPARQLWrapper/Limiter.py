@@ -0,0 +1,277 @@
+# -*- coding: utf-8 -*-
+
+"""
+Limits on the requests sent to the SPARQL endpoints, shared by all the wrappers of the process.
+
+Shared endpoints often have quotas on the number of concurrent requests and on the number of requests per second:
+the bursts beyond them are throttled with C{429} or C{503} responses. An L{EndpointLimiter} keeps the requests within
+such quotas, making them wait (or fail at once, with a L{LimitExceeded<SPARQLWrapper.SPARQLExceptions.LimitExceeded>}
+exception) until they can be sent. Once set for an endpoint with L{setLimiter}, it applies to every request sent to
+that endpoint::
+
+ from SPARQLWrapper import SPARQLWrapper, EndpointLimiter, setLimiter
+
+ setLimiter("http://example.org/sparql", EndpointLimiter(maxConcurrency=4, rate=10))
+ sparql = SPARQLWrapper("http://example.org/sparql")
+
+A limiter can also tune its concurrency limit itself (see L{EndpointLimiter.adaptive}), with an additive increase
+while the endpoint answers well, and a multiplicative decrease when it fails or slows down.
+
+@authors: U{Ivan Herman<http://www.ivan-herman.net>}, U{Sergio Fernández<http://www.wikier.org>}, U{Carlos Tejo Alonso<http://www.dayures.net>}
+@organization: U{World Wide Web Consortium<http://www.w3.org>} and U{Foundation CTIC<http://www.fundacionctic.org/>}.
+@license: U{W3C® SOFTWARE NOTICE AND LICENSE<href="http://www.w3.org/Consortium/Legal/copyright-software">}
+@since: 1.8.3
+"""
+
+import threading
+import time
+
+from SPARQLExceptions import LimitExceeded, QueryCancelled
+from CircuitBreaker import isEndpointFailure
+
+# Delay between two checks of a full concurrency limit, when the limiter is polled (see EndpointLimiter.tryAcquire).
+_POLL_INTERVAL = 0.01
+
+
+class EndpointLimiter(object):
+    """
+    Limiter of the requests sent to an endpoint: at most L{maxConcurrency} requests in flight (until their response
+    headers are received), and at most L{rate} requests per second, with bursts of up to L{burst} requests (a token
+    bucket). The limiter is thread-safe.
+
+    The time the requests wait for being sent is counted, see L{getCounters}.
+
+    @ivar maxConcurrency: Maximum number of requests in flight. Default is C{None}: no limit.
+    @type maxConcurrency: int
+    @ivar rate: Maximum number of requests per second. Default is C{None}: no limit.
+    @type rate: float
+    @ivar burst: Maximum number of requests sent at once, when no request has been sent for a while. Default is
+    L{rate} (at least C{1}).
+    @type burst: float
+    @ivar blocking: C{True} if the requests wait until they can be sent (the default), C{False} if they fail at once.
+    @type blocking: bool
+    @ivar maxWait: Maximum time (in seconds) a request waits before failing. Default is C{None}: no limit.
+    @type maxWait: float
+    @ivar adaptive: Tune the concurrency limit, between L{minConcurrency} and L{maxConcurrency}, from the outcome of
+    the requests (AIMD): it grows by one for each round of successful requests, and it is multiplied by
+    L{decreaseFactor} when a request fails (a C{5XX} or C{429} response, or no response) or is slower than
+    L{latencyThreshold}. Default is C{False}.
+    @type adaptive: bool
+    @ivar minConcurrency: Minimum concurrency limit, when it is tuned. Default is C{1}.
+    @type minConcurrency: int
+    @ivar decreaseFactor: Factor the concurrency limit is multiplied by when it is decreased. Default is C{0.5}.
+    @type decreaseFactor: float
+    @ivar latencyThreshold: Latency (in seconds) decreasing the concurrency limit, when it is tuned. Default is
+    C{None}: only the failures decrease it.
+    @type latencyThreshold: float
+    """
+
+    def __init__(self, maxConcurrency=None, rate=None, burst=None, blocking=True, maxWait=None, adaptive=False,
+                 minConcurrency=1, decreaseFactor=0.5, latencyThreshold=None):
+        """
+        @param maxConcurrency: Maximum number of requests in flight.
+        @type maxConcurrency: int
+        @param rate: Maximum number of requests per second.
+        @type rate: float
+        @param burst: Maximum number of requests sent at once.
+        @type burst: float
+        @param blocking: C{True} if the requests wait until they can be sent, C{False} if they fail at once.
+        @type blocking: bool
+        @param maxWait: Maximum time (in seconds) a request waits before failing.
+        @type maxWait: float
+        @param adaptive: Tune the concurrency limit from the outcome of the requests.
+        @type adaptive: bool
+        @param minConcurrency: Minimum concurrency limit, when it is tuned.
+        @type minConcurrency: int
+        @param decreaseFactor: Factor the concurrency limit is multiplied by when it is decreased.
+        @type decreaseFactor: float
+        @param latencyThreshold: Latency (in seconds) decreasing the concurrency limit, when it is tuned.
+        @type latencyThreshold: float
+        @raise ValueError: If C{adaptive} is set without C{maxConcurrency}, or a limit is not positive.
+        """
+        if adaptive and maxConcurrency is None:
+            raise ValueError("an adaptive limiter needs a maxConcurrency")
+        if (maxConcurrency is not None and maxConcurrency < 1) or (rate is not None and rate <= 0):
+            raise ValueError("the limits must be positive")
+        self.maxConcurrency = maxConcurrency
+        self.rate = rate
+        self.burst = burst if burst is not None else max(1.0, rate or 0)
+        self.blocking = blocking
+        self.maxWait = maxWait
+        self.adaptive = adaptive
+        self.minConcurrency = minConcurrency
+        self.decreaseFactor = decreaseFactor
+        self.latencyThreshold = latencyThreshold
+        self._limit = float(maxConcurrency) if maxConcurrency is not None else None
+        self._inFlight = 0
+        self._tokens = self.burst
+        self._refilled = time.time()
+        self._acquired = 0
+        self._rejected = 0
+        self._waitTime = 0.0
+        self._maxWaitTime = 0.0
+        self._condition = threading.Condition()
+
+    @property
+    def concurrencyLimit(self):
+        """The current concurrency limit (tuned if the limiter is L{adaptive}), or C{None}."""
+        with self._condition:
+            return self._currentLimit()
+
+    def acquire(self, blocking=None, timeout=None, cancellationToken=None):
+        """
+        Take the permission to send a request, waiting if needed. The outcome of the request must then be
+        L{recorded<release>}.
+        @param blocking: C{True} for waiting until the request can be sent, C{False} for failing at once. Default is
+        L{blocking}.
+        @type blocking: bool
+        @param timeout: Maximum time (in seconds) to wait, if lower than L{maxWait}.
+        @type timeout: float
+        @param cancellationToken: The cancellation token of the query, if any: cancelling it stops the wait.
+        @type cancellationToken: L{CancellationToken<SPARQLWrapper.Cancellation.CancellationToken>}
+        @return: the time waited, in seconds.
+        @rtype: float
+        @raise LimitExceeded: If the request can not be sent (in time).
+        @raise QueryCancelled: If the token is cancelled before the request can be sent.
+        """
+        if blocking is None:
+            blocking = self.blocking
+        if self.maxWait is not None:
+            timeout = self.maxWait if timeout is None else min(timeout, self.maxWait)
+        start = time.time()
+        key = cancellationToken.register(self._wakeUp) if cancellationToken is not None else None
+        try:
+            with self._condition:
+                while True:
+                    if cancellationToken is not None and cancellationToken.cancelled:
+                        raise QueryCancelled()
+                    now = time.time()
+                    delay = self._tryAcquire(now, start)
+                    if delay is None:
+                        return now - start
+                    if not blocking or (timeout is not None and now - start >= timeout):
+                        self._rejected += 1
+                        raise LimitExceeded()
+                    if timeout is not None:
+                        delay = min(delay or timeout, start + timeout - now)
+                    # without a token of the bucket to wait for, sleep until a request is released (see release)
+                    self._condition.wait(delay or None)
+        finally:
+            if key is not None:
+                cancellationToken.unregister(key)
+
+    def tryAcquire(self, waitingSince=None):
+        """
+        Take the permission to send a request if it can be sent at once. This is meant for the callers which can
+        not block (eg, in an event loop), which poll the limiter instead.
+        @param waitingSince: Time (as returned by C{time.time()}) the caller has been waiting for sending the request
+        since, counted in the wait time once the request can be sent.
+        @type waitingSince: float
+        @return: C{None} if the request can be sent (its outcome must then be L{recorded<release>}), or the time to
+        wait before trying again.
+        @rtype: float
+        """
+        with self._condition:
+            now = time.time()
+            delay = self._tryAcquire(now, waitingSince if waitingSince is not None else now)
+            return None if delay is None else (delay or _POLL_INTERVAL)
+
+    def _wakeUp(self):
+        """Internal method for waking the requests waiting up, eg, for a cancelled one to stop waiting."""
+        with self._condition:
+            self._condition.notify_all()
+
+    def recordRejection(self):
+        """Count a request that has not been sent because it could not wait any longer (see L{tryAcquire})."""
+        with self._condition:
+            self._rejected += 1
+
+    def release(self, latency=None, error=None):
+        """
+        Record the outcome of a request sent (see L{acquire}).
+        @param latency: Time (in seconds) taken by the request, until the response headers were received, or C{None}
+        if the request was cancelled (its outcome is then unknown).
+        @type latency: float
+        @param error: The exception raised when sending the request, if any.
+        @type error: Exception
+        """
+        with self._condition:
+            self._inFlight -= 1
+            if self.adaptive and latency is not None:
+                slow = self.latencyThreshold is not None and latency > self.latencyThreshold
+                if slow or (error is not None and isEndpointFailure(error)):
+                    self._limit = max(float(self.minConcurrency), self._limit * self.decreaseFactor)
+                elif error is None:
+                    self._limit = min(float(self.maxConcurrency), self._limit + 1.0 / self._limit)
+            self._condition.notify_all()
+
+    def getCounters(self):
+        """
+        Get the counters of the limiter, for monitoring.
+        @return: a dictionary with the number of requests sent (C{acquired}) and of the ones that failed without
+        being sent (C{rejected}), the number of requests in flight (C{inFlight}), the current C{concurrencyLimit}, and
+        the total and maximum time (in seconds) the requests waited for being sent (C{waitTime} and C{maxWaitTime}).
+        @rtype: dict
+        """
+        with self._condition:
+            return {"acquired": self._acquired, "rejected": self._rejected, "inFlight": self._inFlight,
+                    "concurrencyLimit": self._currentLimit(), "waitTime": self._waitTime,
+                    "maxWaitTime": self._maxWaitTime}
+
+    def _currentLimit(self):
+        """Internal method for getting the current concurrency limit (the lock must be held)."""
+        return int(self._limit) if self._limit is not None else None
+
+    def _tryAcquire(self, now, start):
+        """
+        Internal method for taking the permission to send a request if possible (the lock must be held).
+        @return: C{None} if the permission has been taken, or else the time to wait for a token of the bucket (C{0}
+        if the concurrency limit is reached: a request must be released first).
+        @rtype: float
+        """
+        if self.rate is not None:
+            self._tokens = min(self.burst, self._tokens + (now - self._refilled) * self.rate)
+            self._refilled = now
+        if self._limit is not None and self._inFlight >= self._currentLimit():
+            return 0
+        if self.rate is not None and self._tokens < 1:
+            return (1 - self._tokens) / self.rate
+        if self.rate is not None:
+            self._tokens -= 1
+        self._inFlight += 1
+        self._acquired += 1
+        waited = now - start
+        self._waitTime += waited
+        self._maxWaitTime = max(self._maxWaitTime, waited)
+        return None
+
+
+_limiters = {}
+_limitersLock = threading.Lock()
+
+
+def getLimiter(endpoint):
+    """
+    Get the limiter of an endpoint, shared by all the wrappers of the process.
+    @param endpoint: The endpoint URL.
+    @type endpoint: string
+    @return: the limiter, or C{None} if the requests to the endpoint are not limited.
+    @rtype: L{EndpointLimiter}
+    """
+    with _limitersLock:
+        return _limiters.get(endpoint)
+
+
+def setLimiter(endpoint, limiter):
+    """
+    Set the limiter of an endpoint, shared by all the wrappers of the process.
+    @param endpoint: The endpoint URL.
+    @type endpoint: string
+    @param limiter: The limiter, or C{None} for not limiting the requests to the endpoint anymore.
+    @type limiter: L{EndpointLimiter}
+    """
+    with _limitersLock:
+        if limiter is None:
+            _limiters.pop(endpoint, None)
+        else:
+            _limiters[endpoint] = limiter
@@ -0,0 +1,212 @@
+# -*- coding: utf-8 -*-
+
+"""
+Load balancing of the queries over several equivalent endpoints (eg, the read replicas of a triple store).
+
+A L{ReplicaSet} can be given to L{SPARQLWrapper<SPARQLWrapper.Wrapper.SPARQLWrapper>} in place of the endpoint (or
+simply a list of endpoint URLs, balanced round-robin)::
+
+ from SPARQLWrapper import SPARQLWrapper, ReplicaSet, EWMAPolicy
+
+ replicas = ReplicaSet(["http://replica1.example.org/sparql", "http://replica2.example.org/sparql"], policy=EWMAPolicy())
+ sparql = SPARQLWrapper(replicas, updateEndpoint="http://primary.example.org/sparql")
+
+Each query is sent to the replica chosen by the L{policy<LoadBalancingPolicy>}, while the updates are sent to the
+update endpoint (by default, the first replica). A replica failing several times in a row is ejected for a while;
+then a single query probes it, and puts it back in the set if it succeeds.
+
+@authors: U{Ivan Herman<http://www.ivan-herman.net>}, U{Sergio Fernández<http://www.wikier.org>}, U{Carlos Tejo Alonso<http://www.dayures.net>}
+@organization: U{World Wide Web Consortium<http://www.w3.org>} and U{Foundation CTIC<http://www.fundacionctic.org/>}.
+@license: U{W3C® SOFTWARE NOTICE AND LICENSE<href="http://www.w3.org/Consortium/Legal/copyright-software">}
+@since: 1.8.3
+"""
+
+import itertools
+import random
+import threading
+import time
+
+from CircuitBreaker import isEndpointFailure
+
+
+class LoadBalancingPolicy(object):
+    """
+    Base class of the load balancing policies. A policy can be shared by several replica sets.
+    """
+
+    def choose(self, replicas):
+        """
+        Choose the replica a query is sent to.
+        @param replicas: The replicas in the set (not ejected), never empty.
+        @type replicas: list of L{Replica}
+        @rtype: L{Replica}
+        """
+        raise NotImplementedError("LoadBalancingPolicy.choose must be implemented by subclasses")
+
+
+class RoundRobinPolicy(LoadBalancingPolicy):
+    """
+    Send the queries to each replica in turn.
+    """
+
+    def __init__(self):
+        self._counter = itertools.count()
+
+    def choose(self, replicas):
+        return replicas[next(self._counter) % len(replicas)]
+
+
+class LeastOutstandingPolicy(LoadBalancingPolicy):
+    """
+    Send each query to the replica with the fewest requests in flight (chosen at random among the ties).
+    """
+
+    def choose(self, replicas):
+        fewest = min(replica.outstanding for replica in replicas)
+        return random.choice([replica for replica in replicas if replica.outstanding == fewest])
+
+
+class EWMAPolicy(LoadBalancingPolicy):
+    """
+    Send each query to the replica with the lowest expected latency: its exponentially weighted moving average
+    latency (see L{Replica.latency}), multiplied by the number of requests in flight, plus one. The replicas without
+    any known latency yet are tried first.
+    """
+
+    def choose(self, replicas):
+        return min(replicas, key=lambda replica: (replica.latency or 0.0) * (replica.outstanding + 1))
+
+
+class Replica(object):
+    """
+    A replica of a L{ReplicaSet}, with its statistics. Users should not create instances of this class directly.
+
+    @ivar url: URL of the endpoint.
+    @type url: string
+    @ivar outstanding: Number of requests in flight.
+    @type outstanding: int
+    @ivar latency: Exponentially weighted moving average of the latency (in seconds) of the successful requests, or
+    C{None} if it is not known yet.
+    @type latency: float
+    @ivar consecutiveFailures: Number of requests failed in a row.
+    @type consecutiveFailures: int
+    @ivar ejectedUntil: Time (as returned by C{time.time()}) the replica is ejected until, or C{None}.
+    @type ejectedUntil: float
+    @ivar probing: C{True} while a query probes the replica, once its ejection is over.
+    @type probing: bool
+    """
+
+    def __init__(self, url):
+        self.url = url
+        self.outstanding = 0
+        self.latency = None
+        self.consecutiveFailures = 0
+        self.ejectedUntil = None
+        self.probing = False
+
+    def __repr__(self):
+        return "<Replica %s>" % self.url
+
+
+class ReplicaSet(object):
+    """
+    Set of equivalent query endpoints. The replica set is thread-safe, and it can be shared by several wrappers.
+
+    @ivar replicas: The replicas.
+    @type replicas: list of L{Replica}
+    @ivar policy: The load balancing policy. Default is a L{RoundRobinPolicy} instance.
+    @type policy: L{LoadBalancingPolicy}
+    @ivar maxFailures: Number of failures in a row ejecting a replica. Default is C{3}.
+    @type maxFailures: int
+    @ivar ejectionDuration: Number of seconds a replica is ejected before being probed. Default is C{30}.
+    @type ejectionDuration: float
+    @ivar decay: Weight of the last latency in the moving average of the latency. Default is C{0.3}.
+    @type decay: float
+    """
+
+    def __init__(self, endpoints, policy=None, maxFailures=3, ejectionDuration=30, decay=0.3):
+        """
+        @param endpoints: URLs of the endpoints.
+        @type endpoints: list of string
+        @param policy: The load balancing policy. Default is a L{RoundRobinPolicy} instance.
+        @type policy: L{LoadBalancingPolicy}
+        @param maxFailures: Number of failures in a row ejecting a replica.
+        @type maxFailures: int
+        @param ejectionDuration: Number of seconds a replica is ejected before being probed.
+        @type ejectionDuration: float
+        @param decay: Weight of the last latency in the moving average of the latency.
+        @type decay: float
+        @raise ValueError: If there is no endpoint.
+        """
+        if not endpoints:
+            raise ValueError("A replica set needs at least one endpoint")
+        self.replicas = [Replica(url) for url in endpoints]
+        self.policy = policy if policy is not None else RoundRobinPolicy()
+        self.maxFailures = maxFailures
+        self.ejectionDuration = ejectionDuration
+        self.decay = decay
+        self._lock = threading.Lock()
+
+    @property
+    def urls(self):
+        """The URLs of the endpoints."""
+        return [replica.url for replica in self.replicas]
+
+    def acquire(self, exclude=()):
+        """
+        Choose the replica a query is sent to, and count the query as in flight: its outcome must then be
+        L{recorded<release>}.
+
+        An ejected replica is probed, with a single query, once its ejection is over. If all the replicas are
+        ejected, the query is sent to the one ejected first.
+        @param exclude: Replicas to avoid, if possible (eg, the ones already queried for the same query).
+        @type exclude: collection of L{Replica}
+        @rtype: L{Replica}
+        """
+        with self._lock:
+            now = time.time()
+            chosen = None
+            for replica in self.replicas:
+                if replica.ejectedUntil is not None and replica.ejectedUntil <= now and not replica.probing \
+                        and replica not in exclude:
+                    replica.probing = True
+                    chosen = replica
+                    break
+            if chosen is None:
+                available = [replica for replica in self.replicas if replica.ejectedUntil is None]
+                preferred = [replica for replica in available if replica not in exclude]
+                if preferred or available:
+                    chosen = self.policy.choose(preferred or available)
+                else:
+                    chosen = min(self.replicas, key=lambda replica: replica.ejectedUntil)
+            chosen.outstanding += 1
+            return chosen
+
+    def release(self, replica, latency, error=None):
+        """
+        Record the outcome of a query sent to a replica (see L{acquire}).
+        @param replica: The replica.
+        @type replica: L{Replica}
+        @param latency: Time (in seconds) taken by the request, until the response headers were received, or C{None}
+        if the request was cancelled (its outcome is then unknown).
+        @type latency: float
+        @param error: The exception raised when sending the request, if any.
+        @type error: Exception
+        """
+        with self._lock:
+            replica.outstanding -= 1
+            probing, replica.probing = replica.probing, False
+            if latency is None:
+                return
+            if error is not None and isEndpointFailure(error):
+                replica.consecutiveFailures += 1
+                if probing or replica.consecutiveFailures >= self.maxFailures:
+                    replica.ejectedUntil = time.time() + self.ejectionDuration
+                return
+            replica.consecutiveFailures = 0
+            replica.ejectedUntil = None
+            if error is None:
+                if replica.latency is None:
+                    replica.latency = latency
+                else:
+                    replica.latency = self.decay * latency + (1 - self.decay) * replica.latency
@@ -0,0 +1,205 @@
+# -*- coding: utf-8 -*-
+
+"""
+Loaders coalescing the lookups of single entities into batched queries (the "N+1 queries" fix).
+
+The code paths of an application often look entities up one by one (eg, the label of a resource, for each resource
+of a page). A L{DataLoader} collects the lookups requested within a short time window, and sends them at once
+through L{SPARQLWrapper.queryBatch<SPARQLWrapper.Wrapper.SPARQLWrapper.queryBatch>}, in a C{VALUES} clause::
+
+ from SPARQLWrapper import SPARQLWrapper, DataLoader, IRI
+
+ sparql = SPARQLWrapper("http://example.org/sparql")
+ labels = DataLoader(sparql, "SELECT ?uri ?label WHERE { ?uri rdfs:label ?label }", "uri")
+
+ # in many threads
+ rows = labels.load(IRI("http://example.org/a"))  # the rows of the results for this entity
+
+The results are kept by the loader (each entity is looked up once), which is meant to live as long as a unit of work
+(eg, the handling of a web request): it does not see later changes of the data. See
+L{AsyncDataLoader<SPARQLWrapper.AsyncWrapper.AsyncDataLoader>} for a loader coalescing the lookups of an C{asyncio}
+loop iteration.
+
+@authors: U{Ivan Herman<http://www.ivan-herman.net>}, U{Sergio Fernández<http://www.wikier.org>}, U{Carlos Tejo Alonso<http://www.dayures.net>}
+@organization: U{World Wide Web Consortium<http://www.w3.org>} and U{Foundation CTIC<http://www.fundacionctic.org/>}.
+@license: U{W3C® SOFTWARE NOTICE AND LICENSE<href="http://www.w3.org/Consortium/Legal/copyright-software">}
+@since: 1.8.3
+"""
+
+import threading
+
+from Wrapper import QuerySpec
+from Batching import termKey
+
+
+class Lookup(object):
+    """
+    The pending result of the lookup of an entity (see L{DataLoader.loadAsync}).
+
+    @ivar value: The value looked up.
+    """
+
+    def __init__(self, value):
+        self.value = value
+        self._rows = None
+        self._error = None
+        self._done = threading.Event()
+
+    def done(self):
+        """
+        Check if the result of the lookup is available.
+        @rtype: bool
+        """
+        return self._done.is_set()
+
+    def result(self, timeout=None):
+        """
+        Wait for the result of the lookup.
+        @param timeout: Maximum time (in seconds) to wait. Default is C{None}: no limit.
+        @type timeout: float
+        @return: the rows of the results of the lookup (see
+        L{SPARQLWrapper.queryBatch<SPARQLWrapper.Wrapper.SPARQLWrapper.queryBatch>}).
+        @rtype: list of dict
+        @raise RuntimeError: If the result is not available within the timeout.
+        @raise Exception: The exception raised by the batched query, if it failed.
+        """
+        if not self._done.wait(timeout):
+            raise RuntimeError("the lookup is not done yet")
+        if self._error is not None:
+            raise self._error
+        return list(self._rows)
+
+    def _resolve(self, rows=None, error=None):
+        """Internal method for setting the result of the lookup, and waking its callers up."""
+        self._rows = rows
+        self._error = error
+        self._done.set()
+
+
+class DataLoader(object):
+    """
+    Loader coalescing the lookups requested by several threads within a time window into batched queries. It is
+    thread-safe.
+
+    @ivar sparql: The wrapper sending the queries.
+    @type sparql: L{SPARQLWrapper<SPARQLWrapper.Wrapper.SPARQLWrapper>}
+    @ivar query: The C{SELECT} query of a lookup, either a query string or a
+    L{QuerySpec<SPARQLWrapper.Wrapper.QuerySpec>}. It must project the variable of the lookups.
+    @ivar variable: The name of the variable of the lookups (without C{?}).
+    @type variable: string
+    @ivar window: Time (in seconds) the lookups are collected for, from the first one, before being sent. Default is
+    C{0.002}.
+    @type window: float
+    @ivar maxRows: Maximum number of lookups sent in a request (see
+    L{SPARQLWrapper.queryBatch<SPARQLWrapper.Wrapper.SPARQLWrapper.queryBatch>}). Default is C{500}.
+    @type maxRows: int
+    """
+
+    def __init__(self, sparql, query, variable, window=0.002, maxRows=500):
+        """
+        @param sparql: The wrapper sending the queries.
+        @type sparql: L{SPARQLWrapper<SPARQLWrapper.Wrapper.SPARQLWrapper>}
+        @param query: The C{SELECT} query of a lookup.
+        @param variable: The name of the variable of the lookups.
+        @type variable: string
+        @param window: Time (in seconds) the lookups are collected for, before being sent.
+        @type window: float
+        @param maxRows: Maximum number of lookups sent in a request.
+        @type maxRows: int
+        """
+        self.sparql = sparql
+        self.query = query if isinstance(query, QuerySpec) else sparql.prepare(query)
+        self.variable = variable
+        self.window = window
+        self.maxRows = maxRows
+        self._lookups = {}  # by key of the value looked up
+        self._pending = []
+        self._lock = threading.Lock()
+
+    def load(self, value, timeout=None):
+        """
+        Look an entity up, waiting for the batched query.
+        @param value: The value of the variable of the lookup (see L{Template<SPARQLWrapper.Template>}).
+        @param timeout: Maximum time (in seconds) to wait. Default is C{None}: no limit.
+        @type timeout: float
+        @return: the rows of the results of the lookup.
+        @rtype: list of dict
+        """
+        return self.loadAsync(value).result(timeout)
+
+    def loadMany(self, values, timeout=None):
+        """
+        Look several entities up, in the same batched queries.
+        @param values: The values of the variable of the lookups.
+        @type values: iterable
+        @param timeout: Maximum time (in seconds) to wait for each lookup. Default is C{None}: no limit.
+        @type timeout: float
+        @return: the rows of the results of each lookup, in the order of the values.
+        @rtype: list of list of dict
+        """
+        lookups = [self.loadAsync(value) for value in values]
+        return [lookup.result(timeout) for lookup in lookups]
+
+    def loadAsync(self, value):
+        """
+        Request the lookup of an entity, without waiting for it. The lookup is sent once the time L{window} of the
+        first pending lookup is over, unless the entity has been looked up already.
+        @param value: The value of the variable of the lookup.
+        @return: the pending result of the lookup.
+        @rtype: L{Lookup}
+        """
+        key = termKey(value)
+        with self._lock:
+            lookup = self._lookups.get(key)
+            if lookup is not None:
+                return lookup
+            lookup = self._lookups[key] = Lookup(value)
+            self._pending.append((key, lookup))
+            if len(self._pending) == 1:
+                timer = threading.Timer(self.window, self.dispatch)
+                timer.daemon = True
+                timer.start()
+        return lookup
+
+    def dispatch(self):
+        """Send the pending lookups at once, in the current thread."""
+        with self._lock:
+            pending, self._pending = self._pending, []
+        if not pending:
+            return
+        try:
+            results = self.sparql.queryBatch(self.query, [{self.variable: lookup.value} for _, lookup in pending],
+                                             self.maxRows)
+        except Exception, e:
+            with self._lock:
+                for key, lookup in pending:
+                    if self._lookups.get(key) is lookup:
+                        del self._lookups[key]  # looked up again by the next callers
+            for _, lookup in pending:
+                lookup._resolve(error=e)
+        else:
+            for (_, lookup), rows in zip(pending, results):
+                lookup._resolve(rows)
+
+    def prime(self, value, rows):
+        """
+        Set the result of a lookup, eg, from the results of another query.
+        @param value: The value of the variable of the lookup.
+        @param rows: The rows of the results of the lookup.
+        @type rows: list of dict
+        """
+        lookup = Lookup(value)
+        lookup._resolve(list(rows))
+        with self._lock:
+            self._lookups[termKey(value)] = lookup
+
+    def clear(self, value=None):
+        """
+        Forget the result of a lookup, or of all of them, so that the entities are looked up again.
+        @param value: The value of the variable of the lookup. Default is C{None}: all the lookups.
+        """
+        with self._lock:
+            if value is None:
+                self._lookups.clear()
+            else:
+                self._lookups.pop(termKey(value), None)
@@ -0,0 +1,194 @@
+# -*- coding: utf-8 -*-
+
+"""
+Retry policy of L{SPARQLWrapper<SPARQLWrapper.Wrapper.SPARQLWrapper>} (see
+L{SPARQLWrapper.setRetryPolicy<SPARQLWrapper.Wrapper.SPARQLWrapper.setRetryPolicy>}).
+
+Overloaded endpoints shed requests with a C{429}, C{502}, C{503} or C{504} status, or by resetting connections. A
+L{RetryPolicy} sends such requests again, after an exponentially growing, randomized delay (or the delay asked by the
+C{Retry-After} header of the response)::
+
+ from SPARQLWrapper import SPARQLWrapper, RetryPolicy
+
+ sparql = SPARQLWrapper("http://example.org/sparql")
+ sparql.setRetryPolicy(RetryPolicy(maxAttempts=5, backoffFactor=1))
+
+@authors: U{Ivan Herman<http://www.ivan-herman.net>}, U{Sergio Fernández<http://www.wikier.org>}, U{Carlos Tejo Alonso<http://www.dayures.net>}
+@organization: U{World Wide Web Consortium<http://www.w3.org>} and U{Foundation CTIC<http://www.fundacionctic.org/>}.
+@license: U{W3C® SOFTWARE NOTICE AND LICENSE<href="http://www.w3.org/Consortium/Legal/copyright-software">}
+@since: 1.8.3
+"""
+
+import httplib
+import random
+import socket
+import threading
+import time
+import urllib2
+from collections import Counter
+from email.utils import parsedate_tz, mktime_tz
+
+RETRYABLE_STATUSES = (429, 502, 503, 504)
+"""HTTP status codes retried by default."""
+
+RETRYABLE_EXCEPTIONS = (urllib2.URLError, socket.error, httplib.HTTPException)
+"""Exceptions retried by default: connection failures, resets and timeouts, and malformed responses."""
+
+
+class RetryPolicy(object):
+    """
+    Policy deciding whether, and when, a failed request is sent again.
+
+    The delay before the attempt C{n + 1} is C{backoffFactor * 2 ** (n - 1)} seconds, at most L{maxBackoff}, reduced
+    by a random fraction of at most L{jitter} (so that the clients failing together do not retry together). If the
+    response has a C{Retry-After} header, its delay is used instead, unless it is longer than L{maxRetryAfter}: then
+    the request is not retried.
+
+    SPARQL Update requests are not idempotent, so they are not retried, unless L{retryUpdates} is set.
+
+    The policy is thread-safe, and it can be shared by several wrappers. It counts the retries, see L{getCounters}.
+
+    @ivar maxAttempts: Maximum number of attempts, including the first one. Default is C{3}.
+    @type maxAttempts: int
+    @ivar backoffFactor: Delay (in seconds) before the first retry. Default is C{0.5}.
+    @type backoffFactor: float
+    @ivar maxBackoff: Maximum delay (in seconds) between two attempts. Default is C{30}.
+    @type maxBackoff: float
+    @ivar jitter: Maximum fraction of the delay randomly removed, between C{0} and C{1}. Default is C{0.5}.
+    @type jitter: float
+    @ivar statuses: HTTP status codes of the responses retried.
+    @type statuses: frozenset of int
+    @ivar exceptions: Exceptions retried (the C{urllib2.HTTPError} exceptions are retried according to L{statuses}).
+    @type exceptions: tuple of classes
+    @ivar retryUpdates: Retry the SPARQL Update requests too. Default is C{False}.
+    @type retryUpdates: bool
+    @ivar maxRetryAfter: Maximum delay (in seconds) asked by a C{Retry-After} header that is honoured. Default is C{120}.
+    @type maxRetryAfter: float
+    """
+
+    def __init__(self, maxAttempts=3, backoffFactor=0.5, maxBackoff=30, jitter=0.5, statuses=RETRYABLE_STATUSES,
+                 exceptions=RETRYABLE_EXCEPTIONS, retryUpdates=False, maxRetryAfter=120):
+        """
+        @param maxAttempts: Maximum number of attempts, including the first one.
+        @type maxAttempts: int
+        @param backoffFactor: Delay (in seconds) before the first retry.
+        @type backoffFactor: float
+        @param maxBackoff: Maximum delay (in seconds) between two attempts.
+        @type maxBackoff: float
+        @param jitter: Maximum fraction of the delay randomly removed.
+        @type jitter: float
+        @param statuses: HTTP status codes of the responses retried.
+        @type statuses: iterable of int
+        @param exceptions: Exceptions retried.
+        @type exceptions: tuple of classes
+        @param retryUpdates: Retry the SPARQL Update requests too.
+        @type retryUpdates: bool
+        @param maxRetryAfter: Maximum delay (in seconds) asked by a C{Retry-After} header that is honoured.
+        @type maxRetryAfter: float
+        @raise ValueError: If C{maxAttempts} is lower than C{1}, or C{jitter} is not between C{0} and C{1}.
+        """
+        if maxAttempts < 1:
+            raise ValueError("maxAttempts must be at least 1")
+        if not 0 <= jitter <= 1:
+            raise ValueError("jitter must be between 0 and 1")
+        self.maxAttempts = maxAttempts
+        self.backoffFactor = backoffFactor
+        self.maxBackoff = maxBackoff
+        self.jitter = jitter
+        self.statuses = frozenset(statuses)
+        self.exceptions = tuple(exceptions)
+        self.retryUpdates = retryUpdates
+        self.maxRetryAfter = maxRetryAfter
+        self._retries = Counter()
+        self._exhausted = 0
+        self._lock = threading.Lock()
+
+    def isRetryable(self, error, update=False):
+        """
+        Check if a request failed with an error can be retried (regardless of the number of attempts).
+        @param error: The exception raised when sending the request.
+        @type error: Exception
+        @param update: C{True} if the request is a SPARQL Update request.
+        @type update: bool
+        @rtype: bool
+        """
+        if update and not self.retryUpdates:
+            return False
+        if isinstance(error, urllib2.HTTPError):
+            return error.code in self.statuses
+        return isinstance(error, self.exceptions)
+
+    def getBackoff(self, attempt):
+        """
+        Get the delay before retrying a request after a failed attempt, when no C{Retry-After} header is given.
+        @param attempt: Number of the failed attempt (C{1} for the first one).
+        @type attempt: int
+        @return: the delay, in seconds.
+        @rtype: float
+        """
+        delay = min(self.maxBackoff, self.backoffFactor * 2 ** (attempt - 1))
+        return delay * (1 - self.jitter * random.random())
+
+    def getRetryDelay(self, error, attempt, update=False):
+        """
+        Get the delay before retrying a failed request, and count the retry.
+        @param error: The exception raised when sending the request.
+        @type error: Exception
+        @param attempt: Number of the failed attempt (C{1} for the first one).
+        @type attempt: int
+        @param update: C{True} if the request is a SPARQL Update request.
+        @type update: bool
+        @return: the delay, in seconds, or C{None} if the request must not be retried.
+        @rtype: float
+        """
+        if not self.isRetryable(error, update):
+            return None
+        if attempt >= self.maxAttempts:
+            with self._lock:
+                self._exhausted += 1
+            return None
+        delay = _getRetryAfter(error)
+        if delay is None:
+            delay = self.getBackoff(attempt)
+        elif delay > self.maxRetryAfter:
+            return None
+        with self._lock:
+            self._retries[_getReason(error)] += 1
+        return delay
+
+    def getCounters(self):
+        """
+        Get the counters of the policy, for monitoring.
+        @return: a dictionary with the total number of C{retries}, the number of requests given up after
+        L{maxAttempts} attempts (C{exhausted}), and the number of retries per reason (C{retriesByReason}), ie, per HTTP
+        status code or exception class name.
+        @rtype: dict
+        """
+        with self._lock:
+            return {"retries": sum(self._retries.values()), "exhausted": self._exhausted,
+                    "retriesByReason": dict(self._retries)}
+
+
+def _getReason(error):
+    """Internal function for getting the reason of a retry, as counted by L{RetryPolicy}."""
+    if isinstance(error, urllib2.HTTPError):
+        return error.code
+    return error.__class__.__name__
+
+
+def _getRetryAfter(error):
+    """Internal function for getting the delay (in seconds) asked by the C{Retry-After} header of an error response,
+    either a number of seconds or an HTTP date.
+    @return: the delay, or C{None} if there is no (valid) header.
+    """
+    headers = error.info() if isinstance(error, urllib2.HTTPError) else None
+    value = headers.get("Retry-After") if headers is not None else None
+    if not value:
+        return None
+    value = value.strip()
+    if value.isdigit():
+        return float(value)
+    date = parsedate_tz(value)
+    if date is None:
+        return None
+    return max(0.0, mktime_tz(date) - time.time())
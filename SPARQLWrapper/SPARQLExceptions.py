@@ -65,3 +65,43 @@ class URITooLong(SPARQLWrapperException):
 
     msg = "the URI requested by the client is longer than the server is willing to interpret. Check if the request was sent using GET method instead of POST method."
 
+
+class CircuitBreakerOpen(SPARQLWrapperException):
+    """
+    The request has not been sent, because the circuit breaker of the endpoint is open: the endpoint has been failing
+    (or responding too slowly) recently.
+    @since: 1.8.3
+    """
+
+    msg = "the circuit breaker of the endpoint is open (the endpoint is failing or overloaded), so the request has not been sent. Retry later"
+
+
+class DeadlineExceeded(SPARQLWrapperException):
+    """
+    The deadline of the query (see L{SPARQLWrapper.setDeadline<SPARQLWrapper.Wrapper.SPARQLWrapper.setDeadline>}) has
+    been exceeded, while the request was sent or while the result was read and converted.
+    @since: 1.8.3
+    """
+
+    msg = "the deadline of the query has been exceeded, so the query has been abandoned"
+
+
+class QueryCancelled(SPARQLWrapperException):
+    """
+    The query has been cancelled with its L{CancellationToken<SPARQLWrapper.Cancellation.CancellationToken>}, while
+    the request was sent or while the result was read and converted.
+    @since: 1.8.3
+    """
+
+    msg = "the query has been cancelled"
+
+
+class LimitExceeded(SPARQLWrapperException):
+    """
+    The request has not been sent, because the limiter of the endpoint (see
+    L{EndpointLimiter<SPARQLWrapper.Limiter.EndpointLimiter>}) did not let it through in time: too many requests are
+    in flight, or have been sent recently.
+    @since: 1.8.3
+    """
+
+    msg = "the limits of the endpoint have been exceeded, so the request has not been sent. Retry later"
@@ -289,6 +289,27 @@ class SPARQLWrapper2(SPARQLWrapper.SPARQLWrapper):
         else:
             return res
 
+    def execute(self, spec):
+        """
+            Execute a query prepared with L{prepare<SPARQLWrapper.prepare>} and do an automatic conversion
+            (overriding the L{inherited method<SPARQLWrapper.execute>}).
+
+            If the query type is I{not} SELECT, the method falls back to the
+            L{corresponding method in the superclass<SPARQLWrapper.execute>}.
+            @since: 1.8.3
+
+            @param spec: The request specification.
+            @type spec: L{QuerySpec<SPARQLWrapper.Wrapper.QuerySpec>}
+            @return: query result
+            @rtype: L{Bindings} instance
+        """
+        res = super(SPARQLWrapper2, self).execute(spec)
+
+        if spec.queryType == SELECT:
+            return Bindings(res)
+        else:
+            return res
+
     def queryAndConvert(self):
         """This is here to override the inherited method; it is equivalent to L{query}.
 
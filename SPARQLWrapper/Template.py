@@ -0,0 +1,215 @@
+# -*- coding: utf-8 -*-
+
+"""
+Parameterized queries (see L{QuerySpec.bind<SPARQLWrapper.Wrapper.QuerySpec.bind>}).
+
+A query prepared once with L{SPARQLWrapper.prepare<SPARQLWrapper.Wrapper.SPARQLWrapper.prepare>} can be run many
+times with different values of some of its variables, which are replaced by RDF terms in the query text. The values
+are serialized (and escaped) according to their type, so that no value can change the structure of the query (no
+injection)::
+
+ from SPARQLWrapper import SPARQLWrapper, IRI, Literal, JSON
+
+ sparql = SPARQLWrapper("http://example.org/sparql", returnFormat=JSON)
+ spec = sparql.prepare("SELECT ?label WHERE { $uri rdfs:label ?label FILTER(lang(?label) = $lang) }")
+ for uri in uris:
+     results = sparql.execute(spec.bind(uri=IRI(uri), lang="en")).convert()
+
+The template is split once into the segments between its variables (outside of its IRIs, strings and comments, see
+L{findVariables<SPARQLWrapper.Lexer.findVariables>}), and the type of the query is detected once: binding values
+only joins the segments and the serialized terms.
+
+The values can be:
+ - L{IRI} instances, for IRIs
+ - L{Literal} instances, for literals with a language tag or a datatype
+ - L{Value<SPARQLWrapper.SmartWrapper.Value>} instances, eg, from the results of a previous query
+ - strings, for simple literals
+ - C{bool}, C{int}, C{long}, C{float} and C{Decimal} values, for typed literals (C{xsd:boolean}, C{xsd:integer},
+   C{xsd:double} and C{xsd:decimal})
+
+@authors: U{Ivan Herman<http://www.ivan-herman.net>}, U{Sergio Fernández<http://www.wikier.org>}, U{Carlos Tejo Alonso<http://www.dayures.net>}
+@organization: U{World Wide Web Consortium<http://www.w3.org>} and U{Foundation CTIC<http://www.fundacionctic.org/>}.
+@license: U{W3C® SOFTWARE NOTICE AND LICENSE<href="http://www.w3.org/Consortium/Legal/copyright-software">}
+@since: 1.8.3
+"""
+
+import decimal
+import math
+import re
+import threading
+from collections import namedtuple, OrderedDict
+
+from Lexer import findVariables
+from SmartWrapper import Value
+
+_XSD = "http://www.w3.org/2001/XMLSchema#"
+
+# The characters not allowed in an IRIREF of the SPARQL grammar.
+_INVALID_IRI = re.compile(u'[<>"{}|^`\\\\\u0000- ]')
+
+_LANGUAGE_TAG = re.compile(r"^[a-zA-Z]+(-[a-zA-Z0-9]+)*$")
+
+_ESCAPES = {u"\\": u"\\\\", u'"': u'\\"', u"\n": u"\\n", u"\r": u"\\r", u"\t": u"\\t", u"\b": u"\\b", u"\f": u"\\f"}
+_ESCAPED = re.compile(u'[\\\\"\n\r\t\b\f]')
+
+# Maximum number of templates kept split into segments (the least recently used ones are dropped first).
+_MAX_TEMPLATES = 256
+
+_templates = OrderedDict()
+_templatesLock = threading.Lock()
+
+
+class IRI(unicode):
+    """
+    An IRI, to be bound to a variable of a query (a plain string is bound as a literal).
+    @since: 1.8.3
+    """
+    __slots__ = ()
+
+
+class Literal(namedtuple("Literal", ["value", "lang", "datatype"])):
+    """
+    A literal, to be bound to a variable of a query: its lexical C{value}, with either a C{lang} tag or a C{datatype}
+    IRI (or none of them, for a simple literal).
+    @since: 1.8.3
+    """
+    __slots__ = ()
+
+    def __new__(cls, value, lang=None, datatype=None):
+        if lang is not None and datatype is not None:
+            raise ValueError("a literal can not have both a language tag and a datatype")
+        return super(Literal, cls).__new__(cls, value, lang, datatype)
+
+
+class QueryTemplate(object):
+    """
+    A query split into the segments between its variables (see L{getTemplate}).
+
+    @ivar segments: The text between the variables (one more than the variables).
+    @type segments: tuple of string
+    @ivar variables: The names of the variables, in the order of the text.
+    @type variables: tuple of string
+    @ivar tokens: The variables as written in the text (C{?name} or C{$name}).
+    @type tokens: tuple of string
+    """
+
+    def __init__(self, query):
+        """
+        @param query: The query.
+        @type query: string
+        """
+        segments = []
+        variables = []
+        tokens = []
+        position = 0
+        for start, end, name in findVariables(query):
+            segments.append(query[position:start])
+            variables.append(name)
+            tokens.append(query[start:end])
+            position = end
+        segments.append(query[position:])
+        self.segments = tuple(segments)
+        self.variables = tuple(variables)
+        self.tokens = tuple(tokens)
+
+    def render(self, bindings):
+        """
+        Replace some variables of the query by RDF terms.
+        @param bindings: The values of the variables to replace (see L{toTerm}), by name.
+        @type bindings: dict
+        @return: the query.
+        @rtype: string
+        @raise TypeError: If a value has not a supported type.
+        @raise ValueError: If a value can not be serialized (eg, an IRI with a space).
+        """
+        terms = dict((name, toTerm(value)) for name, value in bindings.items())
+        parts = [self.segments[0]]
+        for name, token, segment in zip(self.variables, self.tokens, self.segments[1:]):
+            parts.append(terms.get(name, token))
+            parts.append(segment)
+        return u"".join(parts)
+
+
+def getTemplate(query):
+    """
+    Get a query split into the segments between its variables. The recently used templates are kept, so that a query
+    is split once for all its bindings.
+    @param query: The query.
+    @type query: string
+    @rtype: L{QueryTemplate}
+    """
+    with _templatesLock:
+        template = _templates.pop(query, None)
+        if template is not None:
+            _templates[query] = template  # most recently used
+            return template
+    template = QueryTemplate(query)
+    with _templatesLock:
+        _templates[query] = template
+        while len(_templates) > _MAX_TEMPLATES:
+            _templates.popitem(last=False)
+    return template
+
+
+def toTerm(value):
+    """
+    Serialize a value as an RDF term of the SPARQL syntax.
+    @param value: The value (see L{Template<SPARQLWrapper.Template>} for the supported types).
+    @return: the RDF term.
+    @rtype: string
+    @raise TypeError: If the value has not a supported type.
+    @raise ValueError: If the value can not be serialized (eg, an IRI with a space, or a blank node).
+    """
+    if isinstance(value, IRI):
+        return _iri(value)
+    if isinstance(value, Literal):
+        if value.lang is not None:
+            if not _LANGUAGE_TAG.match(value.lang):
+                raise ValueError("invalid language tag: %r" % value.lang)
+            return u"%s@%s" % (_string(value.value), value.lang)
+        if value.datatype is not None:
+            return u"%s^^%s" % (_string(value.value), _iri(value.datatype))
+        return _string(value.value)
+    if isinstance(value, Value):
+        if value.type == Value.URI:
+            return _iri(value.value)
+        if value.type in [Value.Literal, Value.TypedLiteral]:
+            return toTerm(Literal(value.value, value.lang, value.datatype if value.lang is None else None))
+        raise ValueError("a blank node can not be bound to a variable")
+    if isinstance(value, bool):
+        return u"true" if value else u"false"
+    if isinstance(value, (int, long)):
+        return unicode(value)
+    if isinstance(value, float):
+        if math.isnan(value):
+            lexical = u"NaN"
+        elif math.isinf(value):
+            lexical = u"INF" if value > 0 else u"-INF"
+        else:
+            lexical = unicode(repr(value))
+        return u'"%s"^^<%sdouble>' % (lexical, _XSD)
+    if isinstance(value, decimal.Decimal):
+        if not value.is_finite():
+            raise ValueError("invalid decimal: %s" % value)
+        return u'"%s"^^<%sdecimal>' % (value, _XSD)
+    if isinstance(value, basestring):
+        return _string(value)
+    raise TypeError("unsupported value type: %s" % type(value).__name__)
+
+
+def _iri(value):
+    """Internal function for serializing an IRI, which must not have any invalid character (there is no escape)."""
+    value = _decode(value)
+    if _INVALID_IRI.search(value):
+        raise ValueError("invalid IRI: %r" % value)
+    return u"<%s>" % value
+
+
+def _string(value):
+    """Internal function for serializing the lexical value of a literal, with its special characters escaped."""
+    return u'"%s"' % _ESCAPED.sub(lambda match: _ESCAPES[match.group()], _decode(value))
+
+
+def _decode(value):
+    """Internal function for getting a value as an unicode-string (decoding utf-8 encoded byte-strings)."""
+    return value.decode("utf-8") if isinstance(value, bytes) else unicode(value)
@@ -0,0 +1,276 @@
+# -*- coding: utf-8 -*-
+
+"""
+Transports used by L{SPARQLWrapper<SPARQLWrapper.Wrapper.SPARQLWrapper>} to send the HTTP requests.
+
+A transport sends a C{urllib2.Request} (as built by the wrapper) and returns a streaming, file-like response,
+providing the status (C{code} attribute), the headers (C{info()} method), the URL (C{geturl()} method) and the body
+(C{read()}, C{readline()} and iteration). Error responses (C{4XX} and C{5XX}) are raised as C{urllib2.HTTPError}, as
+C{urllib2.urlopen} does.
+
+The following transports are available:
+  - L{UrllibTransport}: the default one, based on C{urllib2.urlopen};
+  - L{PooledTransport}: persistent connections of a L{ConnectionPool<SPARQLWrapper.ConnectionPool.ConnectionPool>}
+  (see L{SPARQLWrapper.setUseKeepAlive<SPARQLWrapper.Wrapper.SPARQLWrapper.setUseKeepAlive>});
+  - L{InMemoryTransport}: canned responses, with no network at all (for testing and benchmarking).
+
+Other HTTP stacks can be plugged in by subclassing L{Transport} (see
+L{SPARQLWrapper.setTransport<SPARQLWrapper.Wrapper.SPARQLWrapper.setTransport>}).
+
+@authors: U{Ivan Herman<http://www.ivan-herman.net>}, U{Sergio Fernández<http://www.wikier.org>}, U{Carlos Tejo Alonso<http://www.dayures.net>}
+@organization: U{World Wide Web Consortium<http://www.w3.org>} and U{Foundation CTIC<http://www.fundacionctic.org/>}.
+@license: U{W3C® SOFTWARE NOTICE AND LICENSE<href="http://www.w3.org/Consortium/Legal/copyright-software">}
+@since: 1.8.3
+"""
+
+import socket
+import threading
+import urllib2
+from io import BytesIO
+
+from ConnectionPool import ConnectionPool
+from KeyCaseInsensitiveDict import KeyCaseInsensitiveDict
+
+
+class Transport(object):
+    """
+    Base class of the transports.
+
+    @cvar usesGlobalOpener: C{True} if the requests are sent through the global C{urllib2} opener, which must then
+    be configured for the L{DIGEST<SPARQLWrapper.Wrapper.DIGEST>} authentication. Otherwise, the transport answers
+    the authentication challenge itself, with the password manager given to L{open}.
+    @type usesGlobalOpener: bool
+    @cvar canAbort: C{True} if L{abort} interrupts a request in flight. Otherwise, the wrapper sends the requests of
+    the queries that can be cancelled from another thread, so that they can be abandoned at any time.
+    @type canAbort: bool
+    """
+
+    usesGlobalOpener = False
+    canAbort = False
+
+    def open(self, request, timeout=None, passwordManager=None, connectTimeout=None):
+        """
+        Send a request.
+        @param request: The request to send.
+        @type request: C{urllib2.Request}
+        @param timeout: Timeout (in seconds) for the socket operations. Default is C{None}, the global default timeout.
+        @type timeout: float
+        @param passwordManager: Password manager used to answer a C{Digest} authentication challenge, if any.
+        @type passwordManager: C{urllib2.HTTPPasswordMgr}
+        @param connectTimeout: Timeout (in seconds) for opening the connection, if it differs from C{timeout}
+        (which then applies to the reads only). The wrapper only gives this parameter when a connect timeout is set,
+        so the transports written before it was introduced keep working.
+        @type connectTimeout: float
+        @return: the response, a file-like object with the C{code} attribute and the C{info()} and C{geturl()} methods.
+        @raise urllib2.HTTPError: If the response status code is C{4XX} or C{5XX}.
+        @raise urllib2.URLError: If the request could not be sent.
+        """
+        raise NotImplementedError("Transport.open must be implemented by subclasses")
+
+    def abort(self, request):
+        """
+        Abort a request sent by another thread, if the transport can do it before its response is received (eg, the
+        losing request of a hedged query, see L{HedgingPolicy<SPARQLWrapper.Hedging.HedgingPolicy>}): the thread
+        sending it then gets an exception. By default, nothing is done: the response is closed once received. The
+        transports overriding this method set L{canAbort}.
+        @param request: The request.
+        @type request: C{urllib2.Request}
+        """
+        pass
+
+    def close(self):
+        """Release the resources held by the transport (eg, the persistent connections)."""
+        pass
+
+
+class UrllibTransport(Transport):
+    """
+    Transport based on C{urllib2.urlopen} (more precisely, on the C{urlopener} name of the
+    L{Wrapper<SPARQLWrapper.Wrapper>} module, which can be overridden). This is the default transport.
+
+    C{urllib2} applies a single timeout to the connection and to the reads: the read timeout is used if it is given,
+    otherwise the connect timeout.
+    """
+
+    usesGlobalOpener = True
+
+    def open(self, request, timeout=None, passwordManager=None, connectTimeout=None):
+        import Wrapper  # looked up at call time: tests override Wrapper.urlopener
+        timeout = timeout or connectTimeout
+        if timeout:
+            return Wrapper.urlopener(request, timeout=timeout)
+        return Wrapper.urlopener(request)
+
+
+class PooledTransport(Transport):
+    """
+    Transport using the persistent connections of a L{ConnectionPool<SPARQLWrapper.ConnectionPool.ConnectionPool>}.
+
+    @ivar pool: The connection pool.
+    @type pool: L{ConnectionPool<SPARQLWrapper.ConnectionPool.ConnectionPool>}
+    """
+
+    canAbort = True
+
+    def __init__(self, pool=None):
+        """
+        @param pool: The connection pool, which can be shared with other transports. By default a new one is created.
+        @type pool: L{ConnectionPool<SPARQLWrapper.ConnectionPool.ConnectionPool>}
+        """
+        self.pool = pool if pool is not None else ConnectionPool()
+
+    def open(self, request, timeout=None, passwordManager=None, connectTimeout=None):
+        return self.pool.urlopen(request, timeout=timeout if timeout else socket._GLOBAL_DEFAULT_TIMEOUT,
+                                 passwordManager=passwordManager, connectTimeout=connectTimeout)
+
+    def abort(self, request):
+        self.pool.abort(request)
+
+    def close(self):
+        self.pool.clear()
+
+
+class InMemoryTransport(Transport):
+    """
+    Transport serving canned responses, without any network access. The requests are recorded in L{requests}.
+
+    Each response is registered with L{addResponse}, together with an optional predicate on the request; the
+    first registered response whose predicate accepts the request is served (a response can be served any number of
+    times). For example::
+     transport = InMemoryTransport()
+     transport.addResponse(b'{"head": {}, "boolean": true}', headers={"Content-Type": "application/sparql-results+json"})
+     sparql.setTransport(transport)
+
+    @ivar requests: The requests sent so far.
+    @type requests: list of C{urllib2.Request}
+    """
+
+    def __init__(self):
+        self.requests = []
+        self._responses = []
+        self._lock = threading.Lock()
+
+    def addResponse(self, body, code=200, headers=None, match=None):
+        """
+        Register a canned response.
+        @param body: The response body.
+        @type body: bytes
+        @param code: The HTTP status code. Default is C{200}.
+        @type code: int
+        @param headers: The response headers. Default is C{None}, no header.
+        @type headers: dict
+        @param match: Predicate on the request (a C{urllib2.Request}) or, for convenience, a string that must be
+        part of the URL of the request. Default is C{None}: any request is accepted.
+        @type match: callable or string
+        """
+        if isinstance(match, basestring):
+            fragment = match
+            match = lambda request: fragment in request.get_full_url()
+        self._responses.append((match, code, dict(headers or {}), body))
+
+    def open(self, request, timeout=None, passwordManager=None, connectTimeout=None):
+        with self._lock:
+            self.requests.append(request)
+        for match, code, headers, body in self._responses:
+            if match is None or match(request):
+                response = BufferedResponse(body, headers, request.get_full_url(), code)
+                if code >= 400:
+                    raise urllib2.HTTPError(response.url, code, response.msg, response.info(), response)
+                return response
+        raise urllib2.URLError("no canned response for %s" % request.get_full_url())
+
+
+class BufferedResponse(object):
+    """
+    File-like response whose body is held in memory, with the same interface as the responses of
+    C{urllib2.urlopen}.
+
+    @ivar code: HTTP status code.
+    @type code: int
+    @ivar msg: HTTP reason phrase.
+    @type msg: string
+    @ivar url: URL of the request.
+    @type url: string
+    @ivar headers: HTTP response headers.
+    @type headers: L{KeyCaseInsensitiveDict<SPARQLWrapper.KeyCaseInsensitiveDict.KeyCaseInsensitiveDict>}
+    @ivar closed: C{True} once the response has been closed.
+    @type closed: bool
+    """
+
+    def __init__(self, body, headers, url, code=200, msg=""):
+        """
+        @param body: The response body.
+        @type body: bytes
+        @param headers: The response headers.
+        @type headers: dict
+        @param url: URL of the request.
+        @type url: string
+        @param code: HTTP status code.
+        @type code: int
+        @param msg: HTTP reason phrase.
+        @type msg: string
+        """
+        self._body = BytesIO(body)
+        self.headers = KeyCaseInsensitiveDict(headers)
+        self.url = url
+        self.code = code
+        self.msg = msg
+        self.closed = False
+
+    def info(self):
+        return self.headers
+
+    def geturl(self):
+        return self.url
+
+    def getcode(self):
+        return self.code
+
+    def read(self, amt=-1):
+        return self._body.read(-1 if amt is None else amt)
+
+    def readline(self, limit=-1):
+        return self._body.readline(limit)
+
+    def __iter__(self):
+        return self
+
+    def next(self):
+        line = self._body.readline()
+        if not line:
+            raise StopIteration
+        return line
+
+    def close(self):
+        self.closed = True
+
+
+def requestIdentity(request, *extra):
+    """
+    Get the identity of a request, as built by the wrapper: two requests with the same identity get the same response
+    from the endpoint (provided its data has not changed meanwhile). The identity covers the method, the URL (the
+    endpoint, the query and the other parameters), the body, and the headers (C{Accept}, C{Authorization}, etc).
+    @param request: The request.
+    @type request: C{urllib2.Request}
+    @param extra: Other values the response depends on, not part of the request (eg, the credentials of the
+    L{DIGEST<SPARQLWrapper.Wrapper.DIGEST>} authentication).
+    @return: the identity, usable as a dictionary key.
+    @rtype: tuple
+    """
+    headers = tuple(sorted((name.lower(), value) for name, value in request.header_items()))
+    return (request.get_method(), request.get_full_url(), request.data, headers) + extra
+
+
+def bufferResponse(response):
+    """
+    Read a whole response, so that it can be replayed any number of times.
+    @param response: The response, as returned by a transport (the body is read, and the response closed).
+    @return: a tuple with the body, the headers (with case-insensitive names, whatever the version of Python), the URL
+    and the status code of the response, the arguments of a L{BufferedResponse}.
+    @rtype: tuple
+    """
+    try:
+        body = response.read()
+    finally:
+        response.close()
+    return body, KeyCaseInsensitiveDict(dict(response.info().items())), response.geturl(), getattr(response, "code", 200)
@@ -14,6 +14,7 @@
 
 @var POST: to be used to set HTTP POST
 @var GET: to be used to set HTTP GET. This is the default.
+@var AUTO: to be used to let the wrapper choose between HTTP GET and POST, according to the length of the request URL.
 
 @var SELECT: to be used to set the query type to SELECT. This is, usually, determined automatically.
 @var CONSTRUCT: to be used to set the query type to CONSTRUCT. This is, usually, determined automatically.
@@ -34,6 +35,9 @@
 @var BASIC: BASIC HTTP Authentication method
 @var DIGEST: DIGEST HTTP Authentication method
 
+@var VIRTUOSO: to be used to set the server type to Virtuoso (its timeout parameter is C{timeout}).
+@var BLAZEGRAPH: to be used to set the server type to Blazegraph (its timeout parameter is C{maxQueryTimeMillis}).
+
 @see: U{SPARQL Specification<http://www.w3.org/TR/rdf-sparql-query/>}
 @authors: U{Ivan Herman<http://www.ivan-herman.net>}, U{Sergio Fernández<http://www.wikier.org>}, U{Carlos Tejo Alonso<http://www.dayures.net>}
 @organization: U{World Wide Web Consortium<http://www.w3.org>}, U{Salzburg Research<http://www.salzburgresearch.at>} and U{Foundation CTIC<http://www.fundacionctic.org/>}.
@@ -45,13 +49,36 @@ import urllib
 import urllib2
 from urllib2 import urlopen as urlopener  # don't change the name: tests override it
 import base64
+import copy
+import Queue
 import re
 import sys
+import threading
+import time
+import uuid
 import warnings
+from collections import namedtuple, OrderedDict
 
 import json
+import math
+import operator
 from KeyCaseInsensitiveDict import KeyCaseInsensitiveDict
 from SPARQLExceptions import QueryBadFormed, EndPointNotFound, EndPointInternalError, Unauthorized, URITooLong
+from SPARQLExceptions import CircuitBreakerOpen, DeadlineExceeded, QueryCancelled, LimitExceeded
+from ConnectionPool import ConnectionPool
+from Transport import Transport, UrllibTransport, PooledTransport, BufferedResponse, requestIdentity, bufferResponse
+from Compression import ACCEPT_ENCODING, decodeResponse
+from Retry import RetryPolicy
+from CircuitBreaker import getCircuitBreaker
+from LoadBalancing import ReplicaSet
+from Hedging import HedgingPolicy
+from Deadline import DeadlineResponse, isTimeout
+from Cancellation import CancellationToken, CancellableResponse, callCancellable, abortResponse
+from Limiter import getLimiter
+from Coalescing import CoalescingGroup
+from Cache import ResultCache, CacheEntry, cacheKey, getConditionalHeaders, updateHeaders
+from Invalidation import getQueryGraphs, getUpdatedGraphs
+from Lexer import scanQuery
 from SPARQLWrapper import __agent__
 
 #  From <https://www.w3.org/TR/sparql11-protocol/#query-success>
@@ -240,13 +267,28 @@ _allowedFormats = [JSON, XML, TURTLE, N3, RDF, RDFXML, CSV, TSV]
 # Possible HTTP methods
 POST = "POST"
 GET = "GET"
-_allowedRequests = [POST, GET]
+AUTO = "AUTO"
+_allowedRequests = [POST, GET, AUTO]
+
+# Default maximum length of the request URL for sending a query by GET, when the method is AUTO.
+# Many servers and proxies reject (or silently drop) longer URLs.
+_DEFAULT_MAX_GET_LENGTH = 2048
+
+# Endpoint URI -> length of the shortest request URL rejected with a 414 by the endpoint, shared by all the instances.
+_uriTooLongLengths = {}
+_uriTooLongLock = threading.Lock()
 
 # Possible HTTP Authentication methods
 BASIC = "BASIC"
 DIGEST = "DIGEST"
 _allowedAuth = [BASIC, DIGEST]
 
+# Known types of servers, and the parameter (in milliseconds) of the time a query is allowed to run on the server
+VIRTUOSO = "virtuoso"
+BLAZEGRAPH = "blazegraph"
+_SERVER_TIMEOUT_PARAMETERS = {VIRTUOSO: "timeout", BLAZEGRAPH: "maxQueryTimeMillis"}
+_allowedServerTypes = [VIRTUOSO, BLAZEGRAPH]
+
 # Possible SPARQL/SPARUL query type (aka SPARQL Query forms)
 SELECT     = "SELECT"
 CONSTRUCT  = "CONSTRUCT"
@@ -307,6 +349,16 @@ except ImportError:
 # parameters they do not understand. So: just repeat all possibilities in the final URI. UGLY!!!!!!!
 _returnFormatSetting = ["format", "output", "results"]
 
+# Maximum number of request templates kept by a wrapper, for different settings (the least recently used ones are
+# dropped first), see SPARQLWrapper._getRequestTemplate.
+_MAX_REQUEST_TEMPLATES = 64
+
+# The fields of a QuerySpec the request templates depend on: the query string, the endpoint, the timeouts (which
+# change with each attempt of a query with a deadline) and the id of the query (which changes with each query) are
+# not part of them.
+_requestTemplateKey = operator.attrgetter("agent", "user", "passwd", "http_auth", "onlyConneg", "useCompression",
+                                          "customHttpHeaders", "queryType", "returnFormat", "parameters", "serverType")
+
 #######################################################################################################
 
 
@@ -318,9 +370,14 @@ class SPARQLWrapper(object):
     are retained from one query to the next (in other words, only the query string changes). The instance can also be
     reset to its initial values using the L{resetQuery} method.
 
-    @cvar prefix_pattern: regular expression used to remove base/prefixes in the process of determining the query type.
+    As these settings are mutable, an instance can not be used by several threads through L{setQuery} and L{query}.
+    Instead, L{prepare} takes an immutable snapshot of the settings for a query (a L{QuerySpec}), and L{execute} runs
+    it without touching the instance, so a single instance can be shared by many threads (and so its connection pool).
+
+    @cvar prefix_pattern: regular expression used to remove base/prefixes in the process of determining the query type
+    (not used anymore since version C{1.8.3}, see L{Lexer<SPARQLWrapper.Lexer>}).
     @type prefix_pattern: compiled regular expression (see the C{re} module of Python)
-    @cvar pattern: regular expression used to determine whether a query (without base/prefixes) is of type L{CONSTRUCT}, L{SELECT}, L{ASK}, L{DESCRIBE}, L{INSERT}, L{DELETE}, L{CREATE}, L{CLEAR}, L{DROP}, L{LOAD}, L{COPY}, L{MOVE} or L{ADD}.
+    @cvar pattern: regular expression used to determine whether a query (without base/prefixes) is of type L{CONSTRUCT}, L{SELECT}, L{ASK}, L{DESCRIBE}, L{INSERT}, L{DELETE}, L{CREATE}, L{CLEAR}, L{DROP}, L{LOAD}, L{COPY}, L{MOVE} or L{ADD} (not used anymore since version C{1.8.3}, see L{Lexer<SPARQLWrapper.Lexer>}).
     @type pattern: compiled regular expression (see the C{re} module of Python)
     @cvar comments_pattern: regular expression used to remove comments from a query.
     @type comments_pattern: compiled regular expression (see the C{re} module of Python)
@@ -328,6 +385,8 @@ class SPARQLWrapper(object):
     @type endpoint: string
     @ivar updateEndpoint: SPARQL endpoint's URI for update operations (if it's a different one). Default is C{None}
     @type updateEndpoint: string
+    @ivar replicaSet: The equivalent endpoints the queries are balanced over, if several were given. Default is C{None}.
+    @type replicaSet: L{ReplicaSet<SPARQLWrapper.LoadBalancing.ReplicaSet>}
     @ivar agent: The User-Agent for the HTTP request header.
     @type agent: string
     @ivar _defaultGraph: URI for the default graph. Default is C{None}, the value can be set either via an L{explicit call<addParameter>}("default-graph-uri", uri) or as part of the query string.
@@ -340,10 +399,32 @@ class SPARQLWrapper(object):
     @type http_auth: string
     @ivar onlyConneg: Option for allowing (or not) only HTTP Content Negotiation (so dismiss the use of HTTP parameters).The default value is L{False}.
     @type onlyConneg: boolean
+    @ivar useCompression: Option for asking the endpoint for a compressed (C{gzip} or C{deflate}) response, which is transparently decompressed. The default value is L{True}.
+    @type useCompression: boolean
+    @ivar transport: The transport used to send the requests. Default is a L{UrllibTransport<SPARQLWrapper.Transport.UrllibTransport>} instance.
+    @type transport: L{Transport<SPARQLWrapper.Transport.Transport>}
+    @ivar retryPolicy: The policy for retrying the failed requests. Default is C{None}: the requests are not retried.
+    @type retryPolicy: L{RetryPolicy<SPARQLWrapper.Retry.RetryPolicy>}
+    @ivar useCircuitBreaker: Option for failing fast (or not) when the endpoint is failing or overloaded, using the circuit breaker of the endpoint. The default value is L{False}.
+    @type useCircuitBreaker: boolean
+    @ivar hedgingPolicy: The policy for hedging the slow queries. Default is C{None}: the queries are not hedged.
+    @type hedgingPolicy: L{HedgingPolicy<SPARQLWrapper.Hedging.HedgingPolicy>}
+    @ivar coalescingGroup: The group the identical concurrent queries are coalesced in. Default is C{None}: the queries are not coalesced.
+    @type coalescingGroup: L{CoalescingGroup<SPARQLWrapper.Coalescing.CoalescingGroup>}
+    @ivar cache: The cache of the query results. Default is C{None}: the results are not cached.
+    @type cache: L{ResultCache<SPARQLWrapper.Cache.ResultCache>}
     @ivar customHttpHeaders: Custom HTTP Headers to be included in the request. Important: These headers override previous values (including C{Content-Type}, C{User-Agent}, C{Accept} and C{Authorization} if they are present). It is a dictionary where keys are the header field nada and values are the header values.
     @type customHttpHeaders: dict
     @ivar timeout: The timeout (in seconds) to use for querying the endpoint.
     @type timeout: int
+    @ivar connectTimeout: The timeout (in seconds) for opening a connection to the endpoint, if it differs from L{timeout}. Default is C{None}.
+    @type connectTimeout: float
+    @ivar deadline: The time (in seconds) allowed for a whole query, including the retries and the conversion of the result. Default is C{None}: no deadline.
+    @type deadline: float
+    @ivar serverType: The type of the server of the endpoint, L{VIRTUOSO} or L{BLAZEGRAPH}, if known. Default is C{None}.
+    @type serverType: string
+    @ivar cancellationToken: The token the query can be cancelled with, from another thread. Default is C{None}.
+    @type cancellationToken: L{CancellationToken<SPARQLWrapper.Cancellation.CancellationToken>}
     @ivar queryString: The SPARQL query text.
     @type queryString: string
     @ivar queryType: The type of SPARQL query (aka SPARQL query form), like L{CONSTRUCT}, L{SELECT}, L{ASK}, L{DESCRIBE}, L{INSERT}, L{DELETE}, L{CREATE}, L{CLEAR}, L{DROP}, L{LOAD}, L{COPY}, L{MOVE} or L{ADD} (constants in this module).
@@ -352,8 +433,10 @@ class SPARQLWrapper(object):
     @type returnFormat: string
     @ivar requestMethod: The request method for query or update operations. The possibles values are URL-encoded (L{URLENCODED}) or POST directly (L{POSTDIRECTLY}).
     @type requestMethod: string
-    @ivar method: The invocation method. By default, this is L{GET}, but can be set to L{POST}.
+    @ivar method: The invocation method. By default, this is L{GET}, but can be set to L{POST} or L{AUTO}.
     @type method: string
+    @ivar maxGetLength: Maximum length of the request URL for sending a query by GET, when the method is L{AUTO}. Default is C{2048}.
+    @type maxGetLength: int
     @ivar parameters: The parameters of the request (key/value pairs in a dictionary).
     @type parameters: dict
     @ivar _defaultReturnFormat: The default return format.
@@ -369,9 +452,11 @@ class SPARQLWrapper(object):
     def __init__(self, endpoint, updateEndpoint=None, returnFormat=XML, defaultGraph=None, agent=__agent__):
         """
         Class encapsulating a full SPARQL call.
-        @param endpoint: string of the SPARQL endpoint's URI
+        @param endpoint: string of the SPARQL endpoint's URI, or several equivalent endpoints (a list of URIs or a
+        L{ReplicaSet<SPARQLWrapper.LoadBalancing.ReplicaSet>}) the queries are balanced over.
         @type endpoint: string
-        @param updateEndpoint: string of the SPARQL endpoint's URI for update operations (if it's a different one)
+        @param updateEndpoint: string of the SPARQL endpoint's URI for update operations (if it's a different one; by
+        default, the first of several equivalent endpoints)
         @type updateEndpoint: string
         @param returnFormat: Default: L{XML}.
         Can be set to JSON or Turtle/N3
@@ -389,6 +474,13 @@ class SPARQLWrapper(object):
         @param agent: The User-Agent for the HTTP request header.
         @type agent: string
         """
+        if isinstance(endpoint, (list, tuple)):
+            endpoint = ReplicaSet(endpoint)
+        if isinstance(endpoint, ReplicaSet):
+            self.replicaSet = endpoint
+            endpoint = endpoint.replicas[0].url
+        else:
+            self.replicaSet = None
         self.endpoint = endpoint
         self.updateEndpoint = updateEndpoint if updateEndpoint else endpoint
         self.agent = agent
@@ -398,6 +490,17 @@ class SPARQLWrapper(object):
         self._defaultGraph = defaultGraph
         self.onlyConneg = False # Only Content Negotiation
         self.customHttpHeaders = {}
+        self.transport = UrllibTransport()
+        self.retryPolicy = None
+        self.useCircuitBreaker = False
+        self.hedgingPolicy = None
+        self.coalescingGroup = None
+        self.cache = None
+        self.useCompression = True
+        self.maxGetLength = _DEFAULT_MAX_GET_LENGTH
+        self.serverType = None
+        self._requestTemplates = OrderedDict()
+        self._requestTemplatesLock = threading.Lock()
 
         if returnFormat in _allowedFormats:
             self._defaultReturnFormat = returnFormat
@@ -417,6 +520,9 @@ class SPARQLWrapper(object):
         self.method = GET
         self.setQuery("""SELECT * WHERE{ ?s ?p ?o }""")
         self.timeout = None
+        self.connectTimeout = None
+        self.deadline = None
+        self.cancellationToken = None
         self.requestMethod = URLENCODED
 
 
@@ -452,6 +558,59 @@ class SPARQLWrapper(object):
         """
         self.timeout = int(timeout)
 
+    def setConnectTimeout(self, connectTimeout):
+        """Set the timeout (in seconds) for opening a connection to the endpoint. The L{timeout<setTimeout>} then
+        only applies to the reads (note that the default transport can not tell them apart, see
+        L{UrllibTransport<SPARQLWrapper.Transport.UrllibTransport>}).
+        @since: 1.8.3
+
+        @param connectTimeout: Timeout in seconds, or C{None} for using the L{timeout<setTimeout>}.
+        @type connectTimeout: float
+        """
+        self.connectTimeout = float(connectTimeout) if connectTimeout is not None else None
+
+    def setDeadline(self, deadline):
+        """Set the time (in seconds) allowed for a whole query: sending it (including the retries), downloading the
+        result and converting it. Past the deadline, a L{DeadlineExceeded} exception is raised, even while the result
+        is read by the L{QueryResult}. If the L{server type<setServerType>} is known, the time left is also given to
+        the server, so it stops running a query nobody waits for anymore.
+        @since: 1.8.3
+
+        @param deadline: Time in seconds, or C{None} for no deadline (the default).
+        @type deadline: float
+        """
+        self.deadline = float(deadline) if deadline is not None else None
+
+    def setCancellationToken(self, cancellationToken):
+        """Set the token the query can be cancelled with, from another thread: the request is then abandoned, or the
+        reading and the conversion of the result are interrupted, with a L{QueryCancelled} exception. If the
+        L{server type<setServerType>} is L{BLAZEGRAPH}, the server is also asked to cancel the query. See
+        L{Cancellation<SPARQLWrapper.Cancellation>}.
+        @since: 1.8.3
+
+        @param cancellationToken: The token, or C{None} (the default).
+        @type cancellationToken: L{CancellationToken<SPARQLWrapper.Cancellation.CancellationToken>}
+        @raise TypeError: If the C{cancellationToken} parameter is not a L{CancellationToken<SPARQLWrapper.Cancellation.CancellationToken>}.
+        """
+        if cancellationToken is not None and not isinstance(cancellationToken, CancellationToken):
+            raise TypeError('setCancellationToken takes a CancellationToken instance')
+        self.cancellationToken = cancellationToken
+
+    def setServerType(self, serverType):
+        """Set the type of the server of the endpoint, so its specific parameters can be used (eg, the time a query
+        is allowed to run on the server, see L{setDeadline}). That time is only sent when a L{deadline<setDeadline>}
+        is set: the L{timeout<setTimeout>} bounds each socket operation, not the whole query, and Virtuoso would
+        return partial results for a query interrupted by its C{timeout} parameter.
+        @since: 1.8.3
+
+        @param serverType: L{VIRTUOSO}, L{BLAZEGRAPH}, or C{None} if unknown (the default).
+        @type serverType: string
+        @raise ValueError: If the C{serverType} parameter has not one of the valid values.
+        """
+        if serverType is not None and serverType not in _allowedServerTypes:
+            raise ValueError("Value should be one of {0}".format(", ".join(_allowedServerTypes)))
+        self.serverType = serverType
+
     def setOnlyConneg(self, onlyConneg):
         """Set this option for allowing (or not) only HTTP Content Negotiation (so dismiss the use of HTTP parameters).
         @since: 1.8.1
@@ -461,6 +620,17 @@ class SPARQLWrapper(object):
         """
         self.onlyConneg = onlyConneg
 
+    def setUseCompression(self, useCompression):
+        """Set this option for asking (or not) the endpoint for a compressed response, using the C{Accept-Encoding}
+        header. A C{gzip} or C{deflate} response body is decompressed while it is read, so the conversion methods
+        see the plain bytes.
+        @since: 1.8.3
+
+        @param useCompression: True if a compressed response is accepted (the default); False otherwise.
+        @type useCompression: bool
+        """
+        self.useCompression = useCompression
+
     def setRequestMethod(self, method):
         """Set the internal method to use to perform the request for query or
         update operations, either URL-encoded (L{SPARQLWrapper.URLENCODED}) or
@@ -634,6 +804,20 @@ class SPARQLWrapper(object):
             @type query: string
             @raise TypeError: If the C{query} parameter is not an unicode-string or utf-8 encoded byte-string.
         """
+        query = self._decodeQuery(query)
+        self.queryString = query
+        self.queryType = self._parseQueryType(query)
+
+    @staticmethod
+    def _decodeQuery(query):
+        """
+            Internal method for getting the query text as an unicode-string.
+            @param query: query text
+            @type query: string
+            @return: the query text
+            @rtype: unicode-string
+            @raise TypeError: If the C{query} parameter is not an unicode-string or utf-8 encoded byte-string.
+        """
         if sys.version < '3':  # have to write it like this, for 2to3 compatibility
             if isinstance(query, unicode):
                 pass
@@ -648,9 +832,7 @@ class SPARQLWrapper(object):
                 query = query.decode('utf-8')
             else:
                 raise TypeError('setQuery takes either unicode-strings or utf-8 encoded byte-strings')
-
-        self.queryString = query
-        self.queryType = self._parseQueryType(query)
+        return query
 
     def _parseQueryType(self, query):
         """
@@ -661,19 +843,18 @@ class SPARQLWrapper(object):
             according to the SPARQL specification, one of Select, Ask, Describe, or Construct. The
             SPARQL endpoint should raise an exception (via urllib) for such syntax error.
 
+            The query is scanned by a single pass L{lexer<SPARQLWrapper.Lexer.scanQuery>}, which stops at the first
+            query form keyword (outside of the IRIs, strings and comments).
+            @change: Since version C{1.8.3} the query is not parsed with regular expressions anymore (see L{pattern}).
+
             @param query: query text
             @type query: string
             @return: the type of SPARQL query (aka SPARQL query form)
             @rtype: string
         """
-        try:
-            query = query if (isinstance(query, str)) else query.encode('ascii', 'ignore')
-            query = self._cleanComments(query)
-            query_for_queryType = re.sub(self.prefix_pattern, "", query.strip())
-            r_queryType = self.pattern.search(query_for_queryType).group("queryType").upper()
-        except AttributeError:
+        r_queryType = scanQuery(query).queryType
+        if r_queryType is None:
             warnings.warn("not detected query type for query '%s'" % query.replace("\n", " "), RuntimeWarning)
-            r_queryType = None
 
         if r_queryType in _allowedQueryTypes:
             return r_queryType
@@ -684,28 +865,131 @@ class SPARQLWrapper(object):
 
     def setMethod(self, method):
         """Set the invocation method. By default, this is L{GET}, but can be set to L{POST}.
-        @param method: should be either L{GET} or L{POST}. Other cases are ignored.
+
+        With L{AUTO}, a query is sent by GET (so HTTP caches keep working), unless the request URL would be longer
+        than L{maxGetLength<setMaxGetLength>}, or than a URL already rejected by the endpoint with a C{414} status:
+        then it is sent by POST, according to the L{request method<setRequestMethod>}. If a query sent by GET is
+        rejected with a C{414} status anyway, the length is remembered for the endpoint and the query is sent again by
+        POST. Update operations are always sent by POST.
+        @change: Since version C{1.8.3} the L{AUTO} method is available.
+
+        @param method: should be either L{GET}, L{POST} or L{AUTO}. Other cases are ignored.
         @type method: string
         """
         if method in _allowedRequests:
             self.method = method
 
-    def setUseKeepAlive(self):
-        """Make urllib2 use keep-alive.
-        @raise ImportError: when could not be imported keepalive.HTTPHandler
+    def setMaxGetLength(self, length):
+        """Set the maximum length of the request URL for sending a query by GET, when the method is L{AUTO}.
+        @since: 1.8.3
+
+        @param length: Maximum length (in characters) of the request URL. Default is C{2048}.
+        @type length: int
         """
-        try:
-            from keepalive import HTTPHandler
+        self.maxGetLength = int(length)
 
-            if urllib2._opener and any(isinstance(h, HTTPHandler) for h in urllib2._opener.handlers):
-                # already installed
-                return
+    def setUseKeepAlive(self, pool=None):
+        """Make the requests reuse persistent connections (keep-alive), taken from a L{ConnectionPool} owned by
+        this instance. Nothing is installed globally, so other instances (and the L{DIGEST} authentication) are not
+        affected.
+        @change: Since version C{1.8.3} the optional C{keepalive} package is no longer used.
 
-            keepalive_handler = HTTPHandler()
-            opener = urllib2.build_opener(keepalive_handler)
-            urllib2.install_opener(opener)
-        except ImportError:
-            warnings.warn("keepalive support not available, so the execution of this method has no effect")
+        @param pool: The connection pool to use, if it must be shared with other instances (eg, instances targeting
+        the same endpoint host). By default a new pool is created, unless keep-alive is already enabled.
+        @type pool: L{ConnectionPool}
+        """
+        if pool is not None:
+            self.transport = PooledTransport(pool)
+        elif self.connectionPool is None:
+            self.transport = PooledTransport()
+
+    @property
+    def connectionPool(self):
+        """The L{ConnectionPool} used by the transport, if any (see L{setUseKeepAlive}).
+        @rtype: L{ConnectionPool}
+        """
+        return getattr(self.transport, "pool", None)
+
+    def setTransport(self, transport):
+        """Set the transport used to send the requests, eg, an L{InMemoryTransport<SPARQLWrapper.Transport.InMemoryTransport>}
+        serving canned responses, or a custom subclass of L{Transport<SPARQLWrapper.Transport.Transport>}.
+        @since: 1.8.3
+
+        @param transport: The transport.
+        @type transport: L{Transport<SPARQLWrapper.Transport.Transport>}
+        @raise TypeError: If the C{transport} parameter is not a L{Transport<SPARQLWrapper.Transport.Transport>}.
+        """
+        if not isinstance(transport, Transport):
+            raise TypeError('setTransport takes a Transport instance')
+        self.transport = transport
+
+    def setRetryPolicy(self, retryPolicy):
+        """Set the policy for retrying the requests failed because of an overloaded endpoint (eg, a C{503} status or
+        a connection reset).
+        @since: 1.8.3
+
+        @param retryPolicy: The retry policy, or C{None} for not retrying the requests (the default).
+        @type retryPolicy: L{RetryPolicy<SPARQLWrapper.Retry.RetryPolicy>}
+        @raise TypeError: If the C{retryPolicy} parameter is not a L{RetryPolicy<SPARQLWrapper.Retry.RetryPolicy>}.
+        """
+        if retryPolicy is not None and not isinstance(retryPolicy, RetryPolicy):
+            raise TypeError('setRetryPolicy takes a RetryPolicy instance')
+        self.retryPolicy = retryPolicy
+
+    def setUseCircuitBreaker(self, useCircuitBreaker):
+        """Set this option for failing fast (or not) when the endpoint is failing or overloaded: the requests are then
+        rejected with a L{CircuitBreakerOpen} exception, without being sent. The circuit breaker of an endpoint is
+        shared by all the wrappers of the process (see L{CircuitBreaker<SPARQLWrapper.CircuitBreaker>}).
+        @since: 1.8.3
+
+        @param useCircuitBreaker: True if the circuit breaker of the endpoint is used; False otherwise (the default).
+        @type useCircuitBreaker: bool
+        """
+        self.useCircuitBreaker = useCircuitBreaker
+
+    def setHedgingPolicy(self, hedgingPolicy):
+        """Set the policy for hedging the slow queries: when the response headers of a query have not been received
+        after a while, the same query is sent to another replica (see L{replicaSet}), or else to the same endpoint,
+        and the first response is used (see L{Hedging<SPARQLWrapper.Hedging>}). The updates are never hedged.
+        @since: 1.8.3
+
+        @param hedgingPolicy: The hedging policy, or C{None} for not hedging the queries (the default).
+        @type hedgingPolicy: L{HedgingPolicy<SPARQLWrapper.Hedging.HedgingPolicy>}
+        @raise TypeError: If the C{hedgingPolicy} parameter is not a L{HedgingPolicy<SPARQLWrapper.Hedging.HedgingPolicy>}.
+        """
+        if hedgingPolicy is not None and not isinstance(hedgingPolicy, HedgingPolicy):
+            raise TypeError('setHedgingPolicy takes a HedgingPolicy instance')
+        self.hedgingPolicy = hedgingPolicy
+
+    def setCoalescingGroup(self, coalescingGroup):
+        """Set the group the identical concurrent queries are coalesced in: a single request is sent for the queries
+        of the wrappers sharing the group, and each query gets its own copy of the result (see
+        L{Coalescing<SPARQLWrapper.Coalescing>}). The body of the response is then read at once. The updates are
+        never coalesced.
+        @since: 1.8.3
+
+        @param coalescingGroup: The coalescing group, or C{None} for not coalescing the queries (the default).
+        @type coalescingGroup: L{CoalescingGroup<SPARQLWrapper.Coalescing.CoalescingGroup>}
+        @raise TypeError: If the C{coalescingGroup} parameter is not a L{CoalescingGroup<SPARQLWrapper.Coalescing.CoalescingGroup>}.
+        """
+        if coalescingGroup is not None and not isinstance(coalescingGroup, CoalescingGroup):
+            raise TypeError('setCoalescingGroup takes a CoalescingGroup instance')
+        self.coalescingGroup = coalescingGroup
+
+    def setCache(self, cache):
+        """Set the cache of the query results: the response of a query is kept, and replayed (without sending any
+        request) for the identical queries until it expires, according to its C{Cache-Control} and C{Expires}
+        headers or to the TTL of the cache (see L{Cache<SPARQLWrapper.Cache>}). The body of the response is then read
+        at once. The updates are never cached, and they remove the results they may modify from the cache.
+        @since: 1.8.3
+
+        @param cache: The cache, or C{None} for not caching the results (the default).
+        @type cache: L{ResultCache<SPARQLWrapper.Cache.ResultCache>}
+        @raise TypeError: If the C{cache} parameter is not a L{ResultCache<SPARQLWrapper.Cache.ResultCache>}.
+        """
+        if cache is not None and not isinstance(cache, ResultCache):
+            raise TypeError('setCache takes a ResultCache instance')
+        self.cache = cache
 
     def isSparqlUpdateRequest(self):
         """ Returns C{TRUE} if SPARQLWrapper is configured for executing SPARQL Update request.
@@ -730,172 +1014,749 @@ class SPARQLWrapper(object):
         """
         return re.sub(self.comments_pattern, "\n\n", query)
 
-    def _getRequestEncodedParameters(self, query=None):
-        """ Internal method for getting the request encoded parameters.
+    def _getRequestEncodedParameters(self, query=None, spec=None):
+        """ Internal method for getting the request encoded parameters. The parameters which do not depend on the query
+        string are encoded once for all the requests with the same settings (see L{_getRequestTemplate}).
         @param query: a tuple of two items. The first item can be the string
         "query" (for SELECT, DESCRIBE, ASK, CONSTRUCT query) or the string "update"
         (for SPARQL Update queries, like DELETE or INSERT). The second item of the tuple
         is the query string itself.
         @type query: tuple
+        @param spec: The request specification. Default is the current settings of the instance.
+        @type spec: L{QuerySpec}
         """
-        query_parameters = self.parameters.copy()
+        if spec is None:
+            spec = self._getQuerySpec()
+        template = self._getRequestTemplate(spec)
+        # the time the query is allowed to run on the server: the time left before the deadline, if any (the timeout
+        # only bounds each socket operation of the client)
+        serverTimeout = spec.deadline
 
         # in case of query = tuple("query"/"update", queryString)
         if query and (isinstance(query, tuple)) and len(query) == 2:
-            query_parameters[query[0]] = [query[1]]
-
-        if not self.isSparqlUpdateRequest():
+            return template.encodeParameters(query[0], query[1], serverTimeout, spec.queryId)
+        return template.encodeParameters(serverTimeout=serverTimeout, queryId=spec.queryId)
+
+    def _getRequestTemplate(self, spec):
+        """ Internal method for getting the parts of the requests of a spec which do not depend on its query string:
+        the encoded parameters and the headers. The templates of the recently used settings are kept, and any change of
+        the settings they depend on gets a new template (but not a change of the endpoint, of the timeouts or of the
+        id of the query).
+        @param spec: The request specification.
+        @type spec: L{QuerySpec}
+        @rtype: L{_RequestTemplate}
+        @raise NotImplementedError: If the C{HTTP authentification} method is not one of the valid values: L{BASIC} or L{DIGEST}.
+        """
+        key = _requestTemplateKey(spec)
+        with self._requestTemplatesLock:
+            template = self._requestTemplates.pop(key, None)
+            if template is not None:
+                self._requestTemplates[key] = template  # most recently used
+                return template
+        template = self._compileRequestTemplate(spec)
+        with self._requestTemplatesLock:
+            self._requestTemplates[key] = template
+            while len(self._requestTemplates) > _MAX_REQUEST_TEMPLATES:
+                self._requestTemplates.popitem(last=False)
+        return template
+
+    def _compileRequestTemplate(self, spec):
+        """ Internal method for computing the parts of the requests of a spec which do not depend on its query string
+        (see L{_getRequestTemplate}).
+        @param spec: The request specification.
+        @type spec: L{QuerySpec}
+        @rtype: L{_RequestTemplate}
+        """
+        query_parameters = dict((name, list(values)) for name, values in spec.parameters)
+        acceptHeader = self._getAcceptHeader(spec)
+        serverTimeoutParameter = None
+
+        if not spec.isSparqlUpdateRequest():
             # This is very ugly. The fact is that the key for the choice of the output format is not defined.
             # Virtuoso uses 'format',sparqler uses 'output'
             # However, these processors are (hopefully) oblivious to the parameters they do not understand.
             # So: just repeat all possibilities in the final URI. UGLY!!!!!!!
-            if not self.onlyConneg:
+            if not spec.onlyConneg:
                 for f in _returnFormatSetting:
-                    query_parameters[f] = [self.returnFormat]
+                    query_parameters[f] = [spec.returnFormat]
                     # Virtuoso is not supporting a correct Accept header and an unexpected "output"/"format" parameter value. It returns a 406.
                     # "tsv", "rdf+xml" and "json-ld" are not supported as a correct "output"/"format" parameter value but "text/tab-separated-values" or "application/rdf+xml" are a valid values,
                     # and there is no problem to send both (4store does not support unexpected values).
-                    if self.returnFormat in [TSV, JSONLD, RDFXML]:
-                        acceptHeader = self._getAcceptHeader() # to obtain the mime-type "text/tab-separated-values" or "application/rdf+xml"
-                        if "*/*" in acceptHeader:
-                            acceptHeader = "" # clear the value in case of "*/*"
-                        query_parameters[f] += [acceptHeader]
-
-        pairs = (
-            "%s=%s" % (
-                urllib.quote_plus(param.encode('UTF-8'), safe='/'),
-                urllib.quote_plus(value.encode('UTF-8'), safe='/')
-            )
-            for param, values in query_parameters.items() for value in values
-        )
-
-        return '&'.join(pairs)
-
-    def _getAcceptHeader(self):
+                    if spec.returnFormat in [TSV, JSONLD, RDFXML]:
+                        # the mime-type "text/tab-separated-values" or "application/rdf+xml", but not "*/*"
+                        query_parameters[f] += ["" if "*/*" in acceptHeader else acceptHeader]
+
+            # the time the query is allowed to run on the server is set by each request (see _RequestTemplate)
+            name = _SERVER_TIMEOUT_PARAMETERS.get(spec.serverType)
+            if name and name not in query_parameters:
+                serverTimeoutParameter = name
+
+        parameters = [(param, _encodeParameter(param, value))
+                      for param, values in query_parameters.items() for value in values]
+
+        headers = [("User-Agent", spec.agent), ("Accept", acceptHeader)]
+        if spec.useCompression:
+            headers.append(("Accept-Encoding", ACCEPT_ENCODING))
+        if spec.user and spec.passwd:
+            if spec.http_auth == BASIC:
+                credentials = "%s:%s" % (spec.user, spec.passwd)
+                headers.append(("Authorization", "Basic %s" % base64.b64encode(credentials.encode('utf-8')).decode('utf-8')))
+            elif spec.http_auth != DIGEST:  # the DIGEST challenge is answered when the request is sent
+                valid_types = ", ".join(_allowedAuth)
+                raise NotImplementedError("Expecting one of: {0}, but received: {1}".format(valid_types,
+                                                                                            spec.http_auth))
+        # The custom headers override the previous values.
+        headers.extend(spec.customHttpHeaders)
+
+        return _RequestTemplate(parameters, headers, serverTimeoutParameter)
+
+    def _getAcceptHeader(self, spec=None):
         """ Internal method for getting the HTTP Accept Header.
         @see: U{Hypertext Transfer Protocol -- HTTP/1.1 - Header Field Definitions<https://www.w3.org/Protocols/rfc2616/rfc2616-sec14.html#sec14.1>}
+        @param spec: The request specification. Default is the current settings of the instance.
+        @type spec: L{QuerySpec}
         """
-        if self.queryType in [SELECT, ASK]:
-            if self.returnFormat == XML:
+        if spec is None:
+            spec = self._getQuerySpec()
+        if spec.queryType in [SELECT, ASK]:
+            if spec.returnFormat == XML:
                 acceptHeader = ",".join(_SPARQL_XML)
-            elif self.returnFormat == JSON:
+            elif spec.returnFormat == JSON:
                 acceptHeader = ",".join(_SPARQL_JSON)
-            elif self.returnFormat == CSV: # Allowed for SELECT and ASK (https://www.w3.org/TR/2013/REC-sparql11-protocol-20130321/#query-success) but only described for SELECT (https://www.w3.org/TR/sparql11-results-csv-tsv/)
+            elif spec.returnFormat == CSV: # Allowed for SELECT and ASK (https://www.w3.org/TR/2013/REC-sparql11-protocol-20130321/#query-success) but only described for SELECT (https://www.w3.org/TR/sparql11-results-csv-tsv/)
                 acceptHeader = ",".join(_CSV)
-            elif self.returnFormat == TSV: # Allowed for SELECT and ASK (https://www.w3.org/TR/2013/REC-sparql11-protocol-20130321/#query-success) but only described for SELECT (https://www.w3.org/TR/sparql11-results-csv-tsv/)
+            elif spec.returnFormat == TSV: # Allowed for SELECT and ASK (https://www.w3.org/TR/2013/REC-sparql11-protocol-20130321/#query-success) but only described for SELECT (https://www.w3.org/TR/sparql11-results-csv-tsv/)
                 acceptHeader = ",".join(_TSV)
             else:
                 acceptHeader = ",".join(_ALL)
-                warnings.warn("Sending Accept header '*/*' because unexpected returned format '%s' in a '%s' SPARQL query form" % (self.returnFormat, self.queryType), RuntimeWarning)
-        elif self.queryType in [INSERT, DELETE]:
+                warnings.warn("Sending Accept header '*/*' because unexpected returned format '%s' in a '%s' SPARQL query form" % (spec.returnFormat, spec.queryType), RuntimeWarning)
+        elif spec.queryType in [INSERT, DELETE]:
             acceptHeader = "*/*"
         else: #CONSTRUCT, DESCRIBE
-            if self.returnFormat == N3 or self.returnFormat == TURTLE:
+            if spec.returnFormat == N3 or spec.returnFormat == TURTLE:
                 acceptHeader = ",".join(_RDF_N3)
-            elif self.returnFormat == XML or self.returnFormat == RDFXML:
+            elif spec.returnFormat == XML or spec.returnFormat == RDFXML:
                 acceptHeader = ",".join(_RDF_XML)
-            elif self.returnFormat == JSONLD and JSONLD in _allowedFormats:
+            elif spec.returnFormat == JSONLD and JSONLD in _allowedFormats:
                 acceptHeader = ",".join(_RDF_JSONLD)
             else:
                 acceptHeader = ",".join(_ALL)
-                warnings.warn("Sending Accept header '*/*' because unexpected returned format '%s' in a '%s' SPARQL query form" % (self.returnFormat, self.queryType), RuntimeWarning)
+                warnings.warn("Sending Accept header '*/*' because unexpected returned format '%s' in a '%s' SPARQL query form" % (spec.returnFormat, spec.queryType), RuntimeWarning)
         return acceptHeader
 
-    def _createRequest(self):
+    def _createRequest(self, spec=None):
         """Internal method to create request according a HTTP method. Returns a
         C{urllib2.Request} object of the urllib2 Python library
+        @param spec: The request specification. Default is the current settings of the instance.
+        @type spec: L{QuerySpec}
+        @raise NotImplementedError: If the C{HTTP authentification} method is not one of the valid values: L{BASIC} or L{DIGEST}.
+        @return: request a C{urllib2.Request} object of the urllib2 Python library
+        """
+        if spec is None:
+            spec = self._getQuerySpec()
+        request = self._buildRequest(spec)
+        if spec.user and spec.passwd and spec.http_auth == DIGEST:
+            if self._usesGlobalOpener():  # otherwise, the challenge is answered by the connection pool
+                uri = spec.updateEndpoint if spec.isSparqlUpdateRequest() else spec.endpoint
+                opener = urllib2.build_opener()
+                opener.add_handler(urllib2.HTTPDigestAuthHandler(self._getPasswordManager(uri, spec)))
+                urllib2.install_opener(opener)
+
+        return request
+
+    def _buildRequest(self, spec):
+        """Internal method to build the request of a spec from its L{template<_getRequestTemplate>} and its encoded
+        query string, without configuring the global C{urllib2} opener for the L{DIGEST} authentication (see
+        L{_createRequest}).
+        @param spec: The request specification.
+        @type spec: L{QuerySpec}
         @raise NotImplementedError: If the C{HTTP authentification} method is not one of the valid values: L{BASIC} or L{DIGEST}.
         @return: request a C{urllib2.Request} object of the urllib2 Python library
         """
         request = None
 
-        if self.isSparqlUpdateRequest():
+        if spec.isSparqlUpdateRequest():
             #protocol details at http://www.w3.org/TR/sparql11-protocol/#update-operation
-            uri = self.updateEndpoint
+            uri = spec.updateEndpoint
 
-            if self.method != POST:
+            if spec.method == GET:
                 warnings.warn("update operations MUST be done by POST")
 
-            if self.requestMethod == POSTDIRECTLY:
-                request = urllib2.Request(uri + "?" + self._getRequestEncodedParameters())
+            if spec.requestMethod == POSTDIRECTLY:
+                request = urllib2.Request(uri + "?" + self._getRequestEncodedParameters(spec=spec))
                 request.add_header("Content-Type", "application/sparql-update")
-                request.data = self.queryString.encode('UTF-8')
+                request.data = spec.queryString.encode('UTF-8')
             else:  # URL-encoded
                 request = urllib2.Request(uri)
                 request.add_header("Content-Type", "application/x-www-form-urlencoded")
-                request.data = self._getRequestEncodedParameters(("update", self.queryString)).encode('ascii')
+                request.data = self._getRequestEncodedParameters(("update", spec.queryString), spec).encode('ascii')
         else:
             #protocol details at http://www.w3.org/TR/sparql11-protocol/#query-operation
-            uri = self.endpoint
+            uri = spec.endpoint
+            method = spec.method
 
-            if self.method == POST:
-                if self.requestMethod == POSTDIRECTLY:
-                    request = urllib2.Request(uri + "?" + self._getRequestEncodedParameters())
+            if method == AUTO:
+                url = uri + "?" + self._getRequestEncodedParameters(("query", spec.queryString), spec)
+                method = GET if len(url) <= _getMaxGetLength(uri, spec.maxGetLength) else POST
+
+            if method == POST:
+                if spec.requestMethod == POSTDIRECTLY:
+                    request = urllib2.Request(uri + "?" + self._getRequestEncodedParameters(spec=spec))
                     request.add_header("Content-Type", "application/sparql-query")
-                    request.data = self.queryString.encode('UTF-8')
+                    request.data = spec.queryString.encode('UTF-8')
                 else:  # URL-encoded
                     request = urllib2.Request(uri)
                     request.add_header("Content-Type", "application/x-www-form-urlencoded")
-                    request.data = self._getRequestEncodedParameters(("query", self.queryString)).encode('ascii')
+                    request.data = self._getRequestEncodedParameters(("query", spec.queryString), spec).encode('ascii')
+            elif spec.method == AUTO:
+                request = urllib2.Request(url)
             else:  # GET
-                request = urllib2.Request(uri + "?" + self._getRequestEncodedParameters(("query", self.queryString)))
+                request = urllib2.Request(uri + "?" + self._getRequestEncodedParameters(("query", spec.queryString), spec))
 
-        request.add_header("User-Agent", self.agent)
-        request.add_header("Accept", self._getAcceptHeader())
-        if self.user and self.passwd:
-            if self.http_auth == BASIC:
-                credentials = "%s:%s" % (self.user, self.passwd)
-                request.add_header("Authorization", "Basic %s" % base64.b64encode(credentials.encode('utf-8')).decode('utf-8'))
-            elif self.http_auth == DIGEST:
-                realm = self.realm
-                pwd_mgr = urllib2.HTTPPasswordMgr()
-                pwd_mgr.add_password(realm, uri, self.user, self.passwd)
-                opener = urllib2.build_opener()
-                opener.add_handler(urllib2.HTTPDigestAuthHandler(pwd_mgr))
-                urllib2.install_opener(opener)
-            else:
-                valid_types = ", ".join(_allowedAuth)
-                raise NotImplementedError("Expecting one of: {0}, but received: {1}".format(valid_types,
-                                                                                            self.http_auth))
+        # The header field names are capitalized, as in the request.add_header method.
+        request.headers.update(self._getRequestTemplate(spec).headers)
+        return request
 
-        # The header field name is capitalized in the request.add_header method.
-        for customHttpHeader in self.customHttpHeaders:
-            request.add_header(customHttpHeader, self.customHttpHeaders[customHttpHeader])
+    def _usesGlobalOpener(self):
+        """Internal method for checking if the requests are sent through the global C{urllib2} opener (see the
+        L{transport}), which must then be configured for the L{DIGEST} authentication.
+        @rtype: bool
+        """
+        return self.transport.usesGlobalOpener
 
-        return request
+    def _getPasswordManager(self, uri, spec):
+        """Internal method for getting the password manager used by the L{DIGEST} authentication.
+        @param uri: The URI the credentials are valid for.
+        @type uri: string
+        @param spec: The request specification.
+        @type spec: L{QuerySpec}
+        @return: the password manager with the credentials.
+        @rtype: C{urllib2.HTTPPasswordMgr}
+        """
+        pwd_mgr = urllib2.HTTPPasswordMgr()
+        pwd_mgr.add_password(spec.realm, uri, spec.user, spec.passwd)
+        return pwd_mgr
 
-    def _query(self):
+    def _query(self, spec=None):
         """Internal method to execute the query. Returns the output of the
-        C{urllib2.urlopen} method of the standard Python library
-
+        L{transport} (by default, the C{urllib2.urlopen} method of the standard
+        Python library). The failed requests are retried according to the L{retryPolicy}, within the L{deadline}
+        (if any): the response then checks the deadline while it is read. If the query has a L{cancellationToken}, the
+        requests are aborted when it is cancelled, or, if the L{transport} can not abort them (see
+        L{Transport.canAbort<SPARQLWrapper.Transport.Transport>}), they are sent by another thread, so that the query
+        can be abandoned at any time. If its result is in the
+        L{cache}, no request is sent; if it is identical to a query in flight of the L{coalescingGroup}, the result of
+        the latter is shared instead. An update removes the results it may modify from the L{cache}, whether it
+        succeeds or not.
+
+        @param spec: The request specification. Default is the current settings of the instance.
+        @type spec: L{QuerySpec}
         @return: tuples with the raw request plus the expected format.
         @raise QueryBadFormed: If the C{HTTP return code} is C{400}.
         @raise Unauthorized: If the C{HTTP return code} is C{401}.
         @raise EndPointNotFound: If the C{HTTP return code} is C{404}.
-        @raise URITooLong: If the C{HTTP return code} is C{414}.
+        @raise URITooLong: If the C{HTTP return code} is C{414} (and the query was not sent by GET with the L{AUTO}
+        method).
         @raise EndPointInternalError: If the C{HTTP return code} is C{500}.
+        @raise CircuitBreakerOpen: If the circuit breaker of the endpoint is L{used<setUseCircuitBreaker>} and open.
+        @raise LimitExceeded: If the limiter of the endpoint (see L{setLimiter<SPARQLWrapper.Limiter.setLimiter>})
+        does not let the request through in time.
+        @raise DeadlineExceeded: If the L{deadline} is exceeded.
+        @raise QueryCancelled: If the L{cancellationToken} is cancelled.
+        """
+        if spec is None:
+            spec = self._getQuerySpec()
+        hedged = self.hedgingPolicy is not None and spec.isSparqlQueryRequest()
+        expires = time.time() + spec.deadline if spec.deadline else None
+        token = spec.cancellationToken
+        cached = self.cache is not None and spec.isSparqlQueryRequest()
+        coalesced = self.coalescingGroup is not None and spec.isSparqlQueryRequest()
+        if cached or coalesced:
+            identity = self._getRequestIdentity(spec)
+        tried = []
+        keys = []
+        if token is not None:
+            token.raiseIfCancelled()
+            spec, queryId = _withServerQueryId(spec)
+            if queryId is not None:
+                keys.append(token.register(lambda: self._cancelOnServer(spec, queryId, tried)))
+        try:
+            if cached or coalesced:
+                buffered, returnFormat = self._sharedQuery(spec, identity, hedged, expires, tried)
+                response = BufferedResponse(*buffered)
+            else:
+                response, returnFormat = self._queryWithRetries(spec, hedged, expires, tried)
+        except:
+            for key in keys:
+                token.unregister(key)
+            raise
+        finally:
+            if self.cache is not None and spec.isSparqlUpdateRequest():
+                self._invalidateCache(spec)
+        if expires is not None:
+            response = DeadlineResponse(response, expires)
+        if token is not None:
+            response = CancellableResponse(response, token, keys)
+        return response, returnFormat
+
+    def _sharedQuery(self, spec, identity, hedged, expires, tried):
+        """Internal method to get the whole response of a query from the L{cache}, or else to send the request (within
+        the L{coalescingGroup}, if any) and to cache its response.
+
+        A single query (of all the threads, and of all the processes for a
+        L{DiskCache<SPARQLWrapper.Cache.DiskCache>}) sends the request of an expired or missing response, and the other
+        ones wait for the cache to be filled. An expired response is served at once if the cache allows it (see
+        L{ResultCache.staleWhileRevalidate<SPARQLWrapper.Cache.ResultCache>}), and refreshed in the background.
+        @param spec: The request specification.
+        @type spec: L{QuerySpec}
+        @param identity: The identity of the request (see L{_getRequestIdentity}).
+        @type identity: tuple
+        @return: a tuple with the arguments of a L{BufferedResponse<SPARQLWrapper.Transport.BufferedResponse>}
+        holding the response, plus the expected format.
+        @rtype: tuple
+        """
+        cache = self.cache
+        if cache is None:
+            return self._fetchAndCache(spec, identity, None, None, hedged, expires, tried)
+        key = cacheKey(identity)
+        entry = cache.get(key, allowStale=True)
+        if entry is not None and entry.isFresh():
+            return entry.getResponse(), entry.returnFormat
+        if entry is not None and cache.isServableStale(entry):
+            if cache.acquireLock(key, blocking=False):
+                self._refreshInBackground(spec, identity, key, entry, hedged)
+            return entry.getResponse(), entry.returnFormat
+
+        waited = not cache.acquireLock(key, blocking=False)
+        if waited:
+            timeout = cache.lockTimeout if expires is None else min(cache.lockTimeout, expires - time.time())
+            if not cache.acquireLock(key, timeout=max(0, timeout)):
+                # the query filling the cache is too slow: do not wait for it anymore
+                return self._fetchAndCache(spec, identity, key, entry, hedged, expires, tried)
+        try:
+            if waited:
+                entry = cache.get(key, allowStale=True) or entry  # filled meanwhile, most likely
+                if entry is not None and entry.isFresh():
+                    return entry.getResponse(), entry.returnFormat
+            return self._fetchAndCache(spec, identity, key, entry, hedged, expires, tried)
+        finally:
+            cache.releaseLock(key)
+
+    def _refreshInBackground(self, spec, identity, key, stale, hedged):
+        """Internal method for refreshing an expired response of the L{cache} in the background, once its lock is
+        held (it is released once the response is refreshed). The failures are ignored: the next query will try
+        again.
+        @param spec: The request specification.
+        @type spec: L{QuerySpec}
+        @param identity: The identity of the request (see L{_getRequestIdentity}).
+        @type identity: tuple
+        @param key: The key of the request in the cache.
+        @type key: string
+        @param stale: The expired response.
+        @type stale: L{CacheEntry<SPARQLWrapper.Cache.CacheEntry>}
+        """
+        spec = spec._replace(cancellationToken=None, deadline=None)  # not bound to the query served with the response
+
+        def refresh():
+            try:
+                self._fetchAndCache(spec, identity, key, stale, hedged, None, [])
+            except Exception:
+                pass
+            finally:
+                self.cache.releaseLock(key)
+
+        thread = threading.Thread(target=refresh)
+        thread.daemon = True
+        thread.start()
+
+    def _fetchAndCache(self, spec, identity, key, stale, hedged, expires, tried):
+        """Internal method to send the request of a query (within the L{coalescingGroup}, if any) and to cache its
+        response (if there is a L{cache}). The request revalidates the expired response in the cache, if it has
+        validators: a C{304 Not Modified} response then replays the cached one.
+        @param spec: The request specification.
+        @type spec: L{QuerySpec}
+        @param identity: The identity of the request (see L{_getRequestIdentity}).
+        @type identity: tuple
+        @param key: The key of the request in the cache, if any.
+        @type key: string
+        @param stale: The expired response in the cache, if any.
+        @type stale: L{CacheEntry<SPARQLWrapper.Cache.CacheEntry>}
+        @return: a tuple with the arguments of a L{BufferedResponse<SPARQLWrapper.Transport.BufferedResponse>}
+        holding the response, plus the expected format.
+        @rtype: tuple
+        """
+        cache = self.cache
+
+        def send():
+            conditional = getConditionalHeaders(stale.headers) if stale is not None else {}
+            requestSpec = spec
+            if conditional:
+                requestSpec = spec._replace(customHttpHeaders=_freeze(dict(spec.customHttpHeaders, **conditional)))
+            try:
+                buffered, returnFormat = self._bufferedQuery(requestSpec, hedged, expires, tried)
+                body, headers, url, code = buffered
+            except urllib2.HTTPError, e:
+                if e.code != 304 or not conditional:
+                    raise
+                headers, code = KeyCaseInsensitiveDict(dict(e.info().items())), e.code
+                e.close()
+            if code == 304 and conditional:
+                cache.recordRevalidation()
+                body, headers, url, code, returnFormat = (stale.body, updateHeaders(stale.headers, headers), stale.url,
+                                                          stale.code, stale.returnFormat)
+                buffered = body, headers, url, code
+            if key is not None and code == 200:
+                now = time.time()
+                lifetime = cache.getLifetime(headers, now)
+                if lifetime or (lifetime is not None and getConditionalHeaders(headers)):
+                    # a response that must be revalidated at once is kept for its validators
+                    cache.set(key, CacheEntry(body, headers, url, code, returnFormat, now, now + lifetime, spec.endpoint,
+                                              getQueryGraphs(spec.queryString, spec.parameters)))
+                elif stale is not None:
+                    cache.delete(key)
+            return buffered, returnFormat
+
+        if self.coalescingGroup is not None:
+            return self.coalescingGroup.do(identity, send, spec.cancellationToken, expires)
+        return send()
+
+    def _invalidateCache(self, spec):
+        """Internal method for removing the results an update may modify from the L{cache} (see
+        L{Invalidation<SPARQLWrapper.Invalidation>}): the results of the queries of its endpoint reading the graphs it
+        modifies.
+        @param spec: The request specification of the update.
+        @type spec: L{QuerySpec}
+        """
+        endpoints = set([spec.endpoint, spec.updateEndpoint])
+        if self.replicaSet is not None:
+            endpoints.update(replica.url for replica in self.replicaSet.replicas)
+        self.cache.invalidate(endpoints, getUpdatedGraphs(spec.queryString, spec.parameters))
+
+    def _bufferedQuery(self, spec, hedged, expires, tried):
+        """Internal method to send the request (see L{_queryWithRetries}) and read the whole response, within the
+        deadline of the query (if any) and unless it is cancelled.
+        @return: a tuple with the arguments of a L{BufferedResponse<SPARQLWrapper.Transport.BufferedResponse>}
+        holding the response, plus the expected format.
+        @rtype: tuple
+        """
+        response, returnFormat = self._queryWithRetries(spec, hedged, expires, tried)
+        if expires is not None:
+            response = DeadlineResponse(response, expires)
+        if spec.cancellationToken is not None:
+            response = CancellableResponse(response, spec.cancellationToken)
+        return bufferResponse(response), returnFormat
+
+    def _getRequestIdentity(self, spec):
+        """Internal method for getting the identity of the request of a spec (see
+        L{requestIdentity<SPARQLWrapper.Transport.requestIdentity>}), including the credentials of the L{DIGEST}
+        authentication. The request is built from its template, but not sent: the global C{urllib2} opener is left
+        alone.
+        @param spec: The request specification.
+        @type spec: L{QuerySpec}
+        @rtype: tuple
+        """
+        request = self._buildRequest(spec)
+        if spec.user and spec.passwd and spec.http_auth == DIGEST:
+            return requestIdentity(request, spec.user, spec.passwd, spec.realm)
+        return requestIdentity(request)
+
+    def _queryWithRetries(self, spec, hedged, expires, tried):
+        """Internal method to send the request, retrying the failed attempts according to the L{retryPolicy} (see
+        L{_query}).
+        @param spec: The request specification.
+        @type spec: L{QuerySpec}
+        @param hedged: C{True} if the attempts are hedged according to the L{hedgingPolicy}.
+        @type hedged: bool
+        @param expires: Time (as returned by C{time.time()}) of the deadline of the query, if any.
+        @type expires: float
+        @param tried: The replicas already queried for the same query, extended with the ones queried now.
+        @type tried: list of L{Replica<SPARQLWrapper.LoadBalancing.Replica>}
+        @return: tuples with the raw request plus the expected format.
         """
-        request = self._createRequest()
+        token = spec.cancellationToken
+        attemptFunction = self._hedgedQueryAttempt if hedged else self._queryAttempt
+        # a transport that can abort its requests is interrupted by the token, the others are abandoned in a thread
+        threaded = token is not None and not self.transport.canAbort
+        attempt = 0
+        while True:
+            attempt += 1
+            attemptSpec = _boundByDeadline(spec, expires)
+            try:
+                if threaded:
+                    return callCancellable(token, lambda: attemptFunction(attemptSpec, tried), _dismissResult)
+                return attemptFunction(attemptSpec, tried)
+            except Exception, e:
+                if token is not None and token.cancelled:
+                    raise QueryCancelled()
+                if expires is not None and isTimeout(e) and time.time() >= expires:
+                    raise DeadlineExceeded()
+                delay = self._getRetryDelay(spec, e, attempt)
+                if delay is not None and expires is not None and time.time() + delay >= expires:
+                    delay = None  # the retry could not complete in time
+                if delay is None:
+                    if isinstance(e, urllib2.HTTPError):
+                        self._raiseHTTPError(e)
+                    raise
+                if isinstance(e, urllib2.HTTPError):
+                    e.close()
+            if token is None:
+                time.sleep(delay)
+            elif token.wait(delay):
+                raise QueryCancelled()
+
+    def _queryAttempt(self, spec, tried):
+        """Internal method to send the request once, to the replica chosen by the L{replicaSet} (if any) and
+        provided the circuit breaker of the endpoint (if L{used<setUseCircuitBreaker>}) lets it through. The request
+        then waits for the limiter of the endpoint (if any, see L{setLimiter<SPARQLWrapper.Limiter.setLimiter>}),
+        which counts it in flight until the response headers are received.
+        @param spec: The request specification.
+        @type spec: L{QuerySpec}
+        @param tried: The replicas already queried for the same query, extended with the one queried now.
+        @type tried: list of L{Replica<SPARQLWrapper.LoadBalancing.Replica>}
+        @return: tuples with the raw request plus the expected format.
+        @raise urllib2.HTTPError: If the C{HTTP return code} is C{4XX} or C{5XX}.
+        @raise CircuitBreakerOpen: If the circuit breaker of the endpoint is open.
+        @raise LimitExceeded: If the limiter of the endpoint does not let the request through in time.
+        @raise QueryCancelled: If the L{cancellationToken} is cancelled before the response is received.
+        """
+        replica = None
+        if self.replicaSet is not None and spec.isSparqlQueryRequest():
+            replica = self.replicaSet.acquire(tried)
+            tried.append(replica)
+            spec = spec._replace(endpoint=replica.url)
+        request = self._createRequest(spec)
+        uri = spec.updateEndpoint if spec.isSparqlUpdateRequest() else spec.endpoint
+
+        breaker = getCircuitBreaker(uri) if self.useCircuitBreaker else None
+        if breaker is not None:
+            try:
+                breaker.allowRequest()
+            except CircuitBreakerOpen, e:
+                self._recordOutcome(None, replica, 0, e)
+                raise
+
+        token = spec.cancellationToken
+        limiter = getLimiter(uri)
+        if limiter is not None:
+            try:
+                limiter.acquire(timeout=spec.deadline, cancellationToken=token)
+            except (LimitExceeded, QueryCancelled):
+                self._recordOutcome(breaker, replica, None)
+                raise
+        if token is not None and token.cancelled:
+            self._recordOutcome(breaker, replica, None, limiter=limiter)
+            raise QueryCancelled()
+
+        passwordManager = None
+        if spec.user and spec.passwd and spec.http_auth == DIGEST and not self._usesGlobalOpener():
+            passwordManager = self._getPasswordManager(uri, spec)
+
+        options = {"timeout": spec.timeout, "passwordManager": passwordManager}
+        if spec.connectTimeout:
+            options["connectTimeout"] = spec.connectTimeout
+        # cancelling the token aborts the request in flight, if the transport can do it
+        key = token.register(lambda: self.transport.abort(request)) if token is not None else None
+        start = time.time()
+        try:
+            response = self.transport.open(request, **options)
+        except Exception, e:
+            if token is not None and token.cancelled:
+                self._recordOutcome(breaker, replica, None, limiter=limiter)  # the outcome is unknown
+                raise QueryCancelled()
+            self._recordOutcome(breaker, replica, time.time() - start, e, limiter)
+            if isinstance(e, urllib2.HTTPError) and self._isAutoGetRejected(spec, request, e):
+                return self._queryAttempt(spec._replace(method=POST), tried)
+            raise
+        finally:
+            if key is not None:
+                token.unregister(key)
+        self._recordOutcome(breaker, replica, time.time() - start, limiter=limiter)
+        return decodeResponse(response), spec.returnFormat
+
+    def _hedgedQueryAttempt(self, spec, tried):
+        """Internal method to send the query once, hedged according to the L{hedgingPolicy}: if no response has been
+        received after the delay of the policy, the query is sent again (within the budget of the policy), and the
+        first successful response is used. The other request is aborted at once (see L{Transport.abort
+        <SPARQLWrapper.Transport.Transport.abort>}), or else its response is closed as soon as it is received.
+        @param spec: The request specification.
+        @type spec: L{QuerySpec}
+        @param tried: The replicas already queried for the same query, extended with the ones queried now.
+        @type tried: list of L{Replica<SPARQLWrapper.LoadBalancing.Replica>}
+        @return: tuples with the raw request plus the expected format.
+        """
+        policy = self.hedgingPolicy
+        outcomes = Queue.Queue()
+        lock = threading.Lock()
+        decided = []
+        tokens = {}  # the token aborting each request, by hedge flag
 
+        def attempt(hedge):
+            start = time.time()
+            try:
+                result = self._queryAttempt(spec._replace(cancellationToken=tokens[hedge]), tried)
+                outcome = (hedge, result, None, time.time() - start)
+                policy.record(outcome[3])  # the latency of the dismissed requests counts too
+            except Exception, e:
+                outcome = (hedge, None, e, None)
+            with lock:
+                if not decided:
+                    outcomes.put(outcome)
+                    return
+            _dismiss(outcome)
+
+        def start(hedge):
+            tokens[hedge] = CancellationToken()
+            if spec.cancellationToken is not None and spec.cancellationToken.cancelled:
+                tokens[hedge].cancel()
+            thread = threading.Thread(target=attempt, args=(hedge,))
+            thread.daemon = True
+            thread.start()
+
+        parent = spec.cancellationToken  # the requests are aborted when the query is cancelled
+        key = parent.register(lambda: [token.cancel() for token in list(tokens.values())]) if parent else None
         try:
-            if self.timeout:
-                response = urlopener(request, timeout=self.timeout)
-            else:
-                response = urlopener(request)
-            return response, self.returnFormat
-        except urllib2.HTTPError, e:
-            if e.code == 400:
-                raise QueryBadFormed(e.read())
-            elif e.code == 404:
-                raise EndPointNotFound(e.read())
-            elif e.code == 401:
-                raise Unauthorized(e.read())
-            elif e.code == 414:
-                raise URITooLong(e.read())
-            elif e.code == 500:
-                raise EndPointInternalError(e.read())
-            else:
-                raise e
+            delay = policy.startRequest()
+            start(False)
+            pending = 1
+            try:
+                outcome = outcomes.get(timeout=delay) if delay is not None else outcomes.get()
+            except Queue.Empty:
+                if policy.allowHedge():
+                    start(True)
+                    pending += 1
+                outcome = outcomes.get()
+            pending -= 1
+            while outcome[2] is not None and pending:
+                outcome = outcomes.get()
+                pending -= 1
+        finally:
+            if key is not None:
+                parent.unregister(key)
+        with lock:
+            decided.append(outcome)
+        for hedge, token in tokens.items():
+            if hedge != outcome[0]:
+                token.cancel()  # the other request, if still in flight
+        while not outcomes.empty():
+            _dismiss(outcomes.get())
+
+        hedge, result, error, latency = outcome
+        if error is not None:
+            raise error
+        if hedge:
+            policy.recordHedgeWin()
+        return result
+
+    def _recordOutcome(self, breaker, replica, latency, error=None, limiter=None):
+        """Internal method for recording the outcome of a request in the circuit breaker and in the limiter of the
+        endpoint, and in the L{replicaSet}.
+        @param breaker: The circuit breaker of the endpoint, if used.
+        @type breaker: L{CircuitBreaker<SPARQLWrapper.CircuitBreaker.CircuitBreaker>}
+        @param replica: The replica queried, if any.
+        @type replica: L{Replica<SPARQLWrapper.LoadBalancing.Replica>}
+        @param latency: Time (in seconds) taken by the request, until the response headers were received, or C{None}
+        if the request was cancelled.
+        @type latency: float
+        @param error: The exception raised when sending the request, if any.
+        @type error: Exception
+        @param limiter: The limiter of the endpoint, if the request has been let through it.
+        @type limiter: L{EndpointLimiter<SPARQLWrapper.Limiter.EndpointLimiter>}
+        """
+        if breaker is not None:
+            breaker.record(latency, error)
+        if limiter is not None:
+            limiter.release(latency, error)
+        if replica is not None:
+            self.replicaSet.release(replica, latency, error)
+
+    def _getRetryDelay(self, spec, error, attempt):
+        """Internal method for getting the delay before retrying a failed request, according to the L{retryPolicy}.
+        @param spec: The request specification.
+        @type spec: L{QuerySpec}
+        @param error: The exception raised when sending the request.
+        @type error: Exception
+        @param attempt: Number of the failed attempt.
+        @type attempt: int
+        @return: the delay, in seconds, or C{None} if the request must not be retried.
+        @rtype: float
+        """
+        if self.retryPolicy is None:
+            return None
+        return self.retryPolicy.getRetryDelay(error, attempt, spec.isSparqlUpdateRequest())
+
+    def _isAutoGetRejected(self, spec, request, e):
+        """Internal method for checking if a query sent by GET with the L{AUTO} method has been rejected with a
+        C{414} status, in which case it must be sent again by POST. The length of the request URL is then remembered
+        for the endpoint.
+        @param spec: The request specification.
+        @type spec: L{QuerySpec}
+        @param request: The request sent.
+        @type request: C{urllib2.Request}
+        @param e: The HTTP error.
+        @type e: C{urllib2.HTTPError}
+        @rtype: bool
+        """
+        if e.code != 414 or spec.method != AUTO or request.get_method() != GET:
+            return False
+        _rememberURITooLong(spec.endpoint, len(request.get_full_url()))
+        return True
+
+    def _raiseHTTPError(self, e):
+        """Internal method for raising the exception corresponding to an HTTP error response.
+        @param e: The HTTP error.
+        @type e: C{urllib2.HTTPError}
+        @raise QueryBadFormed: If the C{HTTP return code} is C{400}.
+        @raise Unauthorized: If the C{HTTP return code} is C{401}.
+        @raise EndPointNotFound: If the C{HTTP return code} is C{404}.
+        @raise URITooLong: If the C{HTTP return code} is C{414}.
+        @raise EndPointInternalError: If the C{HTTP return code} is C{500}.
+        @raise urllib2.HTTPError: Otherwise.
+        """
+        if e.code == 400:
+            raise QueryBadFormed(decodeResponse(e).read())
+        elif e.code == 404:
+            raise EndPointNotFound(decodeResponse(e).read())
+        elif e.code == 401:
+            raise Unauthorized(decodeResponse(e).read())
+        elif e.code == 414:
+            raise URITooLong(decodeResponse(e).read())
+        elif e.code == 500:
+            raise EndPointInternalError(decodeResponse(e).read())
+        else:
+            raise e
+
+    def _cancelOnServer(self, spec, queryId, tried):
+        """Internal method for asking the server to cancel a query, in the background (it is called by the thread
+        cancelling the token). The answer of the server is ignored: the query is abandoned anyway.
+        @param spec: The request specification.
+        @type spec: L{QuerySpec}
+        @param queryId: The id of the query, see L{_withServerQueryId}.
+        @type queryId: string
+        @param tried: The replicas queried, if any.
+        @type tried: list of L{Replica<SPARQLWrapper.LoadBalancing.Replica>}
+        """
+        # Blazegraph: POST <endpoint>?cancelQuery&queryId=<id>
+        requests = []
+        for uri in set(replica.url for replica in tried) or [spec.endpoint]:
+            request = urllib2.Request(uri + "?cancelQuery&queryId=" + urllib.quote(queryId), data=b"")
+            request.add_header("User-Agent", spec.agent)
+            if spec.user and spec.passwd and spec.http_auth == BASIC:
+                credentials = "%s:%s" % (spec.user, spec.passwd)
+                request.add_header("Authorization", "Basic %s" % base64.b64encode(credentials.encode('utf-8')).decode('utf-8'))
+            for customHttpHeader, value in spec.customHttpHeaders:
+                request.add_header(customHttpHeader, value)
+            requests.append(request)
+
+        def send():
+            for request in requests:
+                try:
+                    self.transport.open(request, timeout=spec.timeout).close()
+                except Exception:
+                    pass
+
+        thread = threading.Thread(target=send)
+        thread.daemon = True
+        thread.start()
 
     def query(self):
         """
@@ -924,6 +1785,195 @@ class SPARQLWrapper(object):
         res = self.query()
         return res.convert()
 
+    def prepare(self, query, **overrides):
+        """
+            Prepare an immutable L{QuerySpec} for a query, to be run with L{execute}. The spec is a snapshot of the
+            current settings of the instance (return format, method, parameters, credentials, etc); later changes
+            of the instance do not affect it.
+            @since: 1.8.3
+
+            The query can also be a template, with variables to replace by RDF terms for each run (see
+            L{QuerySpec.bind}): it is parsed only once.
+
+            @param query: query text
+            @type query: string
+            @param overrides: settings of the spec that differ from the current settings of the instance, using the
+            names of the L{QuerySpec} fields (eg, C{returnFormat=JSON}, C{method=POST}). C{parameters} and
+            C{customHttpHeaders} can be given as dictionaries, like the corresponding instance attributes.
+            @return: the request specification
+            @rtype: L{QuerySpec}
+            @raise TypeError: If the C{query} parameter is not an unicode-string or utf-8 encoded byte-string, or if
+            an override is not a L{QuerySpec} field.
+            @raise ValueError: If an override has not an allowed value.
+        """
+        query = self._decodeQuery(query)
+        spec = self._getQuerySpec()._replace(queryString=query, queryType=self._parseQueryType(query))
+        return spec.replace(**overrides)
+
+    def execute(self, spec):
+        """
+            Execute a query prepared with L{prepare}. Contrary to L{query}, this method does not read nor modify
+            the settings of the instance, so it is safe to call it from several threads at once on a shared instance.
+            @since: 1.8.3
+
+            @param spec: The request specification.
+            @type spec: L{QuerySpec}
+            @return: query result
+            @rtype: L{QueryResult} instance
+        """
+        return QueryResult(self._query(spec))
+
+    def queryMany(self, queries, max_workers=4, ordered=False, convert=False):
+        """
+            Execute many independent queries over a bounded pool of threads, sharing the persistent connections of
+            the instance (or, if the default transport is used, of a L{ConnectionPool} of the batch, see
+            L{setUseKeepAlive}, closed once the queries are done and their responses read). The queries are run with
+            L{execute}, so the settings of the instance are not modified.
+
+            The queries are prepared and started at once, and their outcomes are yielded by the returned iterator as
+            they complete (or in the order of the queries, if C{ordered} is set). A failing query does not abort the
+            batch: its exception is reported in its outcome. If the iteration is stopped early, the queries not
+            started yet are dismissed.
+            @since: 1.8.3
+
+            @param queries: the queries, either query strings or L{QuerySpec} instances (see L{prepare}).
+            @type queries: iterable
+            @param max_workers: Maximum number of concurrent requests.
+            @type max_workers: int
+            @param ordered: Yield the outcomes in the order of the queries, instead of as they complete.
+            @type ordered: bool
+            @param convert: Convert the results (see L{QueryResult.convert}), instead of returning L{QueryResult}
+            instances.
+            @type convert: bool
+            @return: an iterator of L{QueryOutcome} instances.
+            @raise TypeError: If a query is not an unicode-string or utf-8 encoded byte-string (see L{prepare}).
+        """
+        specs = [query if isinstance(query, QuerySpec) else self.prepare(query) for query in queries]
+        sparql = self
+        pool = None
+        if type(self.transport) is UrllibTransport:
+            # a copy of the instance, sending the queries of the batch over persistent connections
+            pool = ConnectionPool(maxsize=max_workers)
+            sparql = copy.copy(self)
+            sparql.transport = PooledTransport(pool)
+
+        pending = Queue.Queue()
+        for item in enumerate(specs):
+            pending.put(item)
+        done = Queue.Queue()
+        stopped = threading.Event()
+        lock = threading.Lock()
+        running = [min(max_workers, len(specs))]
+
+        def worker():
+            try:
+                while not stopped.is_set():
+                    try:
+                        index, spec = pending.get_nowait()
+                    except Queue.Empty:
+                        return
+                    try:
+                        result = sparql.execute(spec)
+                        done.put(QueryOutcome(index, spec, result.convert() if convert else result, None))
+                    except Exception, e:
+                        done.put(QueryOutcome(index, spec, None, e))
+            finally:
+                with lock:
+                    running[0] -= 1
+                    last = not running[0]
+                if last and pool is not None:
+                    pool.close()  # the connections of the responses not read yet are closed once read
+
+        if pool is not None and not specs:
+            pool.close()
+        for _ in range(running[0]):
+            thread = threading.Thread(target=worker)
+            thread.daemon = True
+            thread.start()
+
+        def outcomes():
+            try:
+                completed = {}
+                for expected in range(len(specs)):
+                    if not ordered:
+                        yield done.get()
+                        continue
+                    while expected not in completed:
+                        outcome = done.get()
+                        completed[outcome.index] = outcome
+                    yield completed.pop(expected)
+            finally:
+                stopped.set()
+
+        return outcomes()
+
+    def queryBatch(self, query, bindings, maxRows=500, maxLength=65536, max_workers=4):
+        """
+            Execute a lookup query for many bindings of some of its variables, in a few requests: the bindings are
+            sent in the C{VALUES} clause of the queries (see L{Batching<SPARQLWrapper.Batching>}), and the rows of the
+            results are given back to the bindings they match. The queries are run with L{queryMany}, so the settings
+            of the instance are not modified.
+            @since: 1.8.3
+
+            @param query: the C{SELECT} query, either a query string or a L{QuerySpec} (see L{prepare}). It must
+            project the variables of the bindings.
+            @param bindings: the values of the variables for each lookup, as dictionaries of values by name (see
+            L{Template<SPARQLWrapper.Template>}), all with the same names.
+            @type bindings: iterable
+            @param maxRows: Maximum number of bindings sent in a request.
+            @type maxRows: int
+            @param maxLength: Maximum length of the query of a request, once URL encoded.
+            @type maxLength: int
+            @param max_workers: Maximum number of concurrent requests.
+            @type max_workers: int
+            @return: the rows of the results of each lookup, in the order of the bindings. The rows are dictionaries of
+            the terms by variable name, as in the JSON results (or L{Value<SPARQLWrapper.SmartWrapper.Value>}
+            instances, for a L{SPARQLWrapper2<SPARQLWrapper.SmartWrapper.SPARQLWrapper2>}).
+            @rtype: list of list of dict
+            @raise ValueError: If the query is not a C{SELECT} query, or the bindings do not have the same names.
+        """
+        from Batching import LookupBatch  # not at the top: Batching needs SmartWrapper, which needs this module
+
+        spec = query if isinstance(query, QuerySpec) else self.prepare(query)
+        batch = LookupBatch(spec.queryString, list(bindings), maxRows, maxLength)
+        specs = [spec._replace(queryString=batchQuery, returnFormat=JSON) for batchQuery in batch.queries]
+        for outcome in self.queryMany(specs, max_workers):
+            if outcome.error is not None:
+                raise outcome.error
+            result = outcome.result
+            batch.addResults(result.convert()["results"]["bindings"] if isinstance(result, QueryResult) else result.bindings)
+        return batch.getResults()
+
+    def _getQuerySpec(self):
+        """Internal method for taking a snapshot of the current settings of the instance.
+        @return: the request specification
+        @rtype: L{QuerySpec}
+        """
+        return QuerySpec(
+            endpoint=self.endpoint,
+            updateEndpoint=self.updateEndpoint,
+            agent=self.agent,
+            user=self.user,
+            passwd=self.passwd,
+            realm=getattr(self, "realm", "SPARQL"),
+            http_auth=self.http_auth,
+            onlyConneg=self.onlyConneg,
+            useCompression=self.useCompression,
+            customHttpHeaders=_freeze(self.customHttpHeaders),
+            queryString=self.queryString,
+            queryType=self.queryType,
+            returnFormat=self.returnFormat,
+            method=self.method,
+            requestMethod=self.requestMethod,
+            maxGetLength=self.maxGetLength,
+            parameters=_freeze(self.parameters),
+            timeout=self.timeout,
+            connectTimeout=self.connectTimeout,
+            deadline=self.deadline,
+            serverType=self.serverType,
+            cancellationToken=self.cancellationToken,
+            queryId=None)
+
     def __str__(self):
         """This method returns the string representation of a L{SPARQLWrapper} object.
         @return: A human-readable string of the object.
@@ -939,6 +1989,221 @@ class SPARQLWrapper(object):
 #######################################################################################################
 
 
+def _freeze(d):
+    """Internal function for getting an immutable (and hashable) copy of the C{parameters} or C{customHttpHeaders}
+    dictionaries: a sorted tuple of C{(key, value)} pairs, where the lists of values are turned into tuples.
+    """
+    return tuple(sorted((k, tuple(v) if isinstance(v, list) else v) for k, v in d.items()))
+
+
+def _dismiss(outcome):
+    """Internal function for dismissing the outcome of a hedged request that has not been used: the response is closed.
+    """
+    hedge, result, error, latency = outcome
+    if result is not None:
+        result[0].close()
+
+
+def _dismissResult(result):
+    """Internal function for dismissing the result of an attempt that has not been used (its query has been cancelled
+    meanwhile): the response is closed.
+    """
+    result[0].close()
+
+
+def _withServerQueryId(spec):
+    """Internal function for giving an id to a query, so that it can be cancelled on the server, if the server type is
+    known to support it (Blazegraph only, with its C{queryId} parameter).
+    @return: a tuple with the spec and the id of the query (or C{None}).
+    """
+    if spec.serverType != BLAZEGRAPH or not spec.isSparqlQueryRequest():
+        return spec, None
+    queryId = str(uuid.uuid4())
+    return spec._replace(queryId=queryId), queryId
+
+
+def _boundByDeadline(spec, expires):
+    """Internal function for getting the spec of an attempt, whose timeouts (and the time given to the server) are
+    bounded by the time left before the deadline of the query.
+    @raise DeadlineExceeded: If the deadline is exceeded.
+    """
+    if expires is None:
+        return spec
+    remaining = expires - time.time()
+    if remaining <= 0:
+        raise DeadlineExceeded()
+    connectTimeout = min(spec.connectTimeout, remaining) if spec.connectTimeout else None
+    return spec._replace(deadline=remaining, timeout=min(spec.timeout or remaining, remaining),
+                         connectTimeout=connectTimeout)
+
+
+def _getMaxGetLength(endpoint, maxGetLength):
+    """Internal function for getting the maximum length of the request URL for sending a query to an endpoint by
+    GET: the configured one, unless a shorter URL has already been rejected by the endpoint with a C{414} status.
+    """
+    rejected = _uriTooLongLengths.get(endpoint)
+    if rejected is not None:
+        return min(maxGetLength, rejected - 1)
+    return maxGetLength
+
+
+def _rememberURITooLong(endpoint, length):
+    """Internal function for remembering the length of a request URL rejected by an endpoint with a C{414} status.
+    """
+    with _uriTooLongLock:
+        _uriTooLongLengths[endpoint] = min(length, _uriTooLongLengths.get(endpoint, length))
+
+
+def _encodeParameter(name, value):
+    """Internal function for URL encoding a C{name=value} parameter of a request.
+    """
+    return "%s=%s" % (urllib.quote_plus(name.encode('UTF-8'), safe='/'), urllib.quote_plus(value.encode('UTF-8'), safe='/'))
+
+
+class _RequestTemplate(object):
+    """Internal class of the parts of the requests of a L{QuerySpec} which do not depend on its query string (see
+    L{SPARQLWrapper._getRequestTemplate}): a request only has to encode its query string.
+
+    @ivar headers: The headers of the requests, by (capitalized) field name.
+    @type headers: dict
+    """
+
+    def __init__(self, parameters, headers, serverTimeoutParameter=None):
+        """
+        @param parameters: The names of the parameters, with their encoded C{name=value} pairs.
+        @type parameters: list of (string, string) tuples
+        @param headers: The headers, in the order they are set (the last value of a field wins).
+        @type headers: list of (string, string) tuples
+        @param serverTimeoutParameter: The name of the parameter of the time the query is allowed to run on the
+        server (see L{SPARQLWrapper.setServerType}), if it is sent.
+        @type serverTimeoutParameter: string
+        """
+        self._parameters = parameters
+        self._encoded = {}  # the encoded parameters, without the one carrying the query string (which replaces it)
+        self._serverTimeoutParameter = serverTimeoutParameter
+        self.headers = dict((name.capitalize(), value) for name, value in headers)
+
+    def encodeParameters(self, name=None, queryString=None, serverTimeout=None, queryId=None):
+        """
+        Get the encoded parameters of a request.
+        @param name: The name of the parameter carrying the query string (C{query} or C{update}), if any.
+        @type name: string
+        @param queryString: The query string.
+        @type queryString: string
+        @param serverTimeout: The time (in seconds) the query is allowed to run on the server, if any. It changes with
+        each attempt of a query with a deadline, so it is not part of the template.
+        @type serverTimeout: float
+        @param queryId: The id of the query on the server (see L{QuerySpec}), if any. It changes with each query, so it
+        is not part of the template either.
+        @type queryId: string
+        @rtype: string
+        """
+        parameters = self._encoded.get(name)
+        if parameters is None:
+            parameters = self._encoded[name] = "&".join(pair for param, pair in self._parameters if param != name)
+        pairs = [parameters] if parameters else []
+        if name is not None:
+            pairs.insert(0, _encodeParameter(name, queryString))
+        if self._serverTimeoutParameter and serverTimeout:
+            # in milliseconds
+            pairs.append(_encodeParameter(self._serverTimeoutParameter, str(int(math.ceil(serverTimeout * 1000)))))
+        if queryId:
+            pairs.append(_encodeParameter("queryId", queryId))
+        return "&".join(pairs)
+
+
+class QuerySpec(namedtuple("QuerySpec", ["endpoint", "updateEndpoint", "agent", "user", "passwd", "realm", "http_auth",
+                                         "onlyConneg", "useCompression", "customHttpHeaders", "queryString",
+                                         "queryType", "returnFormat", "method", "requestMethod", "maxGetLength",
+                                         "parameters", "timeout", "connectTimeout", "deadline", "serverType",
+                                         "cancellationToken", "queryId"])):
+    """
+    Immutable specification of a request, as returned by L{SPARQLWrapper.prepare}. Users should not create instances
+    of this class directly. The fields have the same name and meaning as the attributes of L{SPARQLWrapper}, except
+    that C{parameters} and C{customHttpHeaders} are sorted tuples of C{(name, value)} pairs (and, for the parameters,
+    the values are tuples too). The C{queryId} field is set by the wrapper for each query it can cancel on the server
+    (Blazegraph only, with its C{queryId} parameter), and it is C{None} otherwise.
+
+    Being immutable, a spec can be freely shared between threads and used as a dictionary key.
+    @since: 1.8.3
+    """
+    __slots__ = ()
+
+    def replace(self, **overrides):
+        """
+        Return a copy of the spec with some fields replaced. The values are checked the same way the setters of
+        L{SPARQLWrapper} do it. The query string cannot be replaced (use L{SPARQLWrapper.prepare} instead).
+        @param overrides: fields to replace. C{parameters} and C{customHttpHeaders} can also be dictionaries.
+        @return: the new request specification
+        @rtype: L{QuerySpec}
+        @raise TypeError: If an override is not a field.
+        @raise ValueError: If an override has not an allowed value.
+        """
+        unknown = [name for name in overrides if name not in self._fields or name == "queryString"]
+        if unknown:
+            # the query string is not replaceable, as its type must be detected again: use SPARQLWrapper.prepare
+            raise TypeError("Unexpected QuerySpec field(s): %s" % ", ".join(sorted(unknown)))
+        for name, allowed in [("returnFormat", _allowedFormats), ("method", _allowedRequests),
+                              ("requestMethod", _REQUEST_METHODS), ("http_auth", _allowedAuth),
+                              ("queryType", _allowedQueryTypes)]:
+            if name in overrides and overrides[name] not in allowed:
+                raise ValueError("Value of '%s' should be one of %s" % (name, ", ".join(allowed)))
+        if overrides.get("serverType") not in _allowedServerTypes + [None]:
+            raise ValueError("Value of 'serverType' should be one of %s" % ", ".join(_allowedServerTypes))
+        for name in ["parameters", "customHttpHeaders"]:
+            if isinstance(overrides.get(name), dict):
+                overrides[name] = _freeze(overrides[name])
+        return self._replace(**overrides)
+
+    def bind(self, *mappings, **bindings):
+        """
+        Return a copy of the spec with some variables of the query replaced by RDF terms (see
+        L{Template<SPARQLWrapper.Template>}): eg, C{spec.bind(uri=IRI("http://example.org/a"), label="A")} replaces
+        the C{?uri} (or C{$uri}) and C{?label} variables by C{<http://example.org/a>} and C{"A"}. The values are
+        escaped, so that they can not change the structure of the query. The query is split into segments once (for
+        all the bindings of a spec), and its type is not detected again.
+
+        The variables of the projection of a C{SELECT} query (and of a C{CONSTRUCT} template) should not be bound,
+        as an RDF term is not allowed there.
+        @param mappings: dictionaries of the values of the variables, by name (eg, for names which are Python
+        keywords).
+        @param bindings: the values of the variables, by name.
+        @return: the new request specification
+        @rtype: L{QuerySpec}
+        @raise TypeError: If a value has not a supported type.
+        @raise ValueError: If a value can not be serialized (eg, an IRI with a space).
+        """
+        from Template import getTemplate  # not at the top: Template needs SmartWrapper, which needs this module
+
+        for mapping in mappings:
+            bindings.update(mapping)
+        return self._replace(queryString=getTemplate(self.queryString).render(bindings))
+
+    def isSparqlUpdateRequest(self):
+        """ Returns C{TRUE} if the spec is for a SPARQL Update request.
+        @rtype: bool
+        """
+        return self.queryType in [INSERT, DELETE, CREATE, CLEAR, DROP, LOAD, COPY, MOVE, ADD]
+
+    def isSparqlQueryRequest(self):
+        """ Returns C{TRUE} if the spec is for a SPARQL Query request.
+        @rtype: bool
+        """
+        return not self.isSparqlUpdateRequest()
+
+
+class QueryOutcome(namedtuple("QueryOutcome", ["index", "spec", "result", "error"])):
+    """
+    Outcome of a query run by L{SPARQLWrapper.queryMany}: the C{index} of the query in the batch, its C{spec} (see
+    L{QuerySpec}), and either its C{result} or the C{error} (exception) raised while running it.
+    @since: 1.8.3
+    """
+    __slots__ = ()
+
+
+#######################################################################################################
+
+
 class QueryResult(object):
     """
     Wrapper around an a query result. Users should not create instances of this class, it is
@@ -997,6 +2262,17 @@ class QueryResult(object):
         """Method for the standard iterator."""
         return self.response.next()
 
+    def cancel(self):
+        """Cancel the query, eg, from another thread: the response is closed, so a conversion in progress is
+        interrupted. If the query has a L{cancellation token<SPARQLWrapper.setCancellationToken>}, the token is
+        cancelled (so the server may be asked to cancel the query too).
+        @since: 1.8.3
+        """
+        if isinstance(self.response, CancellableResponse):
+            self.response.token.cancel()
+        else:
+            abortResponse(self.response)
+
     def _convertJSON(self):
         """
         Convert a JSON result into a Python dict. This method can be overwritten in a subclass
@@ -1083,7 +2359,23 @@ class QueryResult(object):
             - in the case of CSV/TSV, a string is returned.
         In all other cases the input simply returned.
 
+        If the query has a L{deadline<SPARQLWrapper.setDeadline>} or a
+        L{cancellation token<SPARQLWrapper.setCancellationToken>}, they are checked while the response is read, and
+        once it has been converted.
+
         @return: the converted query result. See the conversion methods for more details.
+        @raise DeadlineExceeded: If the deadline of the query is exceeded.
+        @raise QueryCancelled: If the query is cancelled.
+        """
+        result = self._convertByContentType()
+        if isinstance(self.response, (DeadlineResponse, CancellableResponse)):
+            self.response.check()
+        return result
+
+    def _convertByContentType(self):
+        """
+        Internal method for converting the response according to its C{Content-Type} (see L{convert}).
+        @return: the converted query result.
         """
         def _content_type_in_list(real, expected):
             return True in [real.find(mime) != -1 for mime in expected]
@@ -143,7 +143,8 @@ GET or POST
 ===========
 
 By default, all SPARQL services are invoked using HTTP GET. However, POST might be useful if the size of the query
-extends a reasonable size; this can be set in the query instance.
+extends a reasonable size; this can be set in the query instance. With the C{AUTO} method, the choice is made for each
+query, according to the length of the request URL (see C{setMethod} and C{setMaxGetLength}).
 
 Note that some combination may not work yet with all SPARQL processors
 (eg, there are implementations where POST+JSON return does not work). Hopefully, this problem will eventually disappear.
@@ -182,12 +183,29 @@ __date__ = "2018-05-16"
 
 __agent__ = "sparqlwrapper %s (rdflib.github.io/sparqlwrapper)" % __version__
 
+import sys
 
-from Wrapper import SPARQLWrapper
+from Wrapper import SPARQLWrapper, QuerySpec, QueryOutcome
 from Wrapper import XML, JSON, TURTLE, N3, JSONLD, RDF, RDFXML, CSV, TSV
-from Wrapper import GET, POST
+from Wrapper import GET, POST, AUTO
 from Wrapper import SELECT, CONSTRUCT, ASK, DESCRIBE, INSERT, DELETE
 from Wrapper import URLENCODED, POSTDIRECTLY
 from Wrapper import BASIC, DIGEST
+from Wrapper import VIRTUOSO, BLAZEGRAPH
 
 from SmartWrapper import SPARQLWrapper2
+from ConnectionPool import ConnectionPool
+from Transport import Transport, UrllibTransport, PooledTransport, InMemoryTransport
+from Retry import RetryPolicy
+from CircuitBreaker import CircuitBreaker, getCircuitBreaker, setCircuitBreaker
+from LoadBalancing import ReplicaSet, LoadBalancingPolicy, RoundRobinPolicy, LeastOutstandingPolicy, EWMAPolicy
+from Hedging import HedgingPolicy
+from Cancellation import CancellationToken
+from Limiter import EndpointLimiter, getLimiter, setLimiter
+from Coalescing import CoalescingGroup
+from Cache import ResultCache, MemoryCache, DiskCache
+from Template import IRI, Literal
+from Loader import DataLoader
+
+if sys.version_info >= (3, 5):
+    from AsyncWrapper import AsyncSPARQLWrapper, AsyncDataLoader
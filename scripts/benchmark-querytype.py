@@ -0,0 +1,51 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+# Microbenchmark of the detection of the query type (SPARQLWrapper.setQuery), on generated queries with a growing
+# number of PREFIX declarations and a growing VALUES block: the time per call must grow linearly with the prologue,
+# and not at all with the body of the query.
+
+import re
+import sys
+import timeit
+
+from SPARQLWrapper import SPARQLWrapper
+from SPARQLWrapper.Lexer import scanQuery
+
+# The regular expressions used before the lexer, for comparison
+prefix_pattern = re.compile(r"((?P<base>(\s*BASE\s*<.*?>)\s*)|(?P<prefixes>(\s*PREFIX\s+.+:\s*<.*?>)\s*))*")
+pattern = re.compile(r"(?P<queryType>(CONSTRUCT|SELECT|ASK|DESCRIBE|INSERT|DELETE|CREATE|CLEAR|DROP|LOAD|COPY|MOVE|ADD))", re.VERBOSE | re.IGNORECASE)
+comments_pattern = re.compile(r"(^|\n)\s*#.*?\n")
+
+
+def regexQueryType(query):
+    query = re.sub(comments_pattern, "\n\n", query)
+    return pattern.search(re.sub(prefix_pattern, "", query.strip())).group("queryType").upper()
+
+
+def generateQuery(prefixes, values):
+    lines = ["PREFIX ns%d: <http://example.org/vocabulary/%d#>" % (i, i) for i in range(prefixes)]
+    lines.append("SELECT ?s ?label WHERE {")
+    lines.append("  VALUES ?s { %s }" % " ".join("<http://example.org/resource/%d>" % i for i in range(values)))
+    lines.append("  ?s rdfs:label ?label")
+    lines.append("}")
+    return "\n".join(lines)
+
+
+def measure(function, query, number):
+    return min(timeit.repeat(lambda: function(query), number=number, repeat=3)) / number * 1000
+
+
+def main(number=20):
+    sparql = SPARQLWrapper("http://example.org/sparql")
+    print("%8s %8s %10s %12s %12s %12s" % ("prefixes", "values", "bytes", "lexer (ms)", "regex (ms)", "setQuery (ms)"))
+    for prefixes, values in [(10, 10), (100, 10), (1000, 10), (10, 10000), (10, 100000), (1000, 100000)]:
+        query = generateQuery(prefixes, values)
+        assert scanQuery(query).queryType == regexQueryType(query) == "SELECT"
+        print("%8d %8d %10d %12.3f %12.3f %12.3f" % (prefixes, values, len(query), measure(scanQuery, query, number),
+                                                    measure(regexQueryType, query, number),
+                                                    measure(sparql.setQuery, query, number)))
+
+
+if __name__ == "__main__":
+    main(*[int(arg) for arg in sys.argv[1:]])
@@ -0,0 +1,65 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+# Microbenchmark of the construction of the requests (SPARQLWrapper._createRequest), with a growing number of
+# parameters and custom headers: only the query string is encoded for each request, the rest is encoded once for the
+# same settings. The encoding of all the parameters and headers for each request is timed for comparison.
+
+import base64
+import sys
+import timeit
+import urllib
+import urllib2
+
+from SPARQLWrapper import SPARQLWrapper, JSON, POST
+
+
+def encodeAll(spec):
+    # all the parameters and headers, as encoded before the request templates
+    parameters = dict((name, list(values)) for name, values in spec.parameters)
+    parameters["query"] = [spec.queryString]
+    for name in ["format", "output", "results"]:
+        parameters[name] = [spec.returnFormat]
+    encoded = "&".join(
+        "%s=%s" % (urllib.quote_plus(name.encode("UTF-8"), safe="/"), urllib.quote_plus(value.encode("UTF-8"), safe="/"))
+        for name, values in parameters.items() for value in values)
+    if spec.method == POST:
+        request = urllib2.Request(spec.endpoint)
+        request.add_header("Content-Type", "application/x-www-form-urlencoded")
+        request.data = encoded.encode("ascii")
+    else:
+        request = urllib2.Request(spec.endpoint + "?" + encoded)
+    request.add_header("User-Agent", spec.agent)
+    request.add_header("Accept", "application/sparql-results+json,application/json,text/javascript,application/javascript")
+    request.add_header("Authorization", "Basic %s" % base64.b64encode(("%s:%s" % (spec.user, spec.passwd)).encode("utf-8")).decode("utf-8"))
+    for name, value in spec.customHttpHeaders:
+        request.add_header(name, value)
+    return request
+
+
+def generateWrapper(parameters, headers):
+    sparql = SPARQLWrapper("http://example.org/sparql", returnFormat=JSON)
+    sparql.setCredentials("user", "password")
+    for i in range(parameters):
+        sparql.addParameter("named-graph-uri", "http://example.org/graph/%d" % i)
+    for i in range(headers):
+        sparql.addCustomHttpHeader("X-Header-%d" % i, "value %d" % i)
+    return sparql
+
+
+def measure(function, spec, number):
+    return min(timeit.repeat(lambda: function(spec), number=number, repeat=3)) / number * 1000
+
+
+def main(number=2000):
+    print("%10s %8s %8s %14s %14s" % ("parameters", "headers", "method", "template (ms)", "encoding (ms)"))
+    for parameters, headers in [(0, 0), (10, 5), (100, 20), (1000, 50)]:
+        sparql = generateWrapper(parameters, headers)
+        for method in ["GET", POST]:
+            spec = sparql.prepare("SELECT * WHERE { ?s ?p ?o } LIMIT 10", method=method)
+            print("%10d %8d %8s %14.4f %14.4f" % (parameters, headers, method, measure(sparql._createRequest, spec, number),
+                                                  measure(encodeAll, spec, number)))
+
+
+if __name__ == "__main__":
+    main(*[int(arg) for arg in sys.argv[1:]])
@@ -0,0 +1,290 @@
+# -*- coding: utf-8 -*-
+import inspect
+import os
+import sys
+import json
+import threading
+import time
+import unittest
+import urllib2
+
+# prefer local copy to the one which is installed
+# hack from http://stackoverflow.com/a/6098238/280539
+_top_level_path = os.path.realpath(os.path.abspath(os.path.join(
+    os.path.split(inspect.getfile(inspect.currentframe()))[0],
+    ".."
+)))
+if _top_level_path not in sys.path:
+    sys.path.insert(0, _top_level_path)
+# end of hack
+
+try:
+    import asyncio
+    from SPARQLWrapper import AsyncSPARQLWrapper, AsyncDataLoader
+except (ImportError, SyntaxError):
+    asyncio = None  # Python < 3.5
+
+from SPARQLWrapper import JSON, XML, GET, POST, URLENCODED, POSTDIRECTLY, RetryPolicy, HedgingPolicy
+from SPARQLWrapper.Wrapper import QueryBadFormed, EndPointNotFound, DeadlineExceeded, QueryCancelled
+from SPARQLWrapper import CancellationToken, EndpointLimiter, setLimiter, IRI, MemoryCache, CoalescingGroup
+from SPARQLWrapper.SPARQLExceptions import LimitExceeded
+
+_RESULTS = b'{"head": {"vars": ["s"]}, "results": {"bindings": [{"s": {"type": "uri", "value": "urn:%d"}}]}}'
+
+
+class StubEndpointProtocol(object if asyncio is None else asyncio.Protocol):
+    """A local asyncio SPARQL endpoint (HTTP/1.1, keep-alive), answering with the callback of the test."""
+
+    def __init__(self, test):
+        self.test = test
+        self.buffer = b""
+
+    def connection_made(self, transport):
+        self.transport = transport
+        self.test.connections += 1
+
+    def data_received(self, data):
+        self.buffer += data
+        while True:
+            head, sep, rest = self.buffer.partition(b"\r\n\r\n")
+            if not sep:
+                return
+            lines = head.decode("latin-1").split("\r\n")
+            method, path, _ = lines[0].split(" ")
+            headers = dict((k.strip().lower(), v.strip()) for k, _, v in (line.partition(":") for line in lines[1:]))
+            length = int(headers.get("content-length", 0))
+            if len(rest) < length:
+                return
+            body, self.buffer = rest[:length], rest[length:]
+            self.test.requests.append((method, path, headers, body))
+            code, contentType, payload, chunked = self.test.respond(method, path, headers, body)
+            response = "HTTP/1.1 %d Stub\r\nContent-Type: %s\r\n" % (code, contentType)
+            if chunked:
+                middle = len(payload) // 2
+                payload = b"".join(b"%x\r\n%s\r\n" % (len(c), c) for c in [payload[:middle], payload[middle:]]) + b"0\r\n\r\n"
+                response += "Transfer-Encoding: chunked\r\n\r\n"
+            else:
+                response += "Content-Length: %d\r\n\r\n" % len(payload)
+            delay = self.test.delays.pop(0) if self.test.delays else 0
+            if delay:
+                asyncio.get_event_loop().call_later(delay, self.write, response.encode("latin-1") + payload)
+            else:
+                self.write(response.encode("latin-1") + payload)
+
+    def write(self, data):
+        if not self.transport.is_closing():
+            self.transport.write(data)
+
+
+class AsyncSPARQLWrapper_Test(unittest.TestCase):
+
+    def setUp(self):
+        if asyncio is None:
+            self.skipTest("asyncio is not available")
+        self.connections = 0
+        self.requests = []
+        self.chunked = False
+        self.failures = 0
+        self.delays = []
+        self.loop = asyncio.new_event_loop()
+        self.server = self.loop.run_until_complete(self.loop.create_server(lambda: StubEndpointProtocol(self), '127.0.0.1', 0))
+        self.url = "http://127.0.0.1:%d/sparql" % self.server.sockets[0].getsockname()[1]
+
+    def tearDown(self):
+        self.server.close()
+        self.loop.run_until_complete(self.server.wait_closed())
+        self.loop.close()
+
+    def respond(self, method, path, headers, body):
+        if "missing" in path:
+            return 404, "text/plain", b"not found", False
+        if "ASK" in path or b"ASK" in body:
+            return 400, "text/plain", b"bad query", False
+        if len(self.requests) <= self.failures:
+            return 503, "text/plain", b"overloaded", False
+        return 200, "application/sparql-results+json", _RESULTS % len(self.requests), self.chunked
+
+    def run_coroutine(self, coroutine):
+        return self.loop.run_until_complete(coroutine)
+
+    def testQueryAndConvert(self):
+        sparql = AsyncSPARQLWrapper(self.url, returnFormat=JSON)
+        sparql.setQuery('SELECT ?s WHERE { ?s ?p ?o }')
+        result = self.run_coroutine(sparql.query())
+        self.assertEqual(200, result.response.code)
+        self.assertEqual("urn:1", self.run_coroutine(result.convert())["results"]["bindings"][0]["s"]["value"])
+        self.assertEqual("urn:2", self.run_coroutine(sparql.queryAndConvert())["results"]["bindings"][0]["s"]["value"])
+
+        method, path, headers, body = self.requests[0]
+        self.assertEqual("GET", method)
+        self.assertTrue("format=json" in path)
+        self.assertTrue(headers["accept"].startswith("application/sparql-results+json"))
+        self.assertEqual(1, self.connections)
+
+    def testChunkedResponse(self):
+        self.chunked = True
+        sparql = AsyncSPARQLWrapper(self.url, returnFormat=JSON)
+        for i in range(1, 3):
+            self.assertEqual("urn:%d" % i, self.run_coroutine(sparql.queryAndConvert())["results"]["bindings"][0]["s"]["value"])
+        self.assertEqual(1, self.connections)
+
+    def testRequestSettings(self):
+        sparql = AsyncSPARQLWrapper(self.url, returnFormat=JSON)
+        sparql.setOnlyConneg(True)
+        sparql.setCredentials("login", "password")
+        sparql.addCustomHttpHeader("X-Foo", "bar")
+
+        sparql.setMethod(POST)
+        sparql.setRequestMethod(URLENCODED)
+        self.run_coroutine(sparql.queryAndConvert())
+        sparql.setRequestMethod(POSTDIRECTLY)
+        self.run_coroutine(sparql.queryAndConvert())
+
+        method, path, headers, body = self.requests[0]
+        self.assertEqual("POST", method)
+        self.assertEqual("application/x-www-form-urlencoded", headers["content-type"])
+        self.assertTrue(body.startswith(b"query=") or b"&query=" in body)
+        self.assertFalse(b"format=" in body)
+        self.assertEqual("bar", headers["x-foo"])
+        self.assertTrue(headers["authorization"].startswith("Basic "))
+
+        method, path, headers, body = self.requests[1]
+        self.assertEqual("application/sparql-query", headers["content-type"])
+        self.assertEqual(b"SELECT * WHERE{ ?s ?p ?o }", body)
+
+    def testErrors(self):
+        sparql = AsyncSPARQLWrapper(self.url)
+        sparql.setQuery('ASK { ?s ?p ?o }')
+        self.assertRaises(QueryBadFormed, self.run_coroutine, sparql.query())
+        sparql = AsyncSPARQLWrapper(self.url.replace("sparql", "missing"))
+        self.assertRaises(EndPointNotFound, self.run_coroutine, sparql.query())
+
+    def testRetry(self):
+        self.failures = 2
+        sparql = AsyncSPARQLWrapper(self.url, returnFormat=JSON)
+        policy = RetryPolicy(backoffFactor=0)
+        sparql.setRetryPolicy(policy)
+        self.assertEqual("urn:3", self.run_coroutine(sparql.queryAndConvert())["results"]["bindings"][0]["s"]["value"])
+        self.assertEqual(2, policy.getCounters()["retries"])
+
+    def testHedge(self):
+        self.delays = [0.5]
+        sparql = AsyncSPARQLWrapper(self.url, returnFormat=JSON)
+        policy = HedgingPolicy(delay=0.05, budget=1)
+        sparql.setHedgingPolicy(policy)
+        self.assertEqual("urn:2", self.run_coroutine(sparql.queryAndConvert())["results"]["bindings"][0]["s"]["value"])
+        self.assertEqual(2, len(self.requests))
+        self.assertEqual(2, self.connections)
+        self.assertEqual(1, policy.getCounters()["hedgeWins"])
+
+    def testDeadline(self):
+        self.delays = [0.5]
+        sparql = AsyncSPARQLWrapper(self.url, returnFormat=JSON)
+        sparql.setDeadline(0.1)
+        sparql.setConnectTimeout(1)
+        self.assertRaises(DeadlineExceeded, self.run_coroutine, sparql.query())
+        self.assertEqual("urn:2", self.run_coroutine(sparql.queryAndConvert())["results"]["bindings"][0]["s"]["value"])
+
+    def testCancel(self):
+        self.delays = [0.5]
+        token = CancellationToken()
+        sparql = AsyncSPARQLWrapper(self.url, returnFormat=JSON)
+        sparql.setCancellationToken(token)
+        timer = threading.Timer(0.05, token.cancel)
+        timer.start()
+        start = time.time()
+        self.assertRaises(QueryCancelled, self.run_coroutine, sparql.query())
+        self.assertTrue(time.time() - start < 0.4)
+        self.assertRaises(QueryCancelled, self.run_coroutine, sparql.query())
+        self.assertEqual(1, len(self.requests))
+
+    def testLimiter(self):
+        limiter = EndpointLimiter(maxConcurrency=2, maxWait=1)
+        setLimiter(self.url, limiter)
+        try:
+            sparql = AsyncSPARQLWrapper(self.url, returnFormat=JSON)
+            self.delays = [0.05] * 4
+            self.run_coroutine(sparql.gather(['SELECT ?s WHERE { ?s ?p %d }' % i for i in range(4)], concurrency=4))
+            self.assertTrue(self.connections <= 2)
+            counters = limiter.getCounters()
+            self.assertEqual(4, counters["acquired"])
+            self.assertTrue(counters["maxWaitTime"] >= 0.04)
+
+            limiter.maxWait = 0
+            limiter.acquire()
+            limiter.acquire()
+            self.assertRaises(LimitExceeded, self.run_coroutine, sparql.query())
+            self.assertEqual(1, limiter.getCounters()["rejected"])
+        finally:
+            setLimiter(self.url, None)
+
+    def testCache(self):
+        cache = MemoryCache(ttl=60)
+        sparql = AsyncSPARQLWrapper(self.url, returnFormat=JSON)
+        sparql.setCache(cache)
+        sparql.setQuery('SELECT ?s WHERE { ?s ?p ?o }')
+        self.assertEqual("urn:1", self.run_coroutine(sparql.queryAndConvert())["results"]["bindings"][0]["s"]["value"])
+        sparql.setDeadline(10)
+        sparql.setCancellationToken(CancellationToken())
+        result = self.run_coroutine(sparql.query())  # served from the cache
+        self.assertEqual("urn:1", self.run_coroutine(result.convert())["results"]["bindings"][0]["s"]["value"])
+        self.assertEqual(1, len(self.requests))
+        self.assertEqual(1, cache.getCounters()["hits"])
+
+        # an update removes the results it may modify, for all the wrappers sharing the cache
+        sparql.setQuery('INSERT DATA { <urn:a> <urn:b> <urn:c> }')
+        sparql.setMethod(POST)
+        self.run_coroutine(sparql.query())
+        self.assertEqual(0, cache.getCounters()["entries"])
+        sparql.setQuery('SELECT ?s WHERE { ?s ?p ?o }')
+        self.assertEqual("urn:3", self.run_coroutine(sparql.queryAndConvert())["results"]["bindings"][0]["s"]["value"])
+        self.assertEqual(3, len(self.requests))
+
+    def testCoalescing(self):
+        self.delays = [0.1]
+        sparql = AsyncSPARQLWrapper(self.url, returnFormat=JSON)
+        sparql.setCoalescingGroup(CoalescingGroup())
+        results = self.run_coroutine(sparql.gather(['SELECT ?s WHERE { ?s ?p ?o }'] * 3, concurrency=3))
+        self.assertEqual(["urn:1"] * 3, [result["results"]["bindings"][0]["s"]["value"] for result in results])
+        self.assertEqual(1, len(self.requests))
+
+    def testGather(self):
+        sparql = AsyncSPARQLWrapper(self.url, returnFormat=JSON)
+        queries = ['SELECT ?s WHERE { ?s ?p %d }' % i for i in range(20)]
+        queries.append(sparql.prepare('SELECT ?s WHERE { ?s ?p ?o }', returnFormat=XML))
+        queries.append('ASK { ?s ?p ?o }')
+        results = self.run_coroutine(sparql.gather(queries, concurrency=5, return_exceptions=True))
+
+        self.assertEqual(22, len(results))
+        self.assertEqual(22, len(self.requests))
+        self.assertTrue(self.connections <= 5)
+        for result in results[:20]:
+            self.assertEqual(["s"], result["head"]["vars"])
+        self.assertTrue("format=xml" in self.requests[-2][1] or "format=xml" in self.requests[-1][1])
+        self.assertIsInstance(results[-1], QueryBadFormed)
+
+        results = self.run_coroutine(sparql.gather(queries[:3], concurrency=2, convert=False))
+        self.assertEqual([200] * 3, [result.response.code for result in results])
+        self.assertEqual(json.loads(results[0].response.read().decode("utf-8"))["head"]["vars"], ["s"])
+
+    def testDataLoader(self):
+        sparql = AsyncSPARQLWrapper(self.url)
+        loader = AsyncDataLoader(sparql, 'SELECT ?s WHERE { ?s ?p ?o }', 's')
+
+        lookups = [self.loop.create_task(loader.load(IRI(uri))) for uri in ["urn:1", "urn:2", "urn:1"]]
+        first = self.run_coroutine(asyncio.gather(*lookups))
+        second = self.run_coroutine(loader.loadMany([IRI("urn:2"), IRI("urn:1")]))  # from the loader
+        self.assertEqual(1, len(self.requests))
+        self.assertTrue("VALUES" in self.requests[0][1] and "format=json" in self.requests[0][1])
+        self.assertEqual([["urn:1"], [], ["urn:1"]], [[row["s"]["value"] for row in rows] for rows in first])
+        self.assertEqual([[], ["urn:1"]], [[row["s"]["value"] for row in rows] for rows in second])
+
+        loader.clear()
+        self.failures = 2  # the batched query fails, and is sent again by the next lookup
+        self.assertRaises(urllib2.HTTPError, self.run_coroutine, loader.load(IRI("urn:1")))
+        self.assertEqual([], self.run_coroutine(loader.load(IRI("urn:1"))))
+        self.assertEqual(3, len(self.requests))
+
+
+if __name__ == "__main__":
+    unittest.main()
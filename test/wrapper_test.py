@@ -1,5 +1,6 @@
 # -*- coding: utf-8 -*-
 import inspect
+import json
 import os
 import sys
 
@@ -10,6 +11,7 @@ import urllib2
 from urlparse import urlparse, parse_qsl, parse_qs
 from urllib2 import Request
 import time
+import socket
 
 logging.basicConfig()
 
@@ -29,15 +31,47 @@ from urllib2 import HTTPError
 
 from io import StringIO
 import warnings
+import threading
+import BaseHTTPServer
+import SocketServer
+import gzip
+import multiprocessing
+import shutil
+import sqlite3
+import tempfile
+import zlib
+from decimal import Decimal
+from io import BytesIO
 warnings.simplefilter("always")
 
 import SPARQLWrapper.Wrapper as _victim
 
 from SPARQLWrapper import SPARQLWrapper
-from SPARQLWrapper import XML, GET, POST, JSON, JSONLD, N3, TURTLE, RDF, SELECT, INSERT, RDFXML, CSV, TSV
+from SPARQLWrapper import XML, GET, POST, AUTO, JSON, JSONLD, N3, TURTLE, RDF, SELECT, INSERT, RDFXML, CSV, TSV
 from SPARQLWrapper import URLENCODED, POSTDIRECTLY
 from SPARQLWrapper import BASIC, DIGEST
 from SPARQLWrapper.Wrapper import QueryResult, QueryBadFormed, EndPointNotFound, EndPointInternalError, Unauthorized, URITooLong
+from SPARQLWrapper import ConnectionPool, QuerySpec, QueryOutcome, SPARQLWrapper2
+from SPARQLWrapper import Transport, UrllibTransport, PooledTransport, InMemoryTransport, RetryPolicy
+from SPARQLWrapper import CircuitBreaker, getCircuitBreaker, setCircuitBreaker
+from SPARQLWrapper.CircuitBreaker import CLOSED, OPEN, HALF_OPEN
+from SPARQLWrapper import ReplicaSet, RoundRobinPolicy, LeastOutstandingPolicy, EWMAPolicy, HedgingPolicy
+from SPARQLWrapper.Wrapper import CircuitBreakerOpen, DeadlineExceeded, QueryCancelled
+from SPARQLWrapper import CancellationToken
+from SPARQLWrapper import EndpointLimiter, setLimiter, CoalescingGroup, MemoryCache, DiskCache
+from SPARQLWrapper.Cache import CacheEntry, getFreshnessLifetime, updateHeaders
+from SPARQLWrapper.Invalidation import getUpdatedGraphs, getQueryGraphs
+from SPARQLWrapper.Lexer import scanQuery
+from SPARQLWrapper import IRI, Literal
+from SPARQLWrapper.Template import getTemplate
+from SPARQLWrapper.Batching import splitBatches, termKey
+from SPARQLWrapper import DataLoader
+from SPARQLWrapper.SmartWrapper import Value
+from SPARQLWrapper.SPARQLExceptions import LimitExceeded
+from SPARQLWrapper import VIRTUOSO, BLAZEGRAPH
+from SPARQLWrapper.SmartWrapper import Bindings
+from SPARQLWrapper.Compression import DecompressingResponse
+from SPARQLWrapper.Transport import BufferedResponse, bufferResponse
 
 
 class FakeResult(object):
@@ -65,6 +99,66 @@ def urlopener_check_data_encoding(request):
             raise TypeError
 # DONE
 
+
+class LocalEndpoint(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    """A local SPARQL endpoint (HTTP/1.1, keep-alive). By default, it answers every request with a canned response;
+    tests can replace the respond method."""
+    daemon_threads = True
+
+    def __init__(self, body=b'{"head": {"vars": []}, "results": {"bindings": []}}', content_type="application/sparql-results+json"):
+        self.body = body
+        self.content_type = content_type
+        self.connections = 0
+        self.disconnections = 0
+        self.requests = []
+        BaseHTTPServer.HTTPServer.__init__(self, ('127.0.0.1', 0), LocalEndpointHandler)
+        thread = threading.Thread(target=self.serve_forever, kwargs={'poll_interval': 0.01})
+        thread.daemon = True
+        thread.start()
+
+    @property
+    def url(self):
+        return "http://127.0.0.1:%d/sparql" % self.server_address[1]
+
+    def respond(self, command, path, headers, body):
+        """@return: a tuple with the status code, the headers and the body of the response"""
+        return 200, {"Content-Type": self.content_type}, self.body
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+
+class LocalEndpointHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def setup(self):
+        BaseHTTPServer.BaseHTTPRequestHandler.setup(self)
+        self.server.connections += 1
+
+    def finish(self):
+        BaseHTTPServer.BaseHTTPRequestHandler.finish(self)
+        self.server.disconnections += 1
+
+    def _respond(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        request = (self.command, self.path, dict(self.headers.items()), self.rfile.read(length))
+        self.server.requests.append(request)
+        code, headers, body = self.server.respond(*request)
+        self.send_response(code)
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    do_GET = _respond
+    do_POST = _respond
+
+    def log_message(self, *args):
+        pass
+
+
 class TestCase(unittest.TestCase):
 
     def assertIsInstance(self, obj, cls, msg=None, *args, **kwargs):
@@ -730,6 +824,124 @@ WHERE {
         self.wrapper.setQuery(query)
         self.assertTrue(self.wrapper.isSparqlQueryRequest())
 
+    def testKeywordsInTokens(self):
+        # keywords in IRIs, strings and comments are not query forms
+        self.wrapper.setQuery('PREFIX ex: <http://example.org/insert#>\n# DELETE this\nSELECT * { ?s ex:p "CLEAR" }')
+        self.assertEqual(SELECT, self.wrapper.queryType)
+        self.wrapper.setQuery('BASE <http://example.org/select/> PREFIX : <drop#> INSERT DATA { <a> :b "ask" }')
+        self.assertEqual(INSERT, self.wrapper.queryType)
+        self.wrapper.setQuery('WITH <http://example.org/g> DELETE { ?s ?p ?o } WHERE { ?s ?p ?o }')
+        self.assertTrue(self.wrapper.isSparqlUpdateRequest())
+
+        query = 'PREFIX a: <http://example.org/a#>\n  PREFIX b:<urn:b>\n\nselect* { ?s a:p """ASK\n""" }'
+        scanned = scanQuery(query)
+        self.assertEqual(SELECT, scanned.queryType)
+        self.assertEqual(0, scanned.prologueStart)
+        self.assertEqual(query.index("<urn:b>") + 7, scanned.prologueEnd)
+        self.assertEqual(query.index("select"), scanned.keywordOffset)
+        self.assertEqual((None, 2, 2, 8), scanQuery('  "ask" '))
+
+    def testPrepare(self):
+        self.wrapper.setReturnFormat(JSON)
+        self.wrapper.addParameter('foo', 'bar')
+        spec = self.wrapper.prepare('INSERT DATA { <urn:a> <urn:b> <urn:c> }', method=POST, parameters={'baz': ['qux']})
+        self.assertIsInstance(spec, QuerySpec)
+        self.assertEqual(INSERT, spec.queryType)
+        self.assertTrue(spec.isSparqlUpdateRequest())
+        self.assertEqual(JSON, spec.returnFormat)
+        self.assertEqual(POST, spec.method)
+        self.assertEqual((('baz', ('qux',)),), spec.parameters)
+        self.assertRaises(AttributeError, setattr, spec, 'method', GET)
+        self.assertEqual(hash(spec), hash(spec.replace()))
+
+        # the instance is not modified, and later changes do not affect the spec
+        self.assertEqual(SELECT, self.wrapper.queryType)
+        self.assertEqual(GET, self.wrapper.method)
+        self.wrapper.setReturnFormat(XML)
+        self.assertEqual(JSON, spec.returnFormat)
+
+        self.assertEqual(XML, spec.replace(returnFormat=XML).returnFormat)
+        self.assertRaises(ValueError, spec.replace, method='PUT')
+        self.assertRaises(TypeError, spec.replace, queryString='SELECT * WHERE { ?s ?p ?o }')
+        self.assertRaises(TypeError, self.wrapper.prepare, 'SELECT * WHERE { ?s ?p ?o }', foo='bar')
+        self.assertRaises(TypeError, self.wrapper.prepare, 123)
+
+    def testBind(self):
+        spec = self.wrapper.prepare('SELECT ?o WHERE { $s <urn:p> ?o FILTER(?o != ?v && ?o != "?v") } # ?v')
+        self.assertEqual('SELECT ?o WHERE { <urn:a> <urn:p> ?o FILTER(?o != "x\\" } ; DROP ALL #\\n" && ?o != "?v") } # ?v',
+                         spec.bind(s=IRI('urn:a'), v='x" } ; DROP ALL #\n').queryString)
+        self.assertEqual(SELECT, spec.bind(s=IRI('urn:a')).queryType)
+        self.assertTrue(getTemplate(spec.queryString) is getTemplate(spec.queryString))  # split once
+
+        for value, term in [(Literal(u'chat', lang='fr'), u'"chat"@fr'), (42, u'42'), (-1.5, u'"-1.5"^^<http://www.w3.org/2001/XMLSchema#double>'),
+                            (True, u'true'), (Decimal('1.50'), u'"1.50"^^<http://www.w3.org/2001/XMLSchema#decimal>'),
+                            (Literal('2018-01-01', datatype='http://www.w3.org/2001/XMLSchema#date'),
+                             u'"2018-01-01"^^<http://www.w3.org/2001/XMLSchema#date>'),
+                            (Value('v', {'type': 'uri', 'value': 'urn:b'}), u'<urn:b>'),
+                            (Value('v', {'type': 'literal', 'value': 'b', 'xml:lang': 'en'}), u'"b"@en')]:
+            self.assertEqual(u'ASK { ?s ?p %s }' % term, self.wrapper.prepare('ASK { ?s ?p ?v }').bind({'v': value}).queryString)
+
+        self.assertRaises(ValueError, spec.bind, s=IRI('urn:a> ?p ?o } . { <urn:b'))
+        self.assertRaises(ValueError, spec.bind, v=Literal('a', lang='en fr'))
+        self.assertRaises(ValueError, spec.bind, v=Value('v', {'type': 'bnode', 'value': 'b0'}))
+        self.assertRaises(TypeError, spec.bind, v=object())
+
+    def testRequestTemplate(self):
+        self.wrapper.setCredentials('user', 'pass')
+        self.wrapper.addParameter('query', 'ignored')
+        self.wrapper.addCustomHttpHeader('accept', 'text/plain')
+        template = self.wrapper._getRequestTemplate(self.wrapper.prepare('SELECT * WHERE { ?s ?p ?o }'))
+        self.assertTrue(template is self.wrapper._getRequestTemplate(self.wrapper.prepare('ASK { ?s ?p ?o }').replace(queryType=SELECT)))
+
+        request = self._get_request(self.wrapper)
+        self.assertEqual('text/plain', request.get_header('Accept'))
+        self.assertTrue(request.get_header('Authorization').startswith('Basic '))
+        self.assertEqual(['SELECT * WHERE{ ?s ?p ?o }'], self._get_parameters_from_request(request)['query'])
+
+        # a change of the settings gets a new template
+        self.wrapper.setReturnFormat(JSON)
+        self.assertFalse(template is self.wrapper._getRequestTemplate(self.wrapper.prepare('SELECT * WHERE { ?s ?p ?o }')))
+        self.assertEqual(['json'], self._get_request_parameters(self.wrapper)['format'])
+        self.assertEqual(1, len(self._get_request_parameters(self.wrapper)['query']))
+
+        # but not a change of the timeouts, eg, for each attempt of a query with a deadline
+        spec = self.wrapper.prepare('SELECT * WHERE { ?s ?p ?o }', serverType=VIRTUOSO, deadline=10)
+        template = self.wrapper._getRequestTemplate(spec)
+        attempt = _victim._boundByDeadline(spec, time.time() + 2.5)
+        self.assertTrue(template is self.wrapper._getRequestTemplate(attempt.replace(endpoint='http://example.org/replica')))
+        self.assertEqual(['10000'], parse_qs(self.wrapper._getRequestEncodedParameters(spec=spec))['timeout'])
+        self.assertEqual(['2500'], parse_qs(self.wrapper._getRequestEncodedParameters(spec=attempt))['timeout'])
+
+    def testExecute(self):
+        self.wrapper.setQuery('SELECT * WHERE { ?s ?p ?o }')
+        spec = self.wrapper.prepare('ASK { ?s ?p ?o }', returnFormat=JSON, method=POST)
+        result = self.wrapper.execute(spec)
+        self.assertEqual(JSON, result.requestedFormat)
+        request = result.response.request
+        self.assertEqual('POST', request.get_method())
+        self.assertEqual(['ASK { ?s ?p ?o }'], self._get_parameters_from_request(request)['query'])
+        self.assertEqual(['json'], self._get_parameters_from_request(request)['format'])
+        self.assertEqual('SELECT * WHERE { ?s ?p ?o }', self.wrapper.queryString)
+
+    def testExecuteConcurrently(self):
+        errors = []
+
+        def run(i):
+            query = 'SELECT * WHERE { ?s ?p %d }' % i
+            spec = self.wrapper.prepare(query, returnFormat=[JSON, XML][i % 2], parameters={'i': [str(i)]})
+            for _ in range(50):
+                request = self.wrapper.execute(spec).response.request
+                parameters = self._get_parameters_from_request(request)
+                if parameters['query'] != [query] or parameters['i'] != [str(i)] or parameters['format'] != [spec.returnFormat]:
+                    errors.append(parameters)
+
+        threads = [threading.Thread(target=run, args=(i,)) for i in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual([], errors)
+
     def testOnlyConneg(self):
         # see issue #82
         query = "prefix whatever: <http://example.org/blah#> ASK { ?s ?p ?o }"
@@ -750,6 +962,1646 @@ WHERE {
             self.assertFalse(returnFormatSetting in request_params, "URL parameter '%s' was sent, and it was not expected (only Content Negotiation)" %returnFormatSetting)
 
 
+class KeepAlive_Test(unittest.TestCase):
+
+    def setUp(self):
+        self.endpoint = LocalEndpoint()
+        _victim.urlopener = urllib2.urlopen
+        urllib2._opener = None
+
+    def tearDown(self):
+        self.endpoint.stop()
+
+    def testReuseConnection(self):
+        sparql = SPARQLWrapper(self.endpoint.url, returnFormat=JSON)
+        sparql.setUseKeepAlive()
+        self.assertIsInstance(sparql.connectionPool, ConnectionPool)
+        for method in [GET, POST, GET]:
+            sparql.setMethod(method)
+            self.assertEqual([], sparql.query().convert()["results"]["bindings"])
+
+        self.assertEqual(3, len(self.endpoint.requests))
+        self.assertEqual(1, self.endpoint.connections)
+        self.assertIsNone(urllib2._opener)
+
+    def testSharedPool(self):
+        pool = ConnectionPool(maxsize=1)
+        for i in range(3):
+            sparql = SPARQLWrapper(self.endpoint.url, returnFormat=JSON)
+            sparql.setUseKeepAlive(pool)
+            self.assertTrue(sparql.connectionPool is pool)
+            for line in sparql.query():
+                pass
+
+        self.assertEqual(3, len(self.endpoint.requests))
+        self.assertEqual(1, self.endpoint.connections)
+
+    def testIdleConnectionEvicted(self):
+        sparql = SPARQLWrapper(self.endpoint.url, returnFormat=JSON)
+        sparql.setUseKeepAlive(ConnectionPool(idleTimeout=0))
+        sparql.queryAndConvert()
+        time.sleep(0.01)
+        sparql.queryAndConvert()
+
+        self.assertEqual(2, self.endpoint.connections)
+
+    def testClosedConnectionDiscarded(self):
+        sparql = SPARQLWrapper(self.endpoint.url, returnFormat=JSON)
+        sparql.setUseKeepAlive()
+        sparql.queryAndConvert()
+        for connections in sparql.connectionPool._idle.values():
+            for connection, _ in connections:
+                connection.sock.close()
+                connection.sock = None
+        sparql.queryAndConvert()
+
+        self.assertEqual(2, self.endpoint.connections)
+        self.assertEqual(2, len(self.endpoint.requests))
+
+    def testHTTPError(self):
+        sparql = SPARQLWrapper(self.endpoint.url.replace("/sparql", "/missing"))
+        sparql.setUseKeepAlive()
+        self.endpoint.respond = lambda *request: (404, {}, b"not found")
+        self.assertRaises(EndPointNotFound, sparql.query)
+
+
+    def testExecuteWrapper2(self):
+        sparql = SPARQLWrapper2(self.endpoint.url)
+        self.assertIsInstance(sparql.execute(sparql.prepare('SELECT * WHERE { ?s ?p ?o }')), Bindings)
+        self.assertIsInstance(sparql.execute(sparql.prepare('ASK { ?s ?p ?o }')), QueryResult)
+
+
+class QueryMany_Test(unittest.TestCase):
+
+    def setUp(self):
+        self.endpoint = LocalEndpoint()
+        self.endpoint.respond = self.respond
+        _victim.urlopener = urllib2.urlopen
+
+    def tearDown(self):
+        self.endpoint.stop()
+
+    def respond(self, command, path, headers, body):
+        query = parse_qs(urlparse(path).query)['query'][0]
+        if query.startswith('ASK'):
+            return 400, {}, b"bad query"
+        time.sleep(0.001 * (int(query.split()[-2]) % 3))
+        body = '{"head": {"vars": ["i"]}, "results": {"bindings": [{"i": {"type": "literal", "value": "%s"}}]}}' % query.split()[-2]
+        return 200, {"Content-Type": "application/sparql-results+json"}, body.encode('ascii')
+
+    def testQueryMany(self):
+        sparql = SPARQLWrapper(self.endpoint.url, returnFormat=JSON)
+        queries = ['SELECT ?i WHERE { ?s ?p %d }' % i for i in range(30)]
+        outcomes = list(sparql.queryMany(queries, max_workers=4, convert=True))
+
+        self.assertEqual(30, len(outcomes))
+        self.assertEqual(list(range(30)), sorted(outcome.index for outcome in outcomes))
+        for outcome in outcomes:
+            self.assertIsInstance(outcome, QueryOutcome)
+            self.assertIsNone(outcome.error)
+            self.assertEqual(queries[outcome.index], outcome.spec.queryString)
+            self.assertEqual(str(outcome.index), outcome.result["results"]["bindings"][0]["i"]["value"])
+        self.assertTrue(self.endpoint.connections <= 4)
+        self.assertIsInstance(sparql.transport, UrllibTransport)  # the pool of the batch is not kept
+        self.assertIsNone(sparql.connectionPool)
+
+    def testOrderedWithErrors(self):
+        sparql = SPARQLWrapper(self.endpoint.url, returnFormat=JSON)
+        queries = ['SELECT ?i WHERE { ?s ?p %d }' % i for i in range(10)]
+        queries[3] = 'ASK { ?s ?p 3 }'
+        outcomes = list(sparql.queryMany(queries, max_workers=3, ordered=True))
+
+        self.assertEqual(list(range(10)), [outcome.index for outcome in outcomes])
+        self.assertIsInstance(outcomes[3].error, QueryBadFormed)
+        self.assertIsNone(outcomes[3].result)
+        self.assertIsInstance(outcomes[4].result, QueryResult)
+        self.assertEqual("4", outcomes[4].result.convert()["results"]["bindings"][0]["i"]["value"])
+
+        # the connections of the batch are closed once the responses are read
+        for outcome in outcomes:
+            if outcome.result is not None and outcome.index != 4:
+                outcome.result.convert()
+        for _ in range(100):
+            if self.endpoint.disconnections == self.endpoint.connections:
+                break
+            time.sleep(0.01)
+        self.assertEqual(self.endpoint.connections, self.endpoint.disconnections)
+
+    def testStartedAtOnce(self):
+        sparql = SPARQLWrapper(self.endpoint.url, returnFormat=JSON)
+        queries = ['SELECT ?i WHERE { ?s ?p %d }' % i for i in range(5)]
+        outcomes = sparql.queryMany(queries, max_workers=2, convert=True)  # not iterated yet
+        for _ in range(100):
+            if len(self.endpoint.requests) == 5:
+                break
+            time.sleep(0.01)
+        self.assertEqual(5, len(self.endpoint.requests))
+        self.assertEqual(5, len(list(outcomes)))
+        self.assertRaises(TypeError, sparql.queryMany, queries + [42])  # prepared at once
+
+    def testStopEarly(self):
+        sparql = SPARQLWrapper(self.endpoint.url, returnFormat=JSON)
+        queries = ['SELECT ?i WHERE { ?s ?p %d }' % i for i in range(100)]
+        for outcome in sparql.queryMany(queries, max_workers=2, convert=True):
+            break
+        time.sleep(0.05)
+        self.assertTrue(len(self.endpoint.requests) < 100)
+
+
+class Compression_Test(unittest.TestCase):
+
+    body = b'{"head": {"vars": ["s"]}, "results": {"bindings": [' + b', '.join([b'{"s": {"type": "uri", "value": "urn:x"}}'] * 2000) + b']}}'
+
+    def setUp(self):
+        self.endpoint = LocalEndpoint()
+        self.endpoint.respond = self.respond
+        self.encoding = 'gzip'
+        _victim.urlopener = urllib2.urlopen
+
+    def tearDown(self):
+        self.endpoint.stop()
+
+    @staticmethod
+    def compress(data, encoding):
+        if encoding == 'gzip':
+            out = BytesIO()
+            f = gzip.GzipFile(fileobj=out, mode='wb')
+            f.write(data)
+            f.close()
+            return out.getvalue()
+        elif encoding == 'deflate':
+            return zlib.compress(data)
+        else:  # raw deflate
+            compressor = zlib.compressobj(9, zlib.DEFLATED, -zlib.MAX_WBITS)
+            return compressor.compress(data) + compressor.flush()
+
+    def respond(self, command, path, headers, body):
+        headers = dict((k.lower(), v) for k, v in headers.items())
+        if 'gzip' not in headers.get('accept-encoding', ''):
+            return 200, {"Content-Type": "application/sparql-results+json"}, self.body
+        return 200, {"Content-Type": "application/sparql-results+json", "Content-Encoding": self.encoding.replace('raw ', '')}, self.compress(self.body, self.encoding)
+
+    def testConvert(self):
+        for encoding in ['gzip', 'deflate', 'raw deflate']:
+            self.encoding = encoding
+            for keepAlive in [False, True]:
+                sparql = SPARQLWrapper(self.endpoint.url, returnFormat=JSON)
+                if keepAlive:
+                    sparql.setUseKeepAlive()
+                result = sparql.query()
+                self.assertIsInstance(result.response, DecompressingResponse)
+                self.assertEqual(2000, len(result.convert()["results"]["bindings"]))
+        headers = dict((k.lower(), v) for k, v in self.endpoint.requests[-1][2].items())
+        self.assertEqual('gzip, deflate', headers.get('accept-encoding'))
+
+    def testIterate(self):
+        sparql = SPARQLWrapper(self.endpoint.url, returnFormat=JSON)
+        self.assertEqual(self.body, b''.join(line for line in sparql.query()))
+
+    def testDisabled(self):
+        sparql = SPARQLWrapper(self.endpoint.url, returnFormat=JSON)
+        sparql.setUseCompression(False)
+        result = sparql.query()
+        self.assertFalse(isinstance(result.response, DecompressingResponse))
+        self.assertEqual(2000, len(result.convert()["results"]["bindings"]))
+        headers = dict((k.lower(), v) for k, v in self.endpoint.requests[-1][2].items())
+        self.assertEqual('identity', headers.get('accept-encoding', 'identity'))  # or as added by httplib
+
+    def testStreaming(self):
+        body = '\n'.join(str(i * 7919 % 100003) for i in range(100000)).encode('ascii')
+        raw = BytesIO(self.compress(body, 'gzip'))
+        response = DecompressingResponse(raw, 'gzip')
+        self.assertEqual(body[:100], response.read(100))
+        self.assertTrue(raw.tell() < len(raw.getvalue()) / 4)
+        line = response.readline()
+        self.assertEqual(body[100:].split(b'\n', 1)[0] + b'\n', line)
+        self.assertEqual(body, body[:100] + line + response.read())
+        self.assertEqual(b'', response.read(10))
+
+
+class Transport_Test(unittest.TestCase):
+
+    results = b'{"head": {"vars": ["s"]}, "results": {"bindings": [{"s": {"type": "uri", "value": "urn:x"}}]}}'
+
+    def setUp(self):
+        self.transport = InMemoryTransport()
+        self.transport.addResponse(b"bad query", code=400, match=lambda request: "ASK" in request.get_full_url())
+        self.transport.addResponse(self.results, headers={"Content-Type": "application/sparql-results+json"}, match="example.org")
+
+    def testDefaultTransport(self):
+        sparql = SPARQLWrapper("http://example.org/sparql")
+        self.assertIsInstance(sparql.transport, UrllibTransport)
+        self.assertIsNone(sparql.connectionPool)
+        sparql.setUseKeepAlive()
+        self.assertIsInstance(sparql.transport, PooledTransport)
+        self.assertTrue(sparql.transport.pool is sparql.connectionPool)
+
+    def testInMemoryTransport(self):
+        sparql = SPARQLWrapper("http://example.org/sparql", returnFormat=JSON)
+        sparql.setTransport(self.transport)
+        result = sparql.query()
+        self.assertEqual(200, result.response.code)
+        self.assertEqual("application/sparql-results+json", result.info()["content-type"])
+        self.assertEqual("urn:x", result.convert()["results"]["bindings"][0]["s"]["value"])
+        self.assertEqual(1, len(self.transport.requests))
+        self.assertTrue("format=json" in self.transport.requests[0].get_full_url())
+
+        sparql.setQuery("ASK { ?s ?p ?o }")
+        self.assertRaises(QueryBadFormed, sparql.query)
+        sparql = SPARQLWrapper("http://example.com/sparql")
+        sparql.setTransport(self.transport)
+        self.assertRaises(urllib2.URLError, sparql.query)
+
+        self.assertRaises(TypeError, sparql.setTransport, urllib2.urlopen)
+
+    def testCustomTransport(self):
+        calls = []
+
+        class RecordingTransport(Transport):
+            def open(self, request, timeout=None, passwordManager=None):
+                calls.append((request.get_method(), timeout, passwordManager))
+                return InMemoryTransport.open(transport, request, timeout, passwordManager)
+
+        transport = self.transport
+        sparql = SPARQLWrapper("http://example.org/sparql", returnFormat=JSON)
+        sparql.setTransport(RecordingTransport())
+        sparql.setTimeout(5)
+        sparql.setCredentials("login", "password")
+        sparql.setHTTPAuth(DIGEST)
+        sparql.setMethod(POST)
+        sparql.queryAndConvert()
+        self.assertEqual("POST", calls[0][0])
+        self.assertEqual(5, calls[0][1])
+        self.assertIsNotNone(calls[0][2])
+
+    def testQueryManyKeepsTransport(self):
+        sparql = SPARQLWrapper("http://example.org/sparql", returnFormat=JSON)
+        sparql.setTransport(self.transport)
+        outcomes = list(sparql.queryMany(['SELECT ?s WHERE { ?s ?p %d }' % i for i in range(10)], convert=True))
+        self.assertTrue(sparql.transport is self.transport)
+        self.assertEqual(10, len(self.transport.requests))
+        self.assertEqual(["urn:x"] * 10, [outcome.result["results"]["bindings"][0]["s"]["value"] for outcome in outcomes])
+
+
+class AutoMethod_Test(unittest.TestCase):
+
+    def setUp(self):
+        _victim._uriTooLongLengths.clear()
+        self.transport = InMemoryTransport()
+        # a server rejecting the URLs longer than 1000 characters
+        self.transport.addResponse(b"too long", code=414, match=lambda request: request.get_method() == "GET" and len(request.get_full_url()) > 1000)
+        self.transport.addResponse(b'{"head": {}, "boolean": true}', headers={"Content-Type": "application/sparql-results+json"})
+        self.sparql = SPARQLWrapper("http://example.org/sparql", returnFormat=JSON)
+        self.sparql.setTransport(self.transport)
+        self.sparql.setMethod(AUTO)
+
+    def tearDown(self):
+        _victim._uriTooLongLengths.clear()
+
+    def query(self, length):
+        self.sparql.setQuery('ASK { ?s ?p "%s" }' % ("x" * length))
+        return self.sparql.queryAndConvert()
+
+    def testShortQueryUsesGet(self):
+        self.assertTrue(self.query(10)["boolean"])
+        request = self.transport.requests[-1]
+        self.assertEqual("GET", request.get_method())
+        self.assertTrue("query=ASK" in request.get_full_url())
+
+    def testLongQueryUsesPost(self):
+        self.sparql.setMaxGetLength(500)
+        self.query(600)
+        request = self.transport.requests[-1]
+        self.assertEqual("POST", request.get_method())
+        self.assertEqual("application/x-www-form-urlencoded", request.get_header("Content-type"))
+        self.assertTrue(b"query=ASK" in request.data)
+
+        self.sparql.setRequestMethod(POSTDIRECTLY)
+        self.query(600)
+        request = self.transport.requests[-1]
+        self.assertEqual("application/sparql-query", request.get_header("Content-type"))
+        self.assertEqual(2, len(self.transport.requests))
+
+    def testURITooLongRemembered(self):
+        self.assertTrue(self.query(1500)["boolean"])
+        self.assertEqual(["GET", "POST"], [request.get_method() for request in self.transport.requests])
+        rejected = len(self.transport.requests[0].get_full_url())
+        self.assertEqual(rejected, _victim._uriTooLongLengths["http://example.org/sparql"])
+
+        # the next long queries go straight to POST, also for other instances
+        sparql = SPARQLWrapper("http://example.org/sparql", returnFormat=JSON)
+        sparql.setTransport(self.transport)
+        sparql.setMethod(AUTO)
+        sparql.setQuery('ASK { ?s ?p "%s" }' % ("x" * 1400))
+        sparql.query()
+        self.assertEqual("POST", self.transport.requests[-1].get_method())
+        self.query(10)
+        self.assertEqual("GET", self.transport.requests[-1].get_method())
+
+    def testURITooLongWithGet(self):
+        self.sparql.setMethod(GET)
+        self.assertRaises(URITooLong, self.query, 1500)
+        self.assertEqual(1, len(self.transport.requests))
+        self.assertFalse(_victim._uriTooLongLengths)
+
+    def testUpdate(self):
+        self.sparql.setQuery('INSERT DATA { <urn:s> <urn:p> "o" }')
+        with warnings.catch_warnings(record=True) as w:
+            self.sparql.query()
+        self.assertEqual([], [str(warning.message) for warning in w])
+        self.assertEqual("POST", self.transport.requests[-1].get_method())
+
+    def testPrepare(self):
+        spec = self.sparql.prepare('ASK { ?s ?p ?o }', maxGetLength=10)
+        self.assertEqual(AUTO, spec.method)
+        self.sparql.execute(spec)
+        self.assertEqual("POST", self.transport.requests[-1].get_method())
+
+
+class Retry_Test(unittest.TestCase):
+
+    results = b'{"head": {}, "boolean": true}'
+
+    def setUp(self):
+        self.transport = InMemoryTransport()
+        self.failures = 2
+        self.transport.addResponse(b"overloaded", code=503, match=lambda request: len(self.transport.requests) <= self.failures)
+        self.transport.addResponse(self.results, headers={"Content-Type": "application/sparql-results+json"})
+        self.sparql = SPARQLWrapper("http://example.org/sparql", returnFormat=JSON)
+        self.sparql.setTransport(self.transport)
+        self.sparql.setQuery('ASK { ?s ?p ?o }')
+
+    def testNoRetryByDefault(self):
+        self.assertIsNone(self.sparql.retryPolicy)
+        self.assertRaises(urllib2.HTTPError, self.sparql.query)
+        self.assertEqual(1, len(self.transport.requests))
+        self.assertRaises(TypeError, self.sparql.setRetryPolicy, 3)
+
+    def testRetry(self):
+        policy = RetryPolicy(maxAttempts=3, backoffFactor=0)
+        self.sparql.setRetryPolicy(policy)
+        self.assertTrue(self.sparql.queryAndConvert()["boolean"])
+        self.assertEqual(3, len(self.transport.requests))
+        self.assertEqual({"retries": 2, "exhausted": 0, "retriesByReason": {503: 2}}, policy.getCounters())
+
+    def testExhausted(self):
+        policy = RetryPolicy(maxAttempts=2, backoffFactor=0)
+        self.sparql.setRetryPolicy(policy)
+        try:
+            self.sparql.query()
+            self.fail("HTTPError expected")
+        except urllib2.HTTPError as e:
+            self.assertEqual(503, e.code)
+        self.assertEqual(2, len(self.transport.requests))
+        self.assertEqual({"retries": 1, "exhausted": 1, "retriesByReason": {503: 1}}, policy.getCounters())
+
+    def testNotRetryableStatus(self):
+        transport = InMemoryTransport()
+        transport.addResponse(b"bad query", code=400)
+        self.sparql.setTransport(transport)
+        self.sparql.setRetryPolicy(RetryPolicy(backoffFactor=0))
+        self.assertRaises(QueryBadFormed, self.sparql.query)
+        self.assertEqual(1, len(transport.requests))
+
+    def testUpdate(self):
+        self.sparql.setQuery('INSERT DATA { <urn:s> <urn:p> "o" }')
+        self.sparql.setMethod(POST)
+        self.sparql.setRetryPolicy(RetryPolicy(backoffFactor=0))
+        self.assertRaises(urllib2.HTTPError, self.sparql.query)
+        self.assertEqual(1, len(self.transport.requests))
+
+        self.sparql.setRetryPolicy(RetryPolicy(backoffFactor=0, retryUpdates=True))
+        self.sparql.query()
+        self.assertEqual(3, len(self.transport.requests))
+
+    def testConnectionError(self):
+        transport = self.transport
+
+        class ResettingTransport(Transport):
+            attempts = 0
+
+            def open(self, request, timeout=None, passwordManager=None):
+                self.attempts += 1
+                if self.attempts == 1:
+                    raise urllib2.URLError("connection reset by peer")
+                return transport.open(request, timeout, passwordManager)
+
+        self.failures = 0
+        policy = RetryPolicy(backoffFactor=0)
+        self.sparql.setTransport(ResettingTransport())
+        self.sparql.setRetryPolicy(policy)
+        self.assertTrue(self.sparql.queryAndConvert()["boolean"])
+        self.assertEqual({"URLError": 1}, policy.getCounters()["retriesByReason"])
+
+    def testRetryAfter(self):
+        policy = RetryPolicy(backoffFactor=0, maxRetryAfter=60)
+
+        def error(retryAfter):
+            return urllib2.HTTPError("http://example.org/sparql", 429, "Too Many Requests", {"Retry-After": retryAfter}, None)
+
+        self.assertEqual(7, policy.getRetryDelay(error("7"), 1))
+        date = time.strftime("%a, %d %b %Y %H:%M:%S GMT", time.gmtime(time.time() + 30))
+        self.assertTrue(25 < policy.getRetryDelay(error(date), 1) <= 30)
+        self.assertIsNone(policy.getRetryDelay(error("3600"), 1))
+        self.assertEqual(0, policy.getRetryDelay(error("invalid"), 1))
+
+    def testBackoff(self):
+        policy = RetryPolicy(backoffFactor=0.5, maxBackoff=3, jitter=0)
+        self.assertEqual([0.5, 1, 2, 3, 3], [policy.getBackoff(attempt) for attempt in range(1, 6)])
+        policy = RetryPolicy(backoffFactor=1, jitter=0.5)
+        for _ in range(20):
+            self.assertTrue(1 <= policy.getBackoff(2) <= 2)
+        self.assertRaises(ValueError, RetryPolicy, maxAttempts=0)
+        self.assertRaises(ValueError, RetryPolicy, jitter=2)
+
+
+class CircuitBreaker_Test(unittest.TestCase):
+
+    endpoint = "http://example.org/breaker"
+
+    def setUp(self):
+        self.transport = InMemoryTransport()
+        self.failing = True
+        self.transport.addResponse(b"overloaded", code=503, match=lambda request: self.failing)
+        self.transport.addResponse(b"bad query", code=400, match=lambda request: "ASK" in request.get_full_url())
+        self.transport.addResponse(b'{"head": {"vars": []}, "results": {"bindings": []}}', headers={"Content-Type": "application/sparql-results+json"})
+        self.breaker = CircuitBreaker(windowSize=4, minimumRequests=4, openDuration=0.05)
+        setCircuitBreaker(self.endpoint, self.breaker)
+
+    def tearDown(self):
+        setCircuitBreaker(self.endpoint, None)
+
+    def wrapper(self):
+        sparql = SPARQLWrapper(self.endpoint, returnFormat=JSON)
+        sparql.setTransport(self.transport)
+        sparql.setUseCircuitBreaker(True)
+        return sparql
+
+    def testOpenAndClose(self):
+        sparql = self.wrapper()
+        for _ in range(4):
+            self.assertRaises(urllib2.HTTPError, sparql.query)
+        self.assertEqual(OPEN, self.breaker.state)
+
+        # shared by the other wrappers of the endpoint, and no request is sent
+        self.assertRaises(CircuitBreakerOpen, self.wrapper().query)
+        self.assertEqual(4, len(self.transport.requests))
+
+        time.sleep(0.06)
+        self.assertEqual(HALF_OPEN, self.breaker.state)
+        self.assertRaises(urllib2.HTTPError, sparql.query)  # failed trial request
+        self.assertEqual(OPEN, self.breaker.state)
+
+        time.sleep(0.06)
+        self.failing = False
+        sparql.query()
+        self.assertEqual(CLOSED, self.breaker.state)
+        self.assertEqual(6, len(self.transport.requests))
+
+    def testClientErrorsAreNotFailures(self):
+        sparql = self.wrapper()
+        sparql.setQuery("ASK { ?s ?p ?o }")
+        self.failing = False
+        for _ in range(6):
+            self.assertRaises(QueryBadFormed, sparql.query)
+        self.assertEqual(CLOSED, self.breaker.state)
+
+    def testErrorRate(self):
+        sparql = self.wrapper()
+        self.failing = False
+        for failing in [False, True, False, False, False, True]:
+            self.failing = failing
+            try:
+                sparql.query()
+            except urllib2.HTTPError:
+                pass
+        self.assertEqual(CLOSED, self.breaker.state)
+        self.failing = True
+        self.assertRaises(urllib2.HTTPError, sparql.query)
+        self.assertEqual(OPEN, self.breaker.state)
+
+    def testSlowCalls(self):
+        breaker = CircuitBreaker(slowCallDuration=1, slowCallRate=0.5, windowSize=4, minimumRequests=4)
+        for latency in [0.1, 2, 0.1]:
+            breaker.record(latency)
+        self.assertEqual(CLOSED, breaker.state)
+        breaker.record(3)
+        self.assertEqual(OPEN, breaker.state)
+        self.assertRaises(CircuitBreakerOpen, breaker.allowRequest)
+        breaker.reset()
+        breaker.allowRequest()
+
+    def testHalfOpenTrials(self):
+        breaker = CircuitBreaker(windowSize=1, minimumRequests=1, openDuration=0, halfOpenRequests=2)
+        breaker.record(0.1, urllib2.URLError("refused"))
+        breaker.allowRequest()
+        breaker.allowRequest()
+        self.assertRaises(CircuitBreakerOpen, breaker.allowRequest)  # only two trial requests at once
+        breaker.record(0.1)
+        self.assertEqual(HALF_OPEN, breaker.state)
+        breaker.record(0.1)
+        self.assertEqual(CLOSED, breaker.state)
+
+    def testDisabled(self):
+        sparql = self.wrapper()
+        sparql.setUseCircuitBreaker(False)
+        for _ in range(6):
+            self.assertRaises(urllib2.HTTPError, sparql.query)
+        self.assertEqual(CLOSED, self.breaker.state)
+        self.assertTrue(getCircuitBreaker(self.endpoint) is self.breaker)
+
+
+class ReplicaSet_Test(unittest.TestCase):
+
+    replicas = ["http://replica%d.example.org/sparql" % i for i in range(3)]
+
+    def setUp(self):
+        self.transport = InMemoryTransport()
+        self.down = set()
+        self.transport.addResponse(b"unavailable", code=503, match=lambda request: urlparse(request.get_full_url()).netloc in self.down)
+        self.transport.addResponse(b'{"head": {}, "boolean": true}', headers={"Content-Type": "application/sparql-results+json"})
+
+    def wrapper(self, endpoint, **kwargs):
+        sparql = SPARQLWrapper(endpoint, returnFormat=JSON, **kwargs)
+        sparql.setTransport(self.transport)
+        sparql.setQuery("ASK { ?s ?p ?o }")
+        return sparql
+
+    def hosts(self):
+        return [urlparse(request.get_full_url()).netloc for request in self.transport.requests]
+
+    def testRoundRobin(self):
+        sparql = self.wrapper(self.replicas)
+        self.assertIsInstance(sparql.replicaSet, ReplicaSet)
+        self.assertEqual(self.replicas[0], sparql.endpoint)
+        for _ in range(6):
+            sparql.query()
+        self.assertEqual(["replica0.example.org", "replica1.example.org", "replica2.example.org"] * 2, self.hosts())
+        self.assertEqual([0, 0, 0], [replica.outstanding for replica in sparql.replicaSet.replicas])
+
+    def testUpdatesGoToUpdateEndpoint(self):
+        sparql = self.wrapper(self.replicas, updateEndpoint="http://primary.example.org/sparql")
+        sparql.setQuery('INSERT DATA { <urn:s> <urn:p> "o" }')
+        sparql.setMethod(POST)
+        for _ in range(3):
+            sparql.query()
+        self.assertEqual(["primary.example.org"] * 3, self.hosts())
+        self.assertEqual(self.replicas[0], self.wrapper(self.replicas).updateEndpoint)
+
+    def testEjectionAndProbe(self):
+        replicaSet = ReplicaSet(self.replicas[:2], maxFailures=2, ejectionDuration=0.05)
+        sparql = self.wrapper(replicaSet)
+        self.down.add("replica1.example.org")
+        for _ in range(4):
+            try:
+                sparql.query()
+            except urllib2.HTTPError:
+                pass
+        self.assertIsNotNone(replicaSet.replicas[1].ejectedUntil)
+        del self.transport.requests[:]
+        for _ in range(3):
+            sparql.query()
+        self.assertEqual(["replica0.example.org"] * 3, self.hosts())
+
+        # the ejection is over: a probe puts the replica back
+        time.sleep(0.06)
+        self.down.clear()
+        sparql.query()
+        self.assertEqual("replica1.example.org", self.hosts()[-1])
+        self.assertIsNone(replicaSet.replicas[1].ejectedUntil)
+
+    def testRetryOnAnotherReplica(self):
+        sparql = self.wrapper(self.replicas)
+        sparql.setRetryPolicy(RetryPolicy(backoffFactor=0))
+        self.down.add("replica0.example.org")
+        self.assertTrue(sparql.queryAndConvert()["boolean"])
+        self.assertEqual(2, len(self.hosts()))
+        self.assertEqual("replica0.example.org", self.hosts()[0])
+        self.assertNotEqual("replica0.example.org", self.hosts()[1])
+
+    def testPolicies(self):
+        replicaSet = ReplicaSet(self.replicas, policy=LeastOutstandingPolicy())
+        first = replicaSet.acquire()
+        second = replicaSet.acquire()
+        self.assertNotEqual(first, second)
+        replicaSet.release(first, 0.1)
+        replicaSet.release(second, 0.1)
+
+        replicaSet = ReplicaSet(self.replicas, policy=EWMAPolicy(), decay=0.5)
+        for replica, latency in zip(replicaSet.replicas, [0.3, 0.1, 0.15]):
+            replicaSet.release(replicaSet.acquire(), latency)
+        self.assertEqual([0.3, 0.1, 0.15], [replica.latency for replica in replicaSet.replicas])
+        self.assertEqual(replicaSet.replicas[1], replicaSet.acquire())
+        # in flight requests raise the expected latency
+        self.assertEqual(replicaSet.replicas[2], replicaSet.acquire())
+        replicaSet.release(replicaSet.replicas[1], 0.5)
+        self.assertEqual(0.3, replicaSet.replicas[1].latency)
+
+        self.assertRaises(ValueError, ReplicaSet, [])
+
+
+class Hedging_Test(unittest.TestCase):
+
+    replicas = ["http://replica%d.example.org/sparql" % i for i in range(2)]
+
+    def setUp(self):
+        self.delays = {"replica0.example.org": 0.3}
+        self.responses = []
+        test = self
+
+        class SlowTransport(InMemoryTransport):
+            def open(self, request, timeout=None, passwordManager=None):
+                time.sleep(test.delays.get(urlparse(request.get_full_url()).netloc, 0))
+                response = InMemoryTransport.open(self, request, timeout, passwordManager)
+                test.responses.append(response)
+                return response
+
+        self.transport = SlowTransport()
+        self.transport.addResponse(b'{"head": {}, "boolean": true}', headers={"Content-Type": "application/sparql-results+json"})
+
+    def wrapper(self, policy):
+        sparql = SPARQLWrapper(self.replicas, returnFormat=JSON)
+        sparql.setTransport(self.transport)
+        sparql.setQuery("ASK { ?s ?p ?o }")
+        sparql.setHedgingPolicy(policy)
+        return sparql
+
+    def testHedge(self):
+        policy = HedgingPolicy(delay=0.05, budget=1)
+        sparql = self.wrapper(policy)
+        start = time.time()
+        result = sparql.query()
+        self.assertTrue(time.time() - start < 0.25)
+        self.assertEqual("http://replica1.example.org/sparql?", result.geturl()[:35])
+        self.assertTrue(result.convert()["boolean"])
+        counters = policy.getCounters()
+        self.assertEqual(1, counters["hedges"])
+        self.assertEqual(1, counters["hedgeWins"])
+
+        # the slow response is dismissed once received
+        time.sleep(0.35)
+        self.assertEqual(2, len(self.responses))
+        self.assertTrue(self.responses[-1].closed)
+        self.assertFalse(self.responses[0].closed)
+
+        # a fast query is not hedged
+        self.delays = {}
+        sparql.query()
+        self.assertEqual(1, policy.getCounters()["hedges"])
+        self.assertEqual(3, len(self.transport.requests))
+
+    def testLoserAborted(self):
+        endpoint = LocalEndpoint()
+        stalled = threading.Event()
+
+        def respond(command, path, headers, body):
+            if len(endpoint.requests) == 1:
+                stalled.wait(5)  # the first request stalls
+            return 200, {"Content-Type": "application/sparql-results+json"}, b'{"head": {}, "boolean": true}'
+
+        endpoint.respond = respond
+        try:
+            sparql = SPARQLWrapper(endpoint.url, returnFormat=JSON)
+            sparql.setUseKeepAlive()
+            sparql.setQuery("ASK { ?s ?p ?o }")
+            sparql.setHedgingPolicy(HedgingPolicy(delay=0.05, budget=1))
+            start = time.time()
+            self.assertTrue(sparql.queryAndConvert()["boolean"])
+            # the stalled request is aborted at once: its connection is not in use anymore
+            while sparql.connectionPool._inUse.get(("http", urlparse(endpoint.url).netloc)) and time.time() - start < 2:
+                time.sleep(0.01)
+            self.assertTrue(time.time() - start < 1)
+            self.assertEqual({}, sparql.connectionPool._sending)
+        finally:
+            stalled.set()
+            endpoint.stop()
+
+    def testBudget(self):
+        policy = HedgingPolicy(delay=0.05, budget=0)
+        sparql = self.wrapper(policy)
+        self.assertTrue(sparql.queryAndConvert()["boolean"])
+        self.assertEqual(1, len(self.transport.requests))
+        self.assertEqual({"requests": 1, "hedges": 0, "hedgeWins": 0, "hedgesDenied": 1, "learnedDelay": None}, policy.getCounters())
+
+    def testUpdatesNotHedged(self):
+        policy = HedgingPolicy(delay=0.05, budget=1)
+        sparql = self.wrapper(policy)
+        sparql.setQuery('INSERT DATA { <urn:s> <urn:p> "o" }')
+        sparql.setMethod(POST)
+        sparql.query()
+        self.assertEqual(0, policy.getCounters()["requests"])
+
+    def testLearnedDelay(self):
+        policy = HedgingPolicy(percentile=90, minSamples=10)
+        for latency in range(1, 10):
+            policy.record(latency / 10.0)
+        self.assertIsNone(policy.startRequest())
+        policy.record(1.0)
+        self.assertEqual(0.9, policy.startRequest())
+        self.assertEqual(0.9, policy.getCounters()["learnedDelay"])
+        self.assertRaises(TypeError, SPARQLWrapper(self.replicas).setHedgingPolicy, 0.1)
+        self.assertRaises(ValueError, HedgingPolicy, percentile=101)
+
+
+class Deadline_Test(unittest.TestCase):
+
+    def setUp(self):
+        self.options = []
+        test = self
+
+        class RecordingTransport(InMemoryTransport):
+            def open(self, request, timeout=None, passwordManager=None, connectTimeout=None):
+                test.options.append((timeout, connectTimeout))
+                return InMemoryTransport.open(self, request, timeout, passwordManager)
+
+        self.transport = RecordingTransport()
+        self.sparql = SPARQLWrapper("http://example.org/sparql", returnFormat=JSON)
+        self.sparql.setTransport(self.transport)
+        self.sparql.setQuery("ASK { ?s ?p ?o }")
+
+    def testServerTimeoutParameter(self):
+        self.sparql.setServerType(BLAZEGRAPH)
+        self.sparql.setDeadline(2.5)
+        self.assertEqual(["2500"], parse_qs(self.sparql._getRequestEncodedParameters())["maxQueryTimeMillis"])
+
+        self.sparql.setServerType(VIRTUOSO)
+        self.sparql.setDeadline(10)
+        self.assertEqual(["10000"], parse_qs(self.sparql._getRequestEncodedParameters())["timeout"])
+
+        # the timeout of the socket operations is not a limit of the time the query runs on the server
+        self.sparql.setDeadline(None)
+        self.sparql.setTimeout(10)
+        self.assertNotIn("timeout", parse_qs(self.sparql._getRequestEncodedParameters()))
+
+        self.sparql.addParameter("timeout", "500")  # an explicit value is kept
+        self.assertEqual(["500"], parse_qs(self.sparql._getRequestEncodedParameters())["timeout"])
+
+        self.sparql.setServerType(None)
+        self.assertNotIn("maxQueryTimeMillis", self.sparql._getRequestEncodedParameters())
+        self.assertRaises(ValueError, self.sparql.setServerType, "fuseki")
+        self.assertRaises(ValueError, self.sparql.prepare, "ASK {}", serverType="fuseki")
+
+    def testTimeoutsBoundByDeadline(self):
+        self.transport.addResponse(b'{"head": {}, "boolean": true}', headers={"Content-Type": "application/sparql-results+json"})
+        self.sparql.setTimeout(30)
+        self.sparql.setConnectTimeout(2)
+        self.sparql.query()
+        self.assertEqual([(30, 2.0)], self.options)
+
+        self.sparql.setDeadline(1)
+        self.sparql.setServerType(BLAZEGRAPH)
+        self.assertTrue(self.sparql.queryAndConvert()["boolean"])
+        timeout, connectTimeout = self.options[-1]
+        self.assertTrue(0 < timeout <= 1 and 0 < connectTimeout <= 1)
+        url = self.transport.requests[-1].get_full_url()
+        self.assertTrue(0 < int(parse_qs(urlparse(url).query)["maxQueryTimeMillis"][0]) <= 1000)
+
+    def testDeadlineWhileReading(self):
+        class SlowResponse(BufferedResponse):
+            def read(self, amt=-1):
+                time.sleep(0.1)
+                return BufferedResponse.read(self, amt)
+
+        responses = []
+
+        class SlowTransport(InMemoryTransport):
+            def open(self, request, timeout=None, passwordManager=None):
+                body = b'{"head": {}, "boolean": true, "padding": "' + b"x" * 100000 + b'"}'
+                responses.append(SlowResponse(body, {"Content-Type": "application/sparql-results+json"}, request.get_full_url()))
+                return responses[-1]
+
+        self.sparql.setTransport(SlowTransport())
+        self.assertTrue(self.sparql.queryAndConvert()["boolean"])  # no deadline
+
+        self.sparql.setDeadline(0.25)
+        result = self.sparql.query()
+        self.assertRaises(DeadlineExceeded, result.convert)
+        self.assertTrue(responses[-1].closed)
+
+    def testDeadlineExceededByTimeout(self):
+        def timeout(request):
+            time.sleep(0.2)
+            raise urllib2.URLError(socket.timeout("timed out"))
+
+        self.transport.addResponse(b"", match=timeout)
+        self.sparql.setDeadline(0.1)
+        self.assertRaises(DeadlineExceeded, self.sparql.query)
+
+        # without a deadline, the timeout is raised as is
+        self.sparql.setDeadline(None)
+        self.assertRaises(urllib2.URLError, self.sparql.query)
+
+    def testNoRetryPastDeadline(self):
+        self.transport.addResponse(b"busy", code=503, headers={"Retry-After": "1"})
+        self.sparql.setRetryPolicy(RetryPolicy(maxAttempts=3))
+        self.sparql.setDeadline(0.5)
+        start = time.time()
+        try:
+            self.sparql.query()
+            self.fail("the request should fail")
+        except HTTPError as e:
+            self.assertEqual(503, e.code)
+        self.assertTrue(time.time() - start < 0.5)
+        self.assertEqual(1, len(self.transport.requests))
+
+    def testPooledConnectTimeout(self):
+        endpoint = LocalEndpoint()
+        try:
+            sparql = SPARQLWrapper(endpoint.url, returnFormat=JSON)
+            sparql.setUseKeepAlive()
+            sparql.setTimeout(5)
+            sparql.setConnectTimeout(1)
+            sparql.queryAndConvert()
+            for connections in sparql.connectionPool._idle.values():
+                for connection, _ in connections:
+                    self.assertEqual(5, connection.sock.gettimeout())
+        finally:
+            endpoint.stop()
+
+
+class Cancellation_Test(unittest.TestCase):
+
+    def setUp(self):
+        self.responses = []
+        self.delay = 0
+        test = self
+
+        class SlowTransport(InMemoryTransport):
+            def open(self, request, timeout=None, passwordManager=None):
+                if "cancelQuery" not in request.get_full_url():
+                    time.sleep(test.delay)
+                response = InMemoryTransport.open(self, request, timeout, passwordManager)
+                test.responses.append(response)
+                return response
+
+        self.transport = SlowTransport()
+        self.transport.addResponse(b'{"head": {}, "boolean": true}', headers={"Content-Type": "application/sparql-results+json"})
+        self.token = CancellationToken()
+        self.sparql = SPARQLWrapper("http://example.org/sparql", returnFormat=JSON)
+        self.sparql.setTransport(self.transport)
+        self.sparql.setQuery("ASK { ?s ?p ?o }")
+        self.sparql.setCancellationToken(self.token)
+
+    def cancelLater(self, delay, cancel=None):
+        timer = threading.Timer(delay, cancel or self.token.cancel)
+        timer.daemon = True
+        timer.start()
+
+    def testCancelWhileSending(self):
+        self.delay = 0.4
+        self.cancelLater(0.05)
+        start = time.time()
+        self.assertRaises(QueryCancelled, self.sparql.query)
+        self.assertTrue(time.time() - start < 0.3)
+
+        # the response of the abandoned request is closed once received
+        time.sleep(0.5)
+        self.assertEqual(1, len(self.responses))
+        self.assertTrue(self.responses[0].closed)
+
+        # a cancelled token cancels the next queries at once
+        self.assertRaises(QueryCancelled, self.sparql.query)
+        self.assertEqual(1, len(self.transport.requests))
+
+    def testCancelWhileReading(self):
+        class SlowResponse(BufferedResponse):
+            def read(self, amt=-1):
+                time.sleep(0.05)
+                return BufferedResponse.read(self, amt)
+
+        responses = []
+
+        class SlowTransport(InMemoryTransport):
+            def open(self, request, timeout=None, passwordManager=None):
+                body = b'{"head": {}, "boolean": true, "padding": "' + b"x" * 200000 + b'"}'
+                responses.append(SlowResponse(body, {"Content-Type": "application/sparql-results+json"}, request.get_full_url()))
+                return responses[-1]
+
+        self.sparql.setTransport(SlowTransport())
+        self.assertTrue(self.sparql.queryAndConvert()["boolean"])
+
+        result = self.sparql.query()
+        self.cancelLater(0.1)
+        self.assertRaises(QueryCancelled, result.convert)
+        self.assertTrue(responses[-1].closed)
+
+    def testQueryResultCancel(self):
+        result = self.sparql.query()
+        result.cancel()
+        self.assertTrue(self.token.cancelled)
+        self.assertTrue(self.responses[-1].closed)
+        self.assertRaises(QueryCancelled, result.convert)
+
+        self.sparql.setCancellationToken(None)
+        result = self.sparql.query()
+        result.cancel()
+        self.assertTrue(self.responses[-1].closed)
+        self.assertRaises(TypeError, self.sparql.setCancellationToken, "token")
+
+    def testServerCancel(self):
+        self.sparql.setServerType(BLAZEGRAPH)
+        result = self.sparql.query()
+        queryId = parse_qs(urlparse(self.transport.requests[0].get_full_url()).query)["queryId"][0]
+
+        self.token.cancel()
+        for _ in range(50):
+            if len(self.transport.requests) > 1:
+                break
+            time.sleep(0.01)
+        request = self.transport.requests[1]
+        self.assertEqual("POST", request.get_method())
+        self.assertEqual("http://example.org/sparql?cancelQuery&queryId=%s" % queryId, request.get_full_url())
+        self.assertTrue(self.responses[0].closed)
+
+        # no query id without a server supporting the cancellation
+        self.sparql.setServerType(VIRTUOSO)
+        self.sparql.setCancellationToken(CancellationToken())
+        self.sparql.query()
+        self.assertNotIn("queryId", self.transport.requests[-1].get_full_url())
+
+    def testServerQueryIdNotTemplated(self):
+        # each query gets its own id, but the queries share the same request template
+        self.sparql.setServerType(BLAZEGRAPH)
+        for _ in range(5):
+            self.sparql.query().response.close()
+        queryIds = set(parse_qs(urlparse(request.get_full_url()).query)["queryId"][0] for request in self.transport.requests)
+        self.assertEqual(5, len(queryIds))
+        self.assertEqual(1, len(self.sparql._requestTemplates))
+
+    def testCallbacksUnregistered(self):
+        # a token reused by many queries does not keep the callbacks of the responses read but never closed
+        self.sparql.setServerType(BLAZEGRAPH)
+        for _ in range(5):
+            response = self.sparql.query().response
+            self.assertEqual(2, len(self.token._callbacks))
+            response.read()
+        self.assertEqual({}, self.token._callbacks)
+
+        for _ in range(5):
+            response = self.sparql.query().response
+            while response.readline():
+                pass
+        self.assertEqual({}, self.token._callbacks)
+
+        # nor those of the failing responses
+        response = self.sparql.query().response
+        response._response.read = lambda amt=None: (_ for _ in ()).throw(IOError("connection reset"))
+        self.assertRaises(IOError, response.read)
+        self.assertEqual({}, self.token._callbacks)
+        self.assertFalse(self.token.cancelled)
+
+    def testCancelPooledRequest(self):
+        threaded = []
+        callCancellable = _victim.callCancellable
+        _victim.callCancellable = lambda *args: (threaded.append(args), callCancellable(*args))[1]
+        endpoint = LocalEndpoint()
+        endpoint.respond = lambda *request: (time.sleep(0.5), (200, {"Content-Type": "application/sparql-results+json"}, endpoint.body))[1]
+        try:
+            sparql = SPARQLWrapper(endpoint.url, returnFormat=JSON)
+            sparql.setUseKeepAlive()
+            sparql.setCancellationToken(self.token)
+            self.cancelLater(0.05)
+            start = time.time()
+            self.assertRaises(QueryCancelled, sparql.query)
+            self.assertTrue(time.time() - start < 0.4)
+            self.assertEqual([], threaded)  # aborted by the pool, not abandoned in another thread
+
+            # waiting for a free connection of the pool
+            endpoint.respond = LocalEndpoint.respond.__get__(endpoint)
+            pool = ConnectionPool(maxsize=1, block=True)
+            busy = pool.urlopen(Request(endpoint.url))  # its connection is in use until it is read
+            token = CancellationToken()
+            sparql.setUseKeepAlive(pool)
+            sparql.setCancellationToken(token)
+            self.cancelLater(0.05, token.cancel)
+            start = time.time()
+            self.assertRaises(QueryCancelled, sparql.query)
+            self.assertTrue(time.time() - start < 0.4)
+            busy.read()
+            self.assertEqual([], threaded)
+
+            self.sparql.setCancellationToken(CancellationToken())
+            self.sparql.query()  # a transport which can not abort its requests
+            self.assertEqual(1, len(threaded))
+        finally:
+            _victim.callCancellable = callCancellable
+            endpoint.stop()
+
+
+class Limiter_Test(unittest.TestCase):
+
+    endpoint = "http://example.org/limited"
+
+    def setUp(self):
+        self.transport = InMemoryTransport()
+        self.failing = False
+        self.transport.addResponse(b"overloaded", code=503, match=lambda request: self.failing)
+        self.transport.addResponse(b'{"head": {"vars": []}, "results": {"bindings": []}}', headers={"Content-Type": "application/sparql-results+json"})
+
+    def tearDown(self):
+        setLimiter(self.endpoint, None)
+
+    def wrapper(self):
+        sparql = SPARQLWrapper(self.endpoint, returnFormat=JSON)
+        sparql.setTransport(self.transport)
+        return sparql
+
+    def testConcurrency(self):
+        limiter = EndpointLimiter(maxConcurrency=2)
+        setLimiter(self.endpoint, limiter)
+        inFlight = []
+        seen = []
+        transport = self.transport
+
+        class SlowTransport(Transport):
+            def open(self, request, timeout=None, passwordManager=None):
+                inFlight.append(request)
+                seen.append(len(inFlight))
+                time.sleep(0.05)
+                inFlight.remove(request)
+                return transport.open(request, timeout, passwordManager)
+
+        def run():
+            sparql = self.wrapper()
+            sparql.setTransport(SlowTransport())
+            sparql.query()
+
+        threads = [threading.Thread(target=run) for _ in range(5)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(2, max(seen))
+        counters = limiter.getCounters()
+        self.assertEqual(5, counters["acquired"])
+        self.assertEqual(0, counters["inFlight"])
+        self.assertTrue(counters["maxWaitTime"] >= 0.05)
+        self.assertTrue(counters["waitTime"] >= counters["maxWaitTime"])
+
+    def testRate(self):
+        setLimiter(self.endpoint, EndpointLimiter(rate=20, burst=1))
+        sparql = self.wrapper()
+        start = time.time()
+        for _ in range(3):
+            sparql.query()
+        self.assertTrue(time.time() - start >= 0.09)
+
+    def testNonBlocking(self):
+        limiter = EndpointLimiter(maxConcurrency=1, blocking=False)
+        setLimiter(self.endpoint, limiter)
+        limiter.acquire()  # a request in flight
+        self.assertRaises(LimitExceeded, self.wrapper().query)
+        self.assertEqual(0, len(self.transport.requests))
+        self.assertEqual(1, limiter.getCounters()["rejected"])
+        limiter.release()
+        self.wrapper().query()
+        self.assertEqual(1, len(self.transport.requests))
+
+    def testMaxWait(self):
+        limiter = EndpointLimiter(maxConcurrency=1, maxWait=0.05)
+        setLimiter(self.endpoint, limiter)
+        limiter.acquire()
+        threading.Timer(0.02, limiter.release).start()
+        self.wrapper().query()  # waits for the release
+        limiter.acquire()
+        start = time.time()
+        self.assertRaises(LimitExceeded, self.wrapper().query)
+        self.assertTrue(0.04 <= time.time() - start < 1)
+        self.assertEqual(1, limiter.getCounters()["rejected"])
+
+    def testCancelWhileWaiting(self):
+        limiter = EndpointLimiter(maxConcurrency=1)
+        limiter.acquire()
+        token = CancellationToken()
+        threading.Timer(0.05, token.cancel).start()
+        start = time.time()
+        self.assertRaises(QueryCancelled, limiter.acquire, cancellationToken=token)
+        self.assertTrue(time.time() - start < 0.5)
+        self.assertEqual(1, limiter.getCounters()["inFlight"])
+        limiter.release()
+        token = CancellationToken()
+        limiter.acquire(cancellationToken=token)
+        self.assertEqual({}, token._callbacks)
+
+    def testBlockedWithoutSpinning(self):
+        limiter = EndpointLimiter(maxConcurrency=1)
+        limiter.acquire()
+        threading.Timer(0.5, limiter.release).start()
+        start = os.times()
+        self.assertTrue(limiter.acquire() >= 0.4)  # sleeps until the release
+        cpu = sum(os.times()[:2]) - sum(start[:2])
+        self.assertTrue(cpu < 0.2, "%.2fs of CPU time while blocked" % cpu)
+
+    def testAdaptive(self):
+        limiter = EndpointLimiter(maxConcurrency=8, adaptive=True)
+        setLimiter(self.endpoint, limiter)
+        sparql = self.wrapper()
+        self.failing = True
+        for _ in range(2):
+            self.assertRaises(urllib2.HTTPError, sparql.query)
+        self.assertEqual(2, limiter.concurrencyLimit)
+        self.failing = False
+        for _ in range(6):  # about one more per round of successful requests
+            sparql.query()
+        self.assertEqual(4, limiter.concurrencyLimit)
+        self.assertRaises(ValueError, EndpointLimiter, adaptive=True)
+
+
+class Coalescing_Test(unittest.TestCase):
+
+    def setUp(self):
+        self.transport = InMemoryTransport()
+        self.transport.addResponse(b"bad query", code=400, match=lambda request: "ASK" in request.get_full_url())
+        self.transport.addResponse(b'{"head": {"vars": ["s"]}, "results": {"bindings": []}}', headers={"Content-Type": "application/sparql-results+json"})
+        self.group = CoalescingGroup()
+        self.delay = 0.1
+        transport = self.transport
+        test = self
+
+        class SlowTransport(Transport):
+            def open(self, request, timeout=None, passwordManager=None):
+                time.sleep(test.delay)
+                return transport.open(request, timeout, passwordManager)
+
+        self.slowTransport = SlowTransport()
+
+    def wrapper(self, returnFormat=JSON, query=None):
+        sparql = SPARQLWrapper("http://example.org/coalesced", returnFormat=returnFormat)
+        sparql.setTransport(self.slowTransport)
+        sparql.setCoalescingGroup(self.group)
+        if query is not None:
+            sparql.setQuery(query)
+        return sparql
+
+    def run_concurrently(self, wrappers):
+        outcomes = [None] * len(wrappers)
+
+        def run(index):
+            try:
+                outcomes[index] = wrappers[index].query()
+            except Exception as e:
+                outcomes[index] = e
+
+        threads = [threading.Thread(target=run, args=(i,)) for i in range(len(wrappers))]
+        for thread in threads:
+            thread.start()
+            time.sleep(0.005)
+        for thread in threads:
+            thread.join()
+        return outcomes
+
+    def testCoalesce(self):
+        results = self.run_concurrently([self.wrapper() for _ in range(5)])
+        self.assertEqual(1, len(self.transport.requests))
+        self.assertEqual({"requests": 1, "coalesced": 4}, self.group.getCounters())
+        for result in results:  # each result is read independently
+            self.assertEqual(["s"], result.convert()["head"]["vars"])
+
+        self.run_concurrently([self.wrapper(), self.wrapper(XML), self.wrapper()])
+        self.assertEqual(3, len(self.transport.requests))
+        self.assertRaises(TypeError, self.wrapper().setCoalescingGroup, object())
+
+    def testSharedError(self):
+        outcomes = self.run_concurrently([self.wrapper(query="ASK { ?s ?p ?o }") for _ in range(3)])
+        self.assertEqual(1, len(self.transport.requests))
+        for outcome in outcomes:
+            self.assertIsInstance(outcome, QueryBadFormed)
+
+    def testCancelledLeader(self):
+        token = CancellationToken()
+        leader = self.wrapper()
+        leader.setCancellationToken(token)
+        threading.Timer(0.05, token.cancel).start()
+        outcomes = self.run_concurrently([leader, self.wrapper()])
+        self.assertIsInstance(outcomes[0], QueryCancelled)
+        self.assertEqual(["s"], outcomes[1].convert()["head"]["vars"])  # sent again
+        self.assertEqual(2, len(self.transport.requests))
+
+
+def _fillDiskCache(path, process):
+    cache = DiskCache(path, maxBytes=10 ** 7)
+    for i in range(20):
+        cache.set("%d-%d" % (process, i), CacheEntry(b"body", {}, "", 200, JSON, 0, time.time() + 60))
+
+
+class Cache_Test(unittest.TestCase):
+
+    def setUp(self):
+        self.transport = InMemoryTransport()
+        self.transport.addResponse(b"", match=lambda request: request.data is not None)  # updates
+        self.transport.addResponse(b'{"head": {"vars": ["s"]}, "results": {"bindings": []}}', headers={"Content-Type": "application/sparql-results+json"})
+        self.cache = MemoryCache(ttl=60)
+
+    def wrapper(self, returnFormat=JSON):
+        sparql = SPARQLWrapper("http://example.org/cached", returnFormat=returnFormat)
+        sparql.setTransport(self.transport)
+        sparql.setCache(self.cache)
+        return sparql
+
+    def testHit(self):
+        sparql = self.wrapper()
+        self.assertEqual(["s"], sparql.query().convert()["head"]["vars"])
+        result = self.wrapper().query()  # shared by the wrappers
+        self.assertEqual(["s"], result.convert()["head"]["vars"])
+        self.assertEqual("application/sparql-results+json", result.info()["content-type"])
+        self.assertEqual(1, len(self.transport.requests))
+
+        self.wrapper(XML).query()  # another Accept header
+        sparql.setQuery("SELECT ?o WHERE { ?s ?p ?o }")
+        sparql.query()
+        self.assertEqual(3, len(self.transport.requests))
+        counters = self.cache.getCounters()
+        self.assertEqual(1, counters["hits"])
+        self.assertEqual(3, counters["misses"])
+        self.assertEqual(3, counters["entries"])
+        self.assertRaises(TypeError, sparql.setCache, {})
+
+    def testExpiration(self):
+        self.cache.ttl = 0.05
+        sparql = self.wrapper()
+        sparql.query()
+        sparql.query()
+        time.sleep(0.06)
+        sparql.query()
+        self.assertEqual(2, len(self.transport.requests))
+
+    def testEviction(self):
+        entry = CacheEntry(b"x" * 100, {}, "", 200, JSON, 0, time.time() + 60)
+        cache = MemoryCache(maxBytes=250)
+        cache.set("a", entry)
+        cache.set("b", entry)
+        cache.get("a")
+        cache.set("c", entry)  # evicts the least recently used entry
+        self.assertEqual(None, cache.get("b"))
+        self.assertNotEqual(None, cache.get("a"))
+        cache.set("d", CacheEntry(b"x" * 300, {}, "", 200, JSON, 0, time.time() + 60))  # too large
+        counters = cache.getCounters()
+        self.assertEqual(1, counters["evictions"])
+        self.assertEqual(2, counters["entries"])
+        self.assertEqual(200, counters["bytes"])
+        cache.set("a", CacheEntry(b"x" * 300, {}, "", 200, JSON, 0, time.time() + 60))  # the previous one is removed
+        self.assertEqual(None, cache.get("a", allowStale=True))
+        self.assertEqual(100, cache.getCounters()["bytes"])
+
+    def testHttpHeaders(self):
+        self.assertEqual(None, getFreshnessLifetime({"Cache-Control": "no-store"}, 60))
+        self.assertEqual(0, getFreshnessLifetime({"cache-control": "no-cache"}, 60))
+        self.assertEqual(10, getFreshnessLifetime({"Cache-Control": "public, max-age=10"}, 60))
+        self.assertEqual(120, getFreshnessLifetime({"Date": "Mon, 01 Jan 2018 00:00:00 GMT",
+                                                    "Expires": "Mon, 01 Jan 2018 00:02:00 GMT"}, 60))
+        self.assertEqual(60, getFreshnessLifetime({}, 60))
+
+        transport = InMemoryTransport()
+        transport.addResponse(b"{}", headers={"Content-Type": "application/json", "Cache-Control": "no-store"})
+        sparql = self.wrapper()
+        sparql.setTransport(transport)
+        sparql.query()
+        sparql.query()
+        self.assertEqual(2, len(transport.requests))
+        self.cache.useHttpHeaders = False
+        sparql.query()
+        sparql.query()
+        self.assertEqual(3, len(transport.requests))
+
+    def testDiskCache(self):
+        directory = tempfile.mkdtemp()
+        try:
+            path = os.path.join(directory, "cache.sqlite")
+            self.cache = DiskCache(path)
+            self.assertEqual(["s"], self.wrapper().query().convert()["head"]["vars"])
+            self.cache = DiskCache(path)  # eg, in another process
+            result = self.wrapper().query()
+            self.assertEqual(["s"], result.convert()["head"]["vars"])
+            self.assertEqual("application/sparql-results+json", result.info()["content-type"])
+            self.assertEqual(1, len(self.transport.requests))
+            self.assertEqual(1, self.cache.getCounters()["hits"])
+
+            body = b"0123456789" * 1000
+            size = len(zlib.compress(body)) + len("{}")  # the body and the headers
+            cache = DiskCache(path, maxBytes=3 * size)
+            cache.clear()
+            for key in ["a", "b", "c"]:
+                cache.set(key, CacheEntry(body, {}, "", 200, JSON, 0, time.time() + 60))
+                time.sleep(0.01)
+            counters = cache.getCounters()
+            self.assertEqual(3, counters["entries"])
+            self.assertEqual(3 * size, counters["bytes"])  # compressed
+            self.assertEqual(body, cache.get("a").body)
+            cache.set("d", CacheEntry(body, {}, "", 200, JSON, 0, time.time() + 60))
+            self.assertEqual(None, cache.get("b"))  # the least recently used entry is evicted
+            self.assertNotEqual(None, cache.get("a"))
+            self.assertEqual(1, cache.getCounters()["evictions"])
+            cache.set("d", CacheEntry(os.urandom(4 * size), {}, "", 200, JSON, 0, time.time() + 60))  # too large
+            self.assertEqual(None, cache.get("d", allowStale=True))  # the previous one is removed
+
+            writer = sqlite3.connect(path, isolation_level=None)  # eg, another process writing
+            writer.execute("BEGIN IMMEDIATE")
+            start = time.time()
+            self.assertEqual(body, cache.get("a").body)  # the reads do not wait for the write lock
+            self.assertTrue(time.time() - start < 1)
+            writer.execute("ROLLBACK")
+            writer.close()
+
+            processes = [multiprocessing.Process(target=_fillDiskCache, args=(path, i)) for i in range(3)]
+            for process in processes:
+                process.start()
+            for process in processes:
+                process.join()
+            self.assertEqual(2 + 3 * 20, DiskCache(path).getCounters()["entries"])
+        finally:
+            shutil.rmtree(directory)
+
+    def testHeaderNames(self):
+        # the names of the headers are case-insensitive, whatever the version of Python lowercases them or not
+        headers = bufferResponse(BufferedResponse(b"", {"Content-Type": "text/plain", "ETag": '"v1"'}, "urn:r"))[1]
+        self.assertEqual("text/plain", headers["content-type"])
+        entry = CacheEntry(b"", {"ETag": '"v1"'}, "urn:r", 200, JSON, time.time(), time.time() + 60)
+        self.assertEqual('"v1"', entry.headers["etag"])
+        self.assertEqual('"v2"', updateHeaders(entry.headers, {"etag": '"v2"'})["ETag"])
+        directory = tempfile.mkdtemp()
+        try:
+            cache = DiskCache(os.path.join(directory, "cache.sqlite"))
+            cache.set("key", entry)
+            self.assertEqual('"v1"', cache.get("key").headers["ETag"])
+        finally:
+            shutil.rmtree(directory)
+
+    def testDigestIdentity(self):
+        # the identity of a request is computed without installing the DIGEST opener of the default transport
+        installed = []
+        install_opener = urllib2.install_opener
+        urllib2.install_opener = installed.append
+        try:
+            sparql = SPARQLWrapper("http://example.org/cached", returnFormat=JSON)
+            sparql.setCredentials("user", "password")
+            sparql.setHTTPAuth(DIGEST)
+            spec = sparql.prepare("SELECT * WHERE { ?s ?p ?o }")
+            identity = sparql._getRequestIdentity(spec)
+            self.assertEqual(identity, sparql._getRequestIdentity(spec))
+            self.assertNotEqual(identity, sparql._getRequestIdentity(spec.replace(passwd="other")))
+            self.assertEqual([], installed)
+            sparql._createRequest(spec)
+            self.assertEqual(1, len(installed))
+        finally:
+            urllib2.install_opener = install_opener
+
+    def testRevalidation(self):
+        endpoint = LocalEndpoint()
+        version = ['"v1"']
+
+        def respond(command, path, headers, body):
+            headers = dict((name.lower(), value) for name, value in headers.items())
+            if headers.get("if-none-match") == version[0]:
+                return 304, {"ETag": version[0], "Cache-Control": "max-age=60"}, b""
+            return 200, {"Content-Type": "application/sparql-results+json", "ETag": version[0],
+                         "Cache-Control": "no-cache"}, endpoint.body
+
+        endpoint.respond = respond
+        try:
+            for keepAlive in [False, True]:
+                self.cache.clear()
+                del endpoint.requests[:]
+                sparql = SPARQLWrapper(endpoint.url, returnFormat=JSON)
+                sparql.setCache(self.cache)
+                if keepAlive:
+                    sparql.setUseKeepAlive()
+                sparql.query().convert()
+                result = sparql.query()  # kept for its validator, and revalidated
+                self.assertEqual([], result.convert()["head"]["vars"])
+                self.assertEqual("max-age=60", result.info()["cache-control"])
+                sparql.query()  # fresh now
+                self.assertEqual(2, len(endpoint.requests))
+                self.assertEqual('"v1"', dict((k.lower(), v) for k, v in endpoint.requests[1][2].items())["if-none-match"])
+
+            version[0] = '"v2"'
+            key = list(self.cache._entries)[0]
+            self.cache.set(key, self.cache.get(key)._replace(expires=0))
+            sparql.query()  # modified, so downloaded again
+            self.assertEqual(3, len(endpoint.requests))
+            headers = self.cache.get(key, allowStale=True).headers
+            self.assertEqual(['"v2"'] * 2, [headers["ETag"], headers["etag"]])  # whatever the case of the names
+            self.assertEqual(2, self.cache.getCounters()["revalidations"])
+        finally:
+            endpoint.stop()
+
+    def testUpdatedGraphs(self):
+        self.assertEqual(set(["urn:g"]), getUpdatedGraphs("INSERT DATA { GRAPH <urn:g> { <urn:a> <urn:b> 'GRAPH <urn:x>' } }"))
+        self.assertEqual(set(["http://example.org/g", "urn:h"]), getUpdatedGraphs("""
+            PREFIX ex: <http://example.org/>
+            # CLEAR ALL
+            WITH ex:g DELETE { ?s ?p ?o } INSERT { GRAPH <urn:h> { ?s ?p 1 } } WHERE { ?s ?p ?o }"""))
+        self.assertEqual(set(), getUpdatedGraphs("DELETE WHERE { ?s ?p ?o }"))  # the default graph
+        self.assertEqual(set(["urn:d"]), getUpdatedGraphs("INSERT DATA { <urn:a> <urn:b> <urn:c> }",
+                                                          (("using-graph-uri", ("urn:d",)),)))
+        self.assertEqual(set(["urn:g"]), getUpdatedGraphs("LOAD SILENT <http://example.org/data> INTO GRAPH <urn:g>") - set(["http://example.org/data"]))
+        self.assertEqual(set(["urn:a", "urn:b"]), getUpdatedGraphs("CLEAR GRAPH <urn:a> ; DROP SILENT GRAPH <urn:b>"))
+        self.assertEqual(set(["urn:a", "urn:b"]), getUpdatedGraphs("MOVE <urn:a> TO GRAPH <urn:b>"))
+        for update in ["CLEAR ALL", "DROP NAMED", "INSERT { GRAPH ?g { ?s ?p ?o } } WHERE { GRAPH ?g { ?s ?p ?o } }", "FOO"]:
+            self.assertEqual(None, getUpdatedGraphs(update))
+
+        self.assertEqual(None, getQueryGraphs("SELECT * WHERE { GRAPH <urn:g> { ?s ?p ?o } }"))
+        self.assertEqual(set(["http://example.org/g", "urn:h", "urn:p"]), getQueryGraphs(
+            "PREFIX ex: <http://example.org/> SELECT * FROM ex:g FROM NAMED <urn:h> WHERE { ?s ?p ?o }",
+            (("default-graph-uri", ("urn:p",)),)))
+
+    def testInvalidation(self):
+        sparql = self.wrapper()
+        queries = ["SELECT * WHERE { ?s ?p ?o }", "SELECT * FROM <urn:a> WHERE { ?s ?p ?o }",
+                   "SELECT * FROM <urn:b> WHERE { ?s ?p ?o }"]
+        for query in queries:
+            sparql.setQuery(query)
+            sparql.query()
+        other = SPARQLWrapper("http://example.org/other", returnFormat=JSON)
+        other.setTransport(self.transport)
+        other.setCache(self.cache)
+        other.query()
+        self.assertEqual(4, self.cache.getCounters()["entries"])
+
+        sparql.setMethod(POST)
+        sparql.setQuery("INSERT DATA { GRAPH <urn:a> { <urn:a> <urn:b> <urn:c> } }")
+        sparql.query()
+        self.assertEqual(2, self.cache.getCounters()["invalidations"])  # the default dataset, and <urn:a>
+        for query, requests in zip(queries, [6, 7, 7]):
+            sparql.setQuery(query)
+            sparql.setMethod(GET)
+            sparql.query()
+            self.assertEqual(requests, len(self.transport.requests))
+
+        sparql.setMethod(POST)
+        sparql.setQuery("CLEAR ALL")
+        sparql.query()
+        self.assertEqual(1, self.cache.getCounters()["entries"])  # the other endpoint
+
+    def testUpdatesBypass(self):
+        sparql = self.wrapper()
+        sparql.setQuery("INSERT DATA { <urn:a> <urn:b> <urn:c> }")
+        sparql.setMethod(POST)
+        sparql.query()
+        sparql.query()
+        self.assertEqual(2, len(self.transport.requests))
+        self.assertEqual(0, self.cache.getCounters()["entries"])
+
+    def slowWrapper(self, delay):
+        transport = self.transport
+
+        class SlowTransport(Transport):
+            def open(self, request, timeout=None, passwordManager=None):
+                time.sleep(delay)
+                return transport.open(request, timeout, passwordManager)
+
+        sparql = self.wrapper()
+        sparql.setTransport(SlowTransport())
+        return sparql
+
+    def testStaleWhileRevalidate(self):
+        self.cache = MemoryCache(ttl=0.05, staleWhileRevalidate=60)
+        self.slowWrapper(0).query()
+        time.sleep(0.06)
+        start = time.time()
+        for _ in range(5):
+            result = self.slowWrapper(0.2).query()  # served at once, while a single query refreshes it
+            self.assertEqual(["s"], result.convert()["head"]["vars"])
+        self.assertTrue(time.time() - start < 0.2)
+        time.sleep(0.3)
+        self.assertEqual(2, len(self.transport.requests))
+        self.assertEqual(5, self.cache.getCounters()["stale"])
+
+        self.cache.staleWhileRevalidate = 0
+        time.sleep(0.06)
+        self.slowWrapper(0).query()  # not served once expired
+        self.assertEqual(5, self.cache.getCounters()["stale"])
+        self.assertEqual(3, len(self.transport.requests))
+
+    def testOversizedRefresh(self):
+        self.cache = MemoryCache(maxBytes=1000, ttl=0.05, staleWhileRevalidate=60)
+        self.wrapper().query()
+        time.sleep(0.06)
+        transport = InMemoryTransport()
+        transport.addResponse(b'{"head": {"vars": ["s"]}, "results": {"bindings": []}, "padding": "' + b"x" * 1000 + b'"}',
+                              headers={"Content-Type": "application/sparql-results+json"})
+        sparql = self.wrapper()
+        sparql.setTransport(transport)
+        sparql.query()  # served stale, while the refresh gets a response too large for the cache
+        for _ in range(50):
+            if self.cache.getCounters()["entries"] == 0:
+                break
+            time.sleep(0.01)
+        sparql.query()  # the stale entry has been removed: not served anymore
+        self.assertEqual(2, len(transport.requests))
+        self.assertEqual(1, self.cache.getCounters()["stale"])
+
+    def testStampede(self):
+        outcomes = []
+
+        def run():
+            outcomes.append(self.slowWrapper(0.1).query().convert())
+
+        threads = [threading.Thread(target=run) for _ in range(5)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(5, len(outcomes))
+        self.assertEqual(1, len(self.transport.requests))  # the other queries waited for the cache to be filled
+
+        self.assertTrue(self.cache.acquireLock("key"))
+        self.assertFalse(self.cache.acquireLock("key", blocking=False))
+        self.assertFalse(self.cache.acquireLock("key", timeout=0.01))
+        self.cache.releaseLock("key")
+        self.assertTrue(self.cache.acquireLock("key", blocking=False))
+
+    def testDiskCacheLocks(self):
+        directory = tempfile.mkdtemp()
+        try:
+            path = os.path.join(directory, "cache.sqlite")
+            first, second = DiskCache(path, lockTimeout=0.2), DiskCache(path, lockTimeout=0.2)  # eg, two processes
+            self.assertTrue(first.acquireLock("key"))
+            self.assertFalse(second.acquireLock("key", blocking=False))
+            self.assertTrue(second.acquireLock("other", blocking=False))
+            first.releaseLock("key")
+            self.assertTrue(second.acquireLock("key", blocking=False))
+            self.assertTrue(first.acquireLock("key", timeout=1))  # the lease of a dead process expires
+        finally:
+            shutil.rmtree(directory)
+
+
+class Batching_Test(unittest.TestCase):
+
+    def setUp(self):
+        self.transport = InMemoryTransport()
+        rows = [{"s": {"type": "uri", "value": "urn:b"}, "label": {"type": "literal", "value": "B"}},
+                {"s": {"type": "uri", "value": "urn:a"}, "label": {"type": "literal", "value": "A"}},
+                {"s": {"type": "uri", "value": "urn:a"}, "label": {"type": "literal", "value": u"Ä", "xml:lang": "de"}}]
+        self.transport.addResponse(json.dumps({"head": {"vars": ["s", "label"]}, "results": {"bindings": rows}}).encode("utf-8"),
+                                   headers={"Content-Type": "application/sparql-results+json"}, match="urn%3Aa")
+        self.transport.addResponse(b'{"head": {"vars": ["s", "label"]}, "results": {"bindings": []}}',
+                                   headers={"Content-Type": "application/sparql-results+json"})
+        self.query = "SELECT ?s ?label WHERE { ?s <http://www.w3.org/2000/01/rdf-schema#label> ?label }"
+
+    def wrapper(self, cls=SPARQLWrapper):
+        sparql = cls("http://example.org/batched")
+        sparql.setTransport(self.transport)
+        return sparql
+
+    def testSplit(self):
+        rows = [(IRI("urn:a"),), (IRI("urn:b"),), (IRI("urn:c"),)]
+        batches = splitBatches(self.query, ["s"], rows, maxRows=2)
+        self.assertEqual([[0, 1], [2]], [indexes for _, indexes in batches])
+        self.assertEqual("SELECT ?s ?label WHERE { VALUES ?s { <urn:a> <urn:b> } ?s <http://www.w3.org/2000/01/rdf-schema#label> ?label }",
+                         batches[0][0])
+        self.assertEqual([[0], [1], [2]], [indexes for _, indexes in splitBatches(self.query, ["s"], rows, maxLength=1)])
+        batches = splitBatches(self.query, ["l", "s"], [("a", IRI("urn:a"))])
+        self.assertTrue(' VALUES (?l ?s) { ("a" <urn:a>) } ' in batches[0][0])
+        self.assertRaises(ValueError, splitBatches, "ASK { ?s ?p ?o }", ["s"], rows)
+
+        self.assertEqual(termKey(1), termKey({"type": "typed-literal", "value": "01", "datatype": "http://www.w3.org/2001/XMLSchema#integer"}))
+        self.assertEqual(termKey(u"a"), termKey({"type": "literal", "value": "a", "datatype": "http://www.w3.org/2001/XMLSchema#string"}))
+        self.assertEqual(termKey(Literal(u"a", lang="EN")), termKey({"type": "literal", "value": "a", "xml:lang": "en"}))
+        self.assertNotEqual(termKey(u"urn:a"), termKey(IRI("urn:a")))
+
+    def testQueryBatch(self):
+        sparql = self.wrapper()
+        lookups = [{"s": IRI("urn:a")}, {"s": IRI("urn:b")}, {"s": IRI("urn:c")}, {"s": IRI("urn:a")}]
+        results = sparql.queryBatch(self.query, lookups, maxRows=2)
+        self.assertEqual(2, len(self.transport.requests))  # the duplicate lookup is sent once
+        self.assertEqual([["A", u"Ä"], ["B"], [], ["A", u"Ä"]], [[row["label"]["value"] for row in rows] for rows in results])
+        self.assertEqual([], sparql.queryBatch(self.query, []))
+        self.assertRaises(ValueError, sparql.queryBatch, self.query, [{"s": IRI("urn:a")}, {"o": IRI("urn:b")}])
+
+        results = self.wrapper(SPARQLWrapper2).queryBatch(self.query, lookups[:2])  # with Value instances
+        self.assertEqual([["A", u"Ä"], ["B"]], [[row["label"].value for row in rows] for rows in results])
+
+    def testDataLoader(self):
+        loader = DataLoader(self.wrapper(), self.query, "s", window=0.05)
+        results = {}
+
+        def run(uri):
+            results[uri] = [row["label"]["value"] for row in loader.load(IRI(uri))]
+
+        threads = [threading.Thread(target=run, args=(uri,)) for uri in ["urn:a", "urn:b", "urn:c", "urn:a"]]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(1, len(self.transport.requests))  # a single batched query
+        self.assertEqual({"urn:a": ["A", u"Ä"], "urn:b": ["B"], "urn:c": []}, results)
+        self.assertEqual([["B"], []], [[row["label"]["value"] for row in rows]
+                                       for rows in loader.loadMany([IRI("urn:b"), IRI("urn:c")])])
+        self.assertEqual(1, len(self.transport.requests))  # kept by the loader
+
+        loader.prime(IRI("urn:d"), [{"label": {"type": "literal", "value": "D"}}])
+        self.assertEqual("D", loader.load(IRI("urn:d"))[0]["label"]["value"])
+        loader.clear(IRI("urn:a"))
+        lookup = loader.loadAsync(IRI("urn:a"))
+        self.assertFalse(lookup.done())
+        self.assertEqual(2, len(lookup.result(1)))
+        self.assertEqual(2, len(self.transport.requests))
+
+        loader = DataLoader(self.wrapper(), "ASK { ?s ?p ?o }", "s", window=0)
+        self.assertRaises(ValueError, loader.load, IRI("urn:a"))
+
+
+
 class QueryResult_Test(unittest.TestCase):
 
     def testConstructor(self):